@@ -0,0 +1,115 @@
+# fake_360dialog.py
+#
+# A local stand-in for the 360dialog `messages/` and `media/` endpoints, with configurable latency, error rate
+# and rate limit.
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Fake360DialogServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit=0, port=0):
+        super().__init__(('127.0.0.1', port), Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit  # messages per second, 0 for no limit
+        self.calls = {'messages': 0, 'media': 0, 'errors': 0, 'throttled': 0}
+        self._window = (0, 0)  # (second, messages)
+        self.sent = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/"
+
+    def count(self, endpoint, error=False):
+        with self._lock:
+            self.calls[endpoint] += 1
+            if error:
+                self.calls['errors'] += 1
+
+    def throttle(self):
+        """ Count a message in the current second, return True if it is over the rate limit """
+        if not self.rate_limit:
+            return False
+        second = int(time.time())
+        with self._lock:
+            window_second, messages = self._window
+            messages = messages + 1 if window_second == second else 1
+            self._window = (second, messages)
+            if messages > self.rate_limit:
+                self.calls['throttled'] += 1
+                return True
+        return False
+
+    def reset(self):
+        with self._lock:
+            self.calls = {key: 0 for key in self.calls}
+            self.sent.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024  # write the headers and the body in one segment, flushed after each request
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _should_fail(self):
+        return self.server.error_rate and random.random() < self.server.error_rate
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.path.startswith('/v1/messages'):
+            self._reply(404, b'{}')
+            return
+        if self.server.throttle():
+            self._reply(429, json.dumps({'errors': [{'code': 429, 'title': 'Too many requests'}]}).encode(),
+                        headers={'Retry-After': f"{1 - time.time() % 1:.3f}"})
+            return
+        if self._should_fail():
+            self.server.count('messages', error=True)
+            self._reply(500, json.dumps({'errors': [{'code': 500, 'title': 'Fake error'}]}).encode())
+            return
+        self.server.count('messages')
+        self.server.sent.append(body)
+        self._reply(201, json.dumps({'messages': [{'id': f'wamid.fake{len(self.server.sent)}'}]}).encode())
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.path.startswith('/v1/media'):
+            self._reply(404, b'{}')
+            return
+        if self._should_fail():
+            self.server.count('media', error=True)
+            self._reply(500, b'{}')
+            return
+        self.server.count('media')
+        self._reply(200, b'\x89PNG fake media ' * 64, content_type='image/png')
@@ -0,0 +1,2 @@
+def set_state(user):
+    pass
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# parsers.py
+#
+# Micro-benchmark of the date/time parsers of `validate_value` against the original implementation
+# (`DATE_PATTERN` + `dateutil.parser.parse(dayfirst=True)` and `TIME_PATTERN`).
+# Checks that both accept the same inputs with the same results, then times them.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.parsers
+import itertools
+import re
+import sys
+import timeit
+
+from dateutil.parser import parse
+
+DATE_PATTERN = re.compile('^(3[01]|[12][0-9]|0?[1-9])[/.-](1[0-2]|0?[1-9])[/.-](?:20)?[0-9]{2}$')
+TIME_PATTERN = re.compile('^(?P<hours>1[0-9]|2[0-3]|0?[0-9])\\D?(?P<minutes>[1-5][0-9]|0?[0-9])$')
+
+# typical user input, valid and invalid
+DATE_SAMPLES = ['31/12/23', '1.2.2024', '05-06-99', '29/2/23', '1/2.23', '12/13/23', 'tomorrow', '3/4/2024\n']
+TIME_SAMPLES = ['9:30', '0930', '21h5', '12', '24:00', '7', 'noon', '23:59\n']
+
+
+def original_date(text):
+    if not DATE_PATTERN.match(text):
+        raise ValueError('Wrong date format')
+    return parse(text, dayfirst=True).date()
+
+
+def original_time(text):
+    m = TIME_PATTERN.match(text)
+    return m.group('hours'), m.group('minutes')
+
+
+def outcome(func, text):
+    try:
+        return func(text)
+    except Exception:
+        return None
+
+
+def date_inputs():
+    days = [str(d) for d in range(0, 33)] + [f"{d:02d}" for d in range(0, 10)]
+    months = [str(m) for m in range(0, 14)] + [f"{m:02d}" for m in range(0, 10)]
+    years = ['23', '99', '75', '76', '00', '2003', '2099', '1999', '2', '202', '20']
+    for day, month, year in itertools.product(days, months, years):
+        for sep1, sep2 in itertools.product('/.- ', repeat=2):
+            for tail in ('', '\n', ' '):
+                yield f"{day}{sep1}{month}{sep2}{year}{tail}"
+
+
+def time_inputs():
+    alphabet = '0123456789:h \n'
+    for length in range(6):
+        for chars in itertools.product(alphabet, repeat=length):
+            yield ''.join(chars)
+
+
+def check_parity(name, original, new, inputs):
+    count = 0
+    for text in inputs:
+        count += 1
+        expected = outcome(original, text)
+        got = outcome(new, text)
+        if name == 'time' and got is not None:
+            got = str(got.hour), str(got.minute)
+            expected = expected and (str(int(expected[0])), str(int(expected[1])))
+        if expected != got:
+            print(f"{name} mismatch for {text!r}: {expected!r} != {got!r}")
+            return False
+    print(f"{name}: {count} inputs, same results")
+    return True
+
+
+def report(name, original, new, samples, number=20000):
+    original_time_ = timeit.timeit(lambda: [outcome(original, text) for text in samples], number=number)
+    new_time = timeit.timeit(lambda: [outcome(new, text) for text in samples], number=number)
+    calls = number * len(samples)
+    print(f"{name}: original {original_time_ / calls * 1e6:.2f}us  new {new_time / calls * 1e6:.2f}us  "
+          f"x{original_time_ / new_time:.1f}")
+
+
+def main():
+    from whatsapp_business_api_is.parsers import parse_date, parse_time
+
+    ok = check_parity('date', original_date, parse_date, date_inputs())
+    ok = check_parity('time', original_time, parse_time, time_inputs()) and ok
+    report('date', original_date, parse_date, DATE_SAMPLES)
+    report('time', original_time, parse_time, TIME_SAMPLES)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# run.py
+#
+# End-to-end throughput benchmark of the message pipeline:
+#   views.webhook -> parse_incoming_message -> send_next_message -> (fake) 360dialog
+#
+# Usage (from the repository root):
+#   python -m benchmarks.run --users 50 --rounds 3 --latency 0.02
+#
+# The results are appended to `benchmarks/results/results.jsonl`, together with the package version,
+# and compared with the previous run that used the same parameters.
+import argparse
+import configparser
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+FIXTURE = os.path.join(BENCHMARKS_DIR, 'fixtures', 'sample_flow.json')
+RESULTS_FILE = os.path.join(BENCHMARKS_DIR, 'results', 'results.jsonl')
+
+# the texts each synthetic user sends, in order.
+# the second round starts over, and the known name/email are skipped by `get_next_message`
+CONVERSATION = ['hi', 'Dana', 'dana@example.com', 'Apple', 'red']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Whatsapp Business Api Infrastructure throughput benchmark')
+    parser.add_argument('--users', type=int, default=20, help='Number of synthetic users')
+    parser.add_argument('--rounds', type=int, default=2, help='How many times each user goes through the flow')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latency of the fake 360dialog server (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Error rate of the fake 360dialog server')
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help='Messages per second the fake 360dialog server accepts before responding 429')
+    parser.add_argument('--webhook-mode', default='inline', help='Conf.WEBHOOK_MODE (inline/batch/task)')
+    parser.add_argument('--batch-size', type=int, default=1, help='Messages per webhook payload')
+    parser.add_argument('--settings', default='{}', help='Extra WAB_IS settings, as JSON')
+    parser.add_argument('--label', default='', help='Free text saved with the results')
+    parser.add_argument('--no-save', action='store_true', help="Don't save the results")
+    return parser.parse_args()
+
+
+def boot_django(base_url, options):
+    import django
+    from django.conf import settings
+
+    settings.configure(
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": ":memory:",
+            }
+        },
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            }
+        },
+        WAB_IS={
+            "d360_base_url": base_url,
+            "d360_api_key": "benchmark",
+            "set_state": "benchmarks.hooks.set_state",
+            "webhook_mode": options.webhook_mode,
+            **json.loads(options.settings),
+        },
+        INSTALLED_APPS=(
+            "whatsapp_business_api_is",
+        ),
+        TIME_ZONE="UTC",
+        USE_TZ=True,
+    )
+    django.setup()
+
+    from celery import current_app
+    current_app.conf.task_always_eager = True
+
+    from django.core.management import call_command
+    call_command("migrate", verbosity=0)
+    call_command("loaddata", FIXTURE, verbosity=0)
+
+
+def get_version():
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT_DIR, 'setup.cfg'))
+    version = config.get('metadata', 'version', fallback='unknown')
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ''
+    return version, commit
+
+
+def generate_payloads(options):
+    """ Yield webhook payloads, the users' messages are interleaved like real traffic """
+    messages = []
+    for round_ in range(options.rounds):
+        for text in CONVERSATION:
+            for user in range(options.users):
+                messages.append({
+                    'from': f"97250{user:07d}",
+                    'id': f"wamid.bench.{round_}.{user}.{len(messages)}",
+                    'timestamp': str(int(time.time())),
+                    'type': 'text',
+                    'text': {'body': text},
+                })
+    for i in range(0, len(messages), options.batch_size):
+        yield {'contacts': [], 'messages': messages[i:i + options.batch_size]}
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run(options, server):
+    from django.db import connection
+    from django.test import RequestFactory
+
+    from whatsapp_business_api_is.views import webhook
+
+    request_factory = RequestFactory()
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    payloads = [json.dumps(payload) for payload in generate_payloads(options)]
+    message_count = sum(len(json.loads(payload)['messages']) for payload in payloads)
+
+    server.reset()
+    latencies = []
+    with connection.execute_wrapper(count_queries):
+        started = time.perf_counter()
+        for payload in payloads:
+            request = request_factory.post('/webhook', data=payload, content_type='application/json')
+            request_started = time.perf_counter()
+            webhook(request)
+            latencies.append(time.perf_counter() - request_started)
+        elapsed = time.perf_counter() - started
+
+    return {
+        'messages': message_count,
+        'elapsed': round(elapsed, 4),
+        'messages_per_sec': round(message_count / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'queries_per_message': round(queries / message_count, 2),
+        'http_calls_per_message': round((server.calls['messages'] + server.calls['media']) / message_count, 2),
+        'http_errors': server.calls['errors'],
+        'http_throttled': server.calls['throttled'],
+    }
+
+
+def load_previous(params):
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE) as f:
+        for line in f:
+            result = json.loads(line)
+            if result['params'] == params:
+                previous = result
+    return previous
+
+
+def save(result):
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+
+def report(result, previous):
+    print(f"version {result['version']} ({result['commit']})  {result['params']}")
+    for key, value in result['metrics'].items():
+        line = f"  {key:24} {value}"
+        if previous and isinstance(value, (int, float)) and previous['metrics'].get(key):
+            change = (value - previous['metrics'][key]) / previous['metrics'][key] * 100
+            line += f"  ({change:+.1f}% vs {previous['version']} {previous['commit']})"
+        print(line)
+
+
+def main():
+    sys.path.insert(0, ROOT_DIR)
+    options = parse_args()
+
+    from benchmarks.fake_360dialog import Fake360DialogServer
+    server = Fake360DialogServer(latency=options.latency, error_rate=options.error_rate,
+                                 rate_limit=options.rate_limit).start()
+    try:
+        boot_django(server.base_url, options)
+        metrics = run(options, server)
+    finally:
+        server.stop()
+
+    version, commit = get_version()
+    params = {
+        'users': options.users,
+        'rounds': options.rounds,
+        'latency': options.latency,
+        'error_rate': options.error_rate,
+        'rate_limit': options.rate_limit,
+        'webhook_mode': options.webhook_mode,
+        'batch_size': options.batch_size,
+        'settings': json.loads(options.settings),
+    }
+    result = {
+        'version': version,
+        'commit': commit,
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'label': options.label,
+        'params': params,
+        'metrics': metrics,
+    }
+    previous = load_previous(params)
+    report(result, previous)
+    if not options.no_save:
+        save(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# runtests.py
+
+import sys
+
+from django.core.management import call_command
+
+from boot_django import boot_django
+
+boot_django()
+call_command("test", *(sys.argv[1:] or ["whatsapp_business_api_is"]))
@@ -0,0 +1,70 @@
+import logging
+
+from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.flow import get_flow
+
+
+def action(mutates_user=True):
+    """
+    Declare how a function of `Functions` affects the user.
+
+    Functions declared with `mutates_user=False` don't change the WaUser row,
+    so the user is not refreshed after they run:
+    ```
+    class Functions:
+        @staticmethod
+        @action(mutates_user=False)
+        def send_report(user, msg, msg_obj=None, data=None):
+            ...
+    ```
+    Undeclared functions use `Conf.ACTIONS_MUTATE_USER_BY_DEFAULT`.
+    """
+
+    def decorator(func):
+        func.mutates_user = mutates_user
+        return func
+
+    return decorator
+
+
+def is_mutating(func):
+    return getattr(func, 'mutates_user', Conf.ACTIONS_MUTATE_USER_BY_DEFAULT)
+
+
+class ActionPipeline:
+    """
+    The actions of an IncomingMessage/OutgoingMessage, resolved to functions once:
+    first the function named after the message key (if any), then the message `actions` in order.
+    The functions are looked up in `functions` (by name), `WhatsappBusinessApiIsConfig.FUNCTIONS` by default.
+    """
+
+    def __init__(self, wab_bot_message, functions=None):
+        functions = WhatsappBusinessApiIsConfig.FUNCTIONS if functions is None else functions
+        self.steps = []
+        actions = {wab_bot_message.key: None}
+        if wab_bot_message.actions:
+            actions.update(wab_bot_message.actions)
+
+        for name, data in actions.items():
+            if func := functions.get(name, None):
+                self.steps.append((name, func, data, is_mutating(func)))
+            elif name != wab_bot_message.key:
+                logging.info("Action '%s' of %s not found", name, wab_bot_message.key)
+
+    def __bool__(self):
+        return bool(self.steps)
+
+
+def get_action_pipeline(wab_bot_message):
+    """ Return the pipeline of the message, pipelines of messages of the compiled flow are compiled only once """
+    flow = get_flow()
+    kind = type(wab_bot_message).__name__
+    if flow.get_message(wab_bot_message.key) is not wab_bot_message and \
+            flow.incoming.get(wab_bot_message.key) is not wab_bot_message:
+        return ActionPipeline(wab_bot_message)
+
+    key = ('actions', kind, wab_bot_message.key)
+    if (pipeline := flow.compiled.get(key)) is None:
+        pipeline = flow.compiled[key] = ActionPipeline(wab_bot_message)
+    return pipeline
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from whatsapp_business_api_is.models import WaUser
+from whatsapp_business_api_is.models import WaUser, Broadcast
 
 base_exclude = ['created', 'updated']
 
@@ -12,3 +12,11 @@ class WaUserAdmin(admin.ModelAdmin):
 
 
 admin.site.register(WaUser, WaUserAdmin)
+
+
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ['name', 'message', 'status', 'sent', 'failed', 'last_number', 'created', 'updated', ]
+    ordering = ['-created']
+
+
+admin.site.register(Broadcast, BroadcastAdmin)
@@ -19,6 +19,8 @@ class WhatsappBusinessApiIsConfig(AppConfig):
 
     ## set_state
     ### a function to run when the user state is changed
+    It runs once the changes of the handled message (including the new state) are written to the DB,
+    once for each state change (the user has the last state).
 
     ## FUNCTIONS
     ### a flat dictionary for all methods of `Functions` class defined in `bot_functions.py` of all registered apps
@@ -31,6 +33,17 @@ class WhatsappBusinessApiIsConfig(AppConfig):
     @msg_obj - can be either OutgoingMessage or IncomingMessage
     @data - the action's data as defined in the msg_obj
 
+    `msg_obj` (and `data`) are the objects of the compiled flow, which are shared by all the messages handled by the
+    process (see `whatsapp_business_api_is.flow.FlowGraph`), so functions must not change them: change a copy
+    (`copy.deepcopy(msg_obj)`) or load the message from the DB instead.
+
+    The same `user` object is used while handling a message, and the changes of the infrastructure
+    (state, failure_count, saved data) are written to the DB once the message is handled.
+    The user is reloaded after each function that may change the user row (through another object or with
+    `QuerySet.update()`).
+    Functions that never change the user can be declared with `@action(mutates_user=False)`
+    (`whatsapp_business_api_is.actions`), so the user is not reloaded after them.
+
     Example:
 
     An IncomingMessage object:
@@ -97,7 +110,7 @@ class WhatsappBusinessApiIsConfig(AppConfig):
     The signature for all validators must be `user, msg, msg_obj, validation_message=''`
     @user - the WaUser object
     @msg - the received user message (instance of `BaseMsg`, depend on the received message)
-    @msg_obj - can be either OutgoingMessage or IncomingMessage
+    @msg_obj - can be either OutgoingMessage or IncomingMessage (shared and read only, like the one of FUNCTIONS)
     @validation_message - custom text to be sent to the user in case of validation e
 
     In case of validation error the method should call `raise ValidationError(validation_message, params={'custom_message': True})`
@@ -113,6 +126,10 @@ class WhatsappBusinessApiIsConfig(AppConfig):
     set_state = None
 
     def ready(self):
+        if Conf.STRUCTURED_LOGGING:
+            from whatsapp_business_api_is.logs import setup_logging
+            setup_logging()
+
         try:
             WhatsappBusinessApiIsConfig.incoming_parser = import_string(Conf.INCOMING_PARSER)
             assert callable(WhatsappBusinessApiIsConfig.incoming_parser)
@@ -150,5 +167,11 @@ class WhatsappBusinessApiIsConfig(AppConfig):
             except ImportError:
                 pass
 
+        cache_backend = settings.CACHES.get(Conf.CACHE_ALIAS, {}).get('BACKEND', '')
+        if cache_backend.endswith('LocMemCache'):
+            logging.warning("Conf.CACHE_ALIAS '%s' is %s, which is not shared between processes: flow changes reach "
+                            "the other processes only when they restart, and the user locks, dedup and rate limit "
+                            "are per process", Conf.CACHE_ALIAS, cache_backend)
+
         logging.debug("\n\n[Functions]\n  . " + '\n  . '.join(self.FUNCTIONS.keys()))
         logging.debug("\n\n[validators]\n  . " + '\n  . '.join(self.VALIDATORS.keys()))
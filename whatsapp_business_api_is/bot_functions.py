@@ -1,13 +1,16 @@
+from whatsapp_business_api_is.actions import action
 from whatsapp_business_api_is.utils import set_data
 
 
 class Functions:
 
     @staticmethod
+    @action(mutates_user=False)
     def do_nothing(*args, **kwargs):
         pass
 
     @staticmethod
+    @action(mutates_user=True)
     def save_data(user, msg, msg_obj=None, data=None):
         try:
             set_data(user, data, msg)
@@ -15,5 +18,6 @@ class Functions:
             print(f" Failed to save data: {e}")
 
     @staticmethod
+    @action(mutates_user=False)
     def get_current_user(user, msg, msg_obj=None, data=None):
         return user
@@ -0,0 +1,122 @@
+import hashlib
+import logging
+from concurrent.futures import wait
+
+from django.db.models import F
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.dispatcher import get_dispatcher
+from whatsapp_business_api_is.messages import get_template_message_data, post_message
+from whatsapp_business_api_is.models import Broadcast, WaUser, BROADCAST_DONE
+from whatsapp_business_api_is.render import get_render_plan
+
+
+def iter_chunks(users, chunk_size, last_number=None):
+    """ Yield the users in chunks ordered by number, each chunk is a separate (keyset paginated) query """
+    users = users.order_by('number')
+    while True:
+        chunk = list(users.filter(number__gt=last_number)[:chunk_size] if last_number else users[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_number = chunk[-1].number
+
+
+def send_chunk(message, users):
+    """ Render the template for all the users together and send it concurrently, return the numbers that got it """
+    plan = get_render_plan(message, 'template')
+    dispatcher = get_dispatcher()
+    futures = {}
+    for user, components in zip(users, plan.render_many(users)):
+        data = get_template_message_data(user.number, message.template_name, components)
+        futures[dispatcher.submit(user.number, post_message, data)] = user.number
+    wait(futures)
+
+    sent = []
+    for future, number in futures.items():
+        if future.exception():
+            logging.error("Failed to broadcast %s to %s: %s", message.key, number, future.exception())
+        else:
+            sent.append(number)
+    return sent
+
+
+def get_broadcast_name(message, users):
+    """ The default name of a broadcast: the message and a hash of the users query """
+    digest = hashlib.sha1(str(users.query).encode()).hexdigest()[:16]
+    return f"{message.key[:83]}-{digest}"
+
+
+def broadcast(message, users=None, name=None, filters=None, chunk_size=None):
+    """
+    Send a template message to many users.
+
+    The users (a `WaUser` queryset, or the `filters` of one) are read in chunks of `Conf.BROADCAST_CHUNK_SIZE`,
+    the variables of each chunk are resolved together and the messages are sent concurrently by the dispatcher,
+    within the rate limit of `whatsapp_business_api_is.ratelimit`.
+    The progress is saved in a `Broadcast` after each chunk, so calling `broadcast` again with the same `name`
+    (and users) continues from the last completed chunk. Without a name, the name is derived from the users query.
+    Only broadcasts of `filters` can be resumed by the management command, the filters of a queryset are not saved.
+    Like `send_message`, the `failure_count` of the users who got the message is reset, in one query per chunk.
+    The state of the users is not changed.
+    The numbers of the users the message failed for are saved in `Broadcast.failed_numbers`,
+    to send it to them again with `resend_failed`.
+    """
+    if users is None:
+        users = WaUser.objects.filter(**(filters or {}))
+        filters = filters or {}
+    chunk_size = chunk_size or Conf.BROADCAST_CHUNK_SIZE
+    name = name or get_broadcast_name(message, users)
+
+    campaign, created = Broadcast.objects.get_or_create(name=name, defaults={'message': message,
+                                                                             'filters': filters})
+    if campaign.status == BROADCAST_DONE:
+        logging.info("Broadcast %s is already done", name)
+        return campaign
+    if not created:
+        logging.info("Resuming broadcast %s after %s (sent=%s failed=%s)",
+                     name, campaign.last_number, campaign.sent, campaign.failed)
+
+    for chunk in iter_chunks(users, chunk_size, campaign.last_number):
+        sent = send_chunk(message, chunk)
+        WaUser.objects.filter(number__in=sent).update(failure_count=0)
+        sent_numbers = set(sent)
+        campaign.failed_numbers.extend(user.number for user in chunk if user.number not in sent_numbers)
+        campaign.last_number = chunk[-1].number
+        Broadcast.objects.filter(pk=campaign.pk).update(last_number=campaign.last_number,
+                                                        sent=F('sent') + len(sent),
+                                                        failed=F('failed') + len(chunk) - len(sent),
+                                                        failed_numbers=campaign.failed_numbers)
+        logging.info("Broadcast %s: sent %s/%s up to %s", name, len(sent), len(chunk), campaign.last_number)
+
+    Broadcast.objects.filter(pk=campaign.pk).update(status=BROADCAST_DONE)
+    campaign.refresh_from_db()
+    logging.info("Broadcast %s is done (sent=%s failed=%s)", name, campaign.sent, campaign.failed)
+    return campaign
+
+
+def resend_failed(campaign, chunk_size=None):
+    """
+    Send the message of a broadcast again to the users it failed for, in chunks like `broadcast`.
+    The progress is saved after each chunk, the users it fails for again are kept in `Broadcast.failed_numbers`
+    (with the users that were deleted since) for the next call.
+    """
+    chunk_size = chunk_size or Conf.BROADCAST_CHUNK_SIZE
+    numbers = list(campaign.failed_numbers)
+    still_failed = []
+    for i in range(0, len(numbers), chunk_size):
+        chunk_numbers = numbers[i:i + chunk_size]
+        chunk = list(WaUser.objects.filter(number__in=chunk_numbers).order_by('number'))
+        sent = send_chunk(campaign.message, chunk) if chunk else []
+        WaUser.objects.filter(number__in=sent).update(failure_count=0)
+        sent_numbers = set(sent)
+        still_failed.extend(number for number in chunk_numbers if number not in sent_numbers)
+        campaign.failed_numbers = still_failed + numbers[i + chunk_size:]
+        Broadcast.objects.filter(pk=campaign.pk).update(sent=F('sent') + len(sent),
+                                                        failed=F('failed') - len(sent),
+                                                        failed_numbers=campaign.failed_numbers)
+        logging.info("Broadcast %s: sent again %s/%s", campaign.name, len(sent), len(chunk_numbers))
+
+    campaign.refresh_from_db()
+    logging.info("Broadcast %s: sent again (sent=%s failed=%s)", campaign.name, campaign.sent, campaign.failed)
+    return campaign
@@ -0,0 +1,61 @@
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from whatsapp_business_api_is.conf import Conf
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+
+def _create_session():
+    retry = Retry(total=Conf.HTTP_RETRIES,
+                  backoff_factor=Conf.HTTP_RETRY_BACKOFF,
+                  status_forcelist=Conf.HTTP_RETRY_STATUSES,
+                  respect_retry_after_header=True,
+                  raise_on_status=False)  # the caller checks the status code
+    # a connection for each thread of the dispatcher (used by broadcasts)
+    pool_size = max(Conf.HTTP_POOL_SIZE, Conf.DISPATCHER_CONCURRENCY)
+    adapter = HTTPAdapter(pool_connections=Conf.HTTP_POOL_CONNECTIONS,
+                          pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    logging.debug("Created HTTP session with pool size %s for pid %s", pool_size, os.getpid())
+    return session
+
+
+def get_session():
+    """
+    Return the HTTP session of the current process.
+
+    The session keeps its connections alive, so all the requests of the process (including different Celery tasks)
+    reuse the same sockets. A new session is created after a fork, as sockets must not be shared between processes.
+    """
+    global _session, _session_pid
+
+    if _session is None or _session_pid != os.getpid():
+        with _lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = _create_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault('timeout', (Conf.HTTP_CONNECT_TIMEOUT, Conf.HTTP_READ_TIMEOUT))
+    return get_session().request(method, url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
@@ -0,0 +1,78 @@
+import json
+import logging
+
+from kombu.serialization import register
+
+from whatsapp_business_api_is.conf import Conf
+
+SERIALIZER_NAME = 'wab_is_json'
+SERIALIZER_CONTENT_TYPE = 'application/x-wab-is-json'
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonCodec:
+    """ The standard library codec """
+
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj):
+        """ Return the JSON as str, values that are not JSON raise TypeError """
+        return json.dumps(obj)
+
+    def dumpb(self, obj):
+        """ Return the JSON as UTF-8 bytes, ready to be written to an HTTP body """
+        return json.dumps(obj).encode()
+
+
+class OrjsonCodec:
+    """
+    orjson, which parses from and serializes straight to bytes.
+    Datetimes and dataclasses raise TypeError, like with the standard library codec.
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        self.option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, option=self.option).decode()
+
+    def dumpb(self, obj):
+        return orjson.dumps(obj, option=self.option)
+
+
+CODECS = {
+    'json': JsonCodec,
+    'orjson': OrjsonCodec,
+}
+
+
+def _create_codec():
+    name = Conf.JSON_CODEC
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    elif name == 'orjson' and orjson is None:
+        logging.warning("Conf.JSON_CODEC is orjson, but orjson is not installed, using json")
+        name = 'json'
+    return CODECS[name]()
+
+
+codec = _create_codec()
+loads = codec.loads
+dumps = codec.dumps
+dumpb = codec.dumpb
+
+# a Celery serializer with the same codec, see `Conf.TASK_SERIALIZER`.
+# Like the Celery json serializer, task arguments that are not JSON fail the call
+register(SERIALIZER_NAME, dumpb, loads, content_type=SERIALIZER_CONTENT_TYPE, content_encoding='binary')
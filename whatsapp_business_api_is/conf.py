@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 from django.conf import settings
 
 
@@ -34,3 +37,164 @@ class Conf:
     TEMPLATE_LANG_CODE = conf.get("template_lang_code", "he")
 
     RESEND_ON_WRONG = conf.get("resend_on_wrong", 0)
+
+    # the cache shared by all the processes: the flow version (see `whatsapp_business_api_is.flow`), the user locks,
+    # the dedup keys and the rate limit live there. Django's default (LocMemCache) is local to each process, so a flow
+    # change reaches the other processes only when they restart, use Redis or Memcached with more than one process
+    CACHE_ALIAS = conf.get("cache_alias", "default")
+
+    FLOW_CACHE_CHECK_INTERVAL = conf.get("flow_cache_check_interval", 5)
+
+    HTTP_POOL_CONNECTIONS = conf.get("http_pool_connections", 4)
+
+    HTTP_POOL_SIZE = conf.get("http_pool_size", 10)
+
+    HTTP_CONNECT_TIMEOUT = conf.get("http_connect_timeout", 5)
+
+    HTTP_READ_TIMEOUT = conf.get("http_read_timeout", 30)
+
+    HTTP_RETRIES = conf.get("http_retries", 3)
+
+    HTTP_RETRY_BACKOFF = conf.get("http_retry_backoff", 0.5)
+
+    HTTP_RETRY_STATUSES = conf.get("http_retry_statuses", (502, 503, 504))
+
+    # the dispatcher (`whatsapp_business_api_is.dispatcher`) sends the messages of broadcasts concurrently
+    DISPATCHER_CONCURRENCY = conf.get("dispatcher_concurrency", 32)
+
+    DISPATCHER_SHUTDOWN_TIMEOUT = conf.get("dispatcher_shutdown_timeout", 30)
+
+    # how the webhook hands messages to the incoming parser: 'task' (a task per message),
+    # 'batch' (a single task for all the messages of the webhook) or 'inline' (no broker)
+    WEBHOOK_MODE = conf.get("webhook_mode", "task")
+
+    # serve the webhook with an async view, for ASGI deployments
+    ASYNC_WEBHOOK = conf.get("async_webhook", False)
+
+    # normalizations applied to the user text and to the `user_start` patterns before matching them,
+    # any of 'unicode' (NFKC), 'nbsp', 'whitespace' and 'case'.
+    # The patterns are matched exactly in memory (see `FlowGraph.match_start`), unlike the DB lookup they replaced,
+    # which was case-insensitive with the default MySQL collations: add 'case' (and 'whitespace' for the trailing
+    # spaces of the PAD SPACE collations) to keep matching like MySQL
+    START_PATTERN_NORMALIZATION = conf.get("start_pattern_normalization", [])
+
+    # hash the users on a fixed number of queues (see `whatsapp_business_api_is.routing`), 0 to disable
+    USER_QUEUES = conf.get("user_queues", 0)
+
+    USER_QUEUE_PREFIX = conf.get("user_queue_prefix", "wab_is_user_")
+
+    # lock each user while a task handles it, 0 to disable (mutual exclusion only, the order of the user's messages
+    # is kept by `Conf.USER_QUEUES`).
+    # The lock is not renewed, so it must be longer than the longest task: a task may wait `RATE_LIMIT_WAIT` seconds
+    # for the rate limiter and `SEND_RETRY_MAX_WAIT` seconds for each in-place retry (`SEND_RETRIES`), for each message
+    # it sends
+    USER_LOCK_TIMEOUT = conf.get("user_lock_timeout", 0)
+
+    USER_LOCK_WAIT = conf.get("user_lock_wait", 10)
+
+    USER_LOCK_POLL_INTERVAL = conf.get("user_lock_poll_interval", 0.05)
+
+    # how many times (with exponential backoff) a task is retried while its user is locked, before its message is
+    # dropped (and logged)
+    USER_LOCK_RETRIES = conf.get("user_lock_retries", 10)
+
+    METRICS_ENABLED = conf.get("metrics_enabled", False)
+
+    # the part of the inbound messages that are measured
+    METRICS_SAMPLE_RATE = conf.get("metrics_sample_rate", 0.1)
+
+    # seconds between the publishing of each process' metrics to the cache, for the metrics endpoint of all the
+    # processes (see `whatsapp_business_api_is.metrics.publish`), 0 for an endpoint with the metrics of its process only
+    METRICS_PUBLISH_INTERVAL = conf.get("metrics_publish_interval", 10)
+
+    METRICS_PUBLISH_TTL = conf.get("metrics_publish_ttl", 10 * 60)
+
+    # the bearer token of the metrics endpoint (`Authorization: Bearer <token>`), the endpoint is disabled without it
+    METRICS_TOKEN = conf.get("metrics_token", None)
+
+    # log through a queue with the context, sampling and redaction filters of `whatsapp_business_api_is.logs`
+    STRUCTURED_LOGGING = conf.get("structured_logging", False)
+
+    LOG_SAMPLE_RATES = conf.get("log_sample_rates", {})
+
+    LOG_REDACTED_HEADERS = conf.get("log_redacted_headers", ['d360-api-key', 'authorization'])
+
+    # whether functions without an `@action(mutates_user=...)` declaration may change the user
+    ACTIONS_MUTATE_USER_BY_DEFAULT = conf.get("actions_mutate_user_by_default", True)
+
+    # the cache of the downloaded media (see `whatsapp_business_api_is.media`)
+    MEDIA_STORAGE = conf.get("media_storage", "django.core.files.storage.FileSystemStorage")
+
+    MEDIA_STORAGE_OPTIONS = conf.get("media_storage_options",
+                                     {'location': os.path.join(tempfile.gettempdir(), 'wab_is_media')})
+
+    # bytes, 0 for no limit
+    MEDIA_CACHE_MAX_SIZE = conf.get("media_cache_max_size", 512 * 1024 * 1024)
+
+    MEDIA_CHUNK_SIZE = conf.get("media_chunk_size", 64 * 1024)
+
+    # seconds between scans of the media cache size, when this process didn't fill it (see `media.evict_media`)
+    MEDIA_EVICT_INTERVAL = conf.get("media_evict_interval", 300)
+
+    # the provider's limit of outbound messages per second (see `whatsapp_business_api_is.ratelimit`), 0 to disable
+    RATE_LIMIT = conf.get("rate_limit", 0)
+
+    # use "whatsapp_business_api_is.ratelimit.CacheBackend" to share the limit between the worker processes
+    RATE_LIMIT_BACKEND = conf.get("rate_limit_backend", "whatsapp_business_api_is.ratelimit.LocalBackend")
+
+    RATE_LIMIT_BURST = conf.get("rate_limit_burst", 10)
+
+    RATE_LIMIT_MIN = conf.get("rate_limit_min", 1)
+
+    RATE_LIMIT_DECREASE = conf.get("rate_limit_decrease", 0.5)
+
+    RATE_LIMIT_INCREASE = conf.get("rate_limit_increase", 1)
+
+    # seconds to wait for the rate limiter before raising `ThrottledException`
+    RATE_LIMIT_WAIT = conf.get("rate_limit_wait", 30)
+
+    # how many times a message is sent again after a 429 (or 5xx with a Retry-After) response, with exponential backoff
+    SEND_RETRIES = conf.get("send_retries", 3)
+
+    SEND_RETRY_BACKOFF = conf.get("send_retry_backoff", 1)
+
+    # the longest wait (seconds) for sending again in place, longer waits are retried by the task with a countdown.
+    # With `WEBHOOK_MODE='task'` the user's next messages that are already enqueued are handled before the reply is
+    # sent again (against the state before the reply), the `batch` mode enqueues them after it and the `inline` mode
+    # (without a broker) drops the reply.
+    SEND_RETRY_MAX_WAIT = conf.get("send_retry_max_wait", 5)
+
+    # users per query of a broadcast (see `whatsapp_business_api_is.broadcast`)
+    BROADCAST_CHUNK_SIZE = conf.get("broadcast_chunk_size", 500)
+
+    # drop webhook messages with an id that was already received (see `whatsapp_business_api_is.dedup`)
+    DEDUP_ENABLED = conf.get("dedup_enabled", True)
+
+    # seconds
+    DEDUP_TTL = conf.get("dedup_ttl", 24 * 60 * 60)
+
+    DEDUP_LRU_SIZE = conf.get("dedup_lru_size", 10000)
+
+    # how status callbacks (sent/delivered/read/failed) are saved (see `whatsapp_business_api_is.statuses`):
+    # "buffer" writes them in batches of `STATUS_BATCH_SIZE` (or every `STATUS_FLUSH_INTERVAL` seconds) from the web
+    # process, in a transaction per batch, but the statuses still in memory are lost if the process dies;
+    # "task" saves them durably, but with a task and a transaction per webhook, which usually holds a single status;
+    # None ignores them
+    STATUS_INGESTION = conf.get("status_ingestion", "buffer")
+
+    STATUS_BATCH_SIZE = conf.get("status_batch_size", 500)
+
+    # seconds
+    STATUS_FLUSH_INTERVAL = conf.get("status_flush_interval", 2)
+
+    # the JSON library of the webhook, the outbound messages and the tasks: "auto" (orjson if installed), "orjson"
+    # or "json" (see `whatsapp_business_api_is.codec`)
+    JSON_CODEC = conf.get("json_codec", "auto")
+
+    # the serializer of the package tasks, e.g. "wab_is_json" for `Conf.JSON_CODEC` (add it to the Celery
+    # `accept_content` of the workers), None for the Celery default
+    TASK_SERIALIZER = conf.get("task_serializer", None)
+
+    # a flow artifact written by the `compile_flow` command, loaded instead of the messages in the DB
+    # (changes of the messages in the DB are ignored until a new artifact is deployed)
+    FLOW_ARTIFACT = conf.get("flow_artifact", None)
@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from whatsapp_business_api_is.conf import Conf
+
+SEEN_CACHE_KEY = 'wab_is:seen:{id}'
+
+
+class LRU:
+    """ A bounded set of keys that expire after `ttl` seconds, the least recently added are dropped first """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """ Add the key, return False if it is already in the set """
+        now = time.monotonic()
+        with self._lock:
+            expires = self.keys.get(key)
+            if expires is not None and expires > now:
+                return False
+            self.keys[key] = now + self.ttl
+            self.keys.move_to_end(key)
+            while len(self.keys) > self.size:
+                self.keys.popitem(last=False)
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self.keys.pop(key, None)
+
+
+_seen = None
+_lock = threading.Lock()
+
+
+def _get_seen():
+    global _seen
+
+    if _seen is None:
+        with _lock:
+            if _seen is None:
+                _seen = LRU(Conf.DEDUP_LRU_SIZE, Conf.DEDUP_TTL)
+    return _seen
+
+
+def is_new(message_id):
+    """
+    Mark the message id as seen, return False if it was already seen.
+
+    The ids are checked in a process local LRU first, and then in the cache (`Conf.CACHE_ALIAS`),
+    which is shared by all the web processes and expires the ids after `Conf.DEDUP_TTL` seconds.
+    The id is not marked when the cache fails, so the provider's redelivery is handled.
+    """
+    seen = _get_seen()
+    if not seen.add(message_id):
+        return False
+    try:
+        return caches[Conf.CACHE_ALIAS].add(SEEN_CACHE_KEY.format(id=message_id), 1, Conf.DEDUP_TTL)
+    except Exception:
+        seen.discard(message_id)
+        raise
+
+
+def get_message_id(message):
+    return message.get('id')
+
+
+def forget_messages(messages, key=get_message_id):
+    """
+    Mark the messages as not seen, for messages that were not handled after all.
+    Never raises: when the cache fails the ids are only dropped from the LRU (and expire from the cache
+    after `Conf.DEDUP_TTL` seconds).
+    """
+    if not Conf.DEDUP_ENABLED:
+        return
+    message_ids = [message_id for message in messages if (message_id := key(message)) is not None]
+    seen = _get_seen()
+    for message_id in message_ids:
+        seen.discard(message_id)
+    try:
+        caches[Conf.CACHE_ALIAS].delete_many([SEEN_CACHE_KEY.format(id=message_id) for message_id in message_ids])
+    except Exception:
+        logging.exception("Failed to forget the messages %s", message_ids)
+
+
+def drop_duplicates(messages, key=get_message_id):
+    """
+    Return the messages that were not seen before (messages without an id are always new).
+    When the check fails, the messages marked before the error are forgotten and the error is raised.
+    """
+    if not Conf.DEDUP_ENABLED:
+        return messages
+    new_messages = []
+    try:
+        for message in messages:
+            if (message_id := key(message)) is None or is_new(message_id):
+                new_messages.append(message)
+            else:
+                logging.info("Dropping duplicate message %s", message_id)
+    except Exception:
+        forget_messages(new_messages, key)  # let the provider redeliver them
+        raise
+    return new_messages
@@ -0,0 +1,94 @@
+import asyncio
+import atexit
+import collections
+import concurrent.futures
+import logging
+import os
+import threading
+
+from whatsapp_business_api_is.conf import Conf
+
+
+class Dispatcher:
+    """
+    Run blocking jobs (like sending a message) on a background asyncio loop.
+
+    Jobs of different keys run concurrently (up to `concurrency` at the same time),
+    while jobs of the same key (the user number) run one after the other, in the order they were submitted.
+    """
+
+    def __init__(self, concurrency):
+        self._loop = asyncio.new_event_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency,
+                                                               thread_name_prefix='wab-is-dispatcher')
+        self._queues = {}  # accessed only from the loop thread
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='wab-is-dispatcher-loop', daemon=True)
+        self._thread.start()
+
+    def submit(self, key, func, *args):
+        """
+        Schedule `func(*args)` after all the jobs previously submitted with the same key.
+        Return a `concurrent.futures.Future` with the result of the job.
+        """
+        future = concurrent.futures.Future()
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        self._loop.call_soon_threadsafe(self._enqueue, key, future, func, args)
+        return future
+
+    def _discard(self, future):
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def _enqueue(self, key, future, func, args):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = collections.deque()
+            self._loop.create_task(self._drain(key, queue))
+        queue.append((future, func, args))
+
+    async def _drain(self, key, queue):
+        while queue:
+            future, func, args = queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = await self._loop.run_in_executor(self._executor, func, *args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        del self._queues[key]
+
+    def wait(self, timeout=None):
+        """ Wait for all the submitted jobs to finish """
+        with self._pending_lock:
+            pending = list(self._pending)
+        concurrent.futures.wait(pending, timeout=timeout)
+
+    def close(self, timeout=None):
+        self.wait(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._executor.shutdown(wait=False)
+
+
+_dispatcher = None
+_dispatcher_pid = None
+_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """ Return the dispatcher of the current process, a new one is started after a fork """
+    global _dispatcher, _dispatcher_pid
+
+    if _dispatcher is None or _dispatcher_pid != os.getpid():
+        with _lock:
+            if _dispatcher is None or _dispatcher_pid != os.getpid():
+                logging.debug("Starting dispatcher for pid %s", os.getpid())
+                _dispatcher = Dispatcher(Conf.DISPATCHER_CONCURRENCY)
+                _dispatcher_pid = os.getpid()
+                atexit.register(_dispatcher.close, Conf.DISPATCHER_SHUTDOWN_TIMEOUT)
+    return _dispatcher
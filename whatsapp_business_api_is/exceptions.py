@@ -4,3 +4,61 @@ class RetryMessageException(Exception):
 
 class StopMessageException(Exception):
     pass
+
+
+class UserLockedException(Exception):
+    pass
+
+
+class SendMessageException(Exception):
+    """ The provider rejected a message, `retryable` errors may succeed if the message is sent again later """
+
+    def __init__(self, status_code, error, retry_after=None):
+        super().__init__(status_code, error, retry_after)  # all the arguments, so the exception can be pickled
+        self.status_code = status_code
+        self.error = error
+        self.retry_after = retry_after  # seconds, as asked by the provider
+
+    def __str__(self):
+        return str(self.error)
+
+    @property
+    def retryable(self):
+        # other server errors may come after the message was sent, and sending it again would duplicate it
+        return self.status_code == 429 or (self.status_code >= 500 and self.retry_after is not None)
+
+
+class ReplyFailedException(Exception):
+    """
+    A retryable error (`error`) sending `reply_message` to the user,
+    the reply and the messages after it can be sent again later (see `whatsapp_business_api_is.tasks.send_reply_later`)
+    """
+
+    def __init__(self, error, number, msg, incoming_message, reply_message):
+        super().__init__(error, number, msg, incoming_message, reply_message)
+        self.error = error
+        self.number = number
+        self.msg = msg
+        self.incoming_message = incoming_message
+        self.reply_message = reply_message
+
+    def __str__(self):
+        return f"Failed to send {self.reply_message.key} to {self.number}: {self.error}"
+
+
+class RateLimitedException(SendMessageException):
+    """ The provider rate limit was exceeded (HTTP 429) """
+    pass
+
+
+class ThrottledException(Exception):
+    """ The local rate limiter had no capacity for the message in time """
+
+    retryable = True  # the message was not sent
+
+    def __init__(self, message, retry_after):
+        super().__init__(message, retry_after)
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return self.args[0]
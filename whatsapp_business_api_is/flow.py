@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+import unicodedata
+
+from django.core.cache import caches
+from django.db import transaction
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.models import OutgoingMessage, IncomingMessage, TYPE_QUICK_REPLY, TYPE_CHOICES, \
+    TYPE_USER_START
+
+FLOW_VERSION_CACHE_KEY = 'wab_is:flow_version'
+
+PATTERN_NORMALIZERS = {
+    'unicode': lambda text: unicodedata.normalize('NFKC', text),
+    'nbsp': lambda text: text.replace(u'\xa0', u' '),
+    'whitespace': lambda text: ' '.join(text.split()),
+    'case': lambda text: text.casefold(),
+}
+
+
+def normalize_pattern(text):
+    """ Normalize a start message pattern (or a user text) by `Conf.START_PATTERN_NORMALIZATION` """
+    for name in Conf.START_PATTERN_NORMALIZATION:
+        text = PATTERN_NORMALIZERS[name](text)
+    return text
+
+
+class FlowGraph:
+    """
+    A process local, compiled copy of the conversation flow (all `OutgoingMessage` and `IncomingMessage` objects).
+
+    The messages are loaded once and linked to each other (`next_message`, `message`, `reply`),
+    so walking the flow doesn't hit the DB.
+    The objects are shared between all the tasks of the process and must be treated as read only,
+    also by the FUNCTIONS and VALIDATORS they are passed to as `msg_obj`.
+    Other processes see a change of the flow through the version in the shared cache (`Conf.CACHE_ALIAS`).
+    """
+
+    def __init__(self, outgoing_messages, incoming_messages, version=None, tables=None):
+        self.version = version
+        self.digest = None  # the digest of the artifact the flow was loaded from
+        self.messages = {message.key: message for message in outgoing_messages}
+        self.incoming = {message.key: message for message in incoming_messages}
+        self.responses = {key: [] for key in self.messages}
+
+        for message in self.messages.values():
+            if message.next_message_id is not None:
+                message.next_message = self.messages.get(message.next_message_id)
+
+        # same order as `message.responses.first()`, which is ordered by pk
+        for incoming_message in sorted(self.incoming.values(), key=lambda m: m.key):
+            if incoming_message.message_id is not None:
+                incoming_message.message = self.messages.get(incoming_message.message_id)
+                self.responses.setdefault(incoming_message.message_id, []).append(incoming_message)
+            if incoming_message.reply_id is not None:
+                incoming_message.reply = self.messages.get(incoming_message.reply_id)
+
+        self.response_keys = {key: {response.key: response for response in responses}
+                              for key, responses in self.responses.items()}
+        if tables is None:
+            self._build_tables()
+        else:  # the tables of a compiled artifact (see `whatsapp_business_api_is.flow_compiler`)
+            self._load_tables(tables)
+
+        # objects compiled from the flow on demand (like render plans), dropped together with the flow
+        self.compiled = {}
+
+    def _build_tables(self):
+        self.default_responses = {key: min(responses, key=lambda r: not r.is_default)
+                                  for key, responses in self.responses.items() if responses}
+
+        # same as `IncomingMessage.objects.filter(type=TYPE_USER_START, pattern=pattern).first()` with a binary
+        # collation, see `Conf.START_PATTERN_NORMALIZATION`
+        self.start_messages = {}
+        for incoming_message in sorted(self.incoming.values(), key=lambda m: m.key):
+            if incoming_message.type == TYPE_USER_START and incoming_message.pattern is not None:
+                self.start_messages.setdefault(normalize_pattern(incoming_message.pattern), incoming_message)
+
+        # lookup tables for matching the user reply to a response of the current state
+        self.buttons = {}
+        self.choices = {}
+        for message in self.messages.values():
+            if message.type == TYPE_QUICK_REPLY and message.quick_reply:
+                buttons = self.buttons[message.key] = {}
+                for reply in message.quick_reply:
+                    button_key, button_text = next(iter(reply.items()))
+                    buttons.setdefault(button_text, button_key)
+            elif message.type == TYPE_CHOICES:
+                choice_key_prefix = f"{message.key}_resp_"
+                choices = self.choices[message.key] = {}
+                for response in self.responses.get(message.key, []):
+                    if response.key.startswith(choice_key_prefix):
+                        choices.setdefault(response.pattern, response)
+
+    def _load_tables(self, tables):
+        """ Link the tables (of message keys) to the messages """
+        incoming = self.incoming
+        self.default_responses = {key: incoming[response_key]
+                                  for key, response_key in tables['default_responses'].items()}
+        self.start_messages = {pattern: incoming[key] for pattern, key in tables['start_messages'].items()}
+        self.buttons = tables['buttons']
+        self.choices = {key: {pattern: incoming[response_key] for pattern, response_key in choices.items()}
+                        for key, choices in tables['choices'].items()}
+
+    @classmethod
+    def load(cls, version=None):
+        if Conf.FLOW_ARTIFACT:
+            from whatsapp_business_api_is.flow_compiler import load_artifact
+            return load_artifact(Conf.FLOW_ARTIFACT, version)
+        return cls(OutgoingMessage.objects.all(), IncomingMessage.objects.all(), version)
+
+    def get_message(self, key):
+        return self.messages.get(key)
+
+    def require_message(self, key):
+        try:
+            return self.messages[key]
+        except KeyError:
+            raise OutgoingMessage.DoesNotExist(f"OutgoingMessage '{key}' does not exist")
+
+    def get_responses(self, message):
+        return self.responses.get(message.key, [])
+
+    def get_response(self, message, key):
+        return self.response_keys.get(message.key, {}).get(key)
+
+    def match_start(self, text):
+        """ The `user_start` message of the text, matched exactly after `Conf.START_PATTERN_NORMALIZATION` """
+        return self.start_messages.get(normalize_pattern(text))
+
+    def match_button(self, message, text):
+        """ Return the key of the quick reply button of the message with the given text """
+        return self.buttons.get(message.key, {}).get(text)
+
+    def match_choice(self, message, text):
+        """ Return the response of the choice matching the text, or the default choice response """
+        if text and (response := self.choices.get(message.key, {}).get(text)):
+            return response
+        return self.get_response(message, f"{message.key}_resp__default_choice")
+
+    def get_default_response(self, message):
+        """ same as `message.responses.order_by('-is_default').first()` """
+        return self.default_responses.get(message.key)
+
+
+_flow = None
+_local_version = 0
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _get_shared_version():
+    return caches[Conf.CACHE_ALIAS].get(FLOW_VERSION_CACHE_KEY, 0)
+
+
+def _bump_shared_version():
+    cache = caches[Conf.CACHE_ALIAS]
+    cache.add(FLOW_VERSION_CACHE_KEY, 0, None)
+    try:
+        cache.incr(FLOW_VERSION_CACHE_KEY)
+    except ValueError:  # the key was evicted between `add` and `incr`
+        cache.set(FLOW_VERSION_CACHE_KEY, 1, None)
+
+
+def get_flow():
+    """
+    Return the compiled flow of this process.
+
+    The flow is recompiled when a message was saved in this process (local version),
+    or when another process bumped the shared version in the cache.
+    The shared version is checked at most once every `Conf.FLOW_CACHE_CHECK_INTERVAL` seconds.
+    """
+    global _flow, _checked_at
+
+    flow = _flow
+    if flow is not None and flow.version[0] == _local_version:
+        now = time.monotonic()
+        if now - _checked_at < Conf.FLOW_CACHE_CHECK_INTERVAL:
+            return flow
+        _checked_at = now
+        if flow.version[1] == _get_shared_version():
+            return flow
+
+    with _lock:
+        version = (_local_version, _get_shared_version())
+        if _flow is None or _flow.version != version:
+            logging.info("Compiling flow version=%s", version)
+            _flow = FlowGraph.load(version)
+            _checked_at = time.monotonic()
+        return _flow
+
+
+def invalidate_flow():
+    global _local_version
+    _local_version += 1
+    transaction.on_commit(_bump_shared_version)
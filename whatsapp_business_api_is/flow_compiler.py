@@ -0,0 +1,274 @@
+"""
+Static checks of the flow, and the compiled flow artifact that workers load instead of the DB (`Conf.FLOW_ARTIFACT`).
+"""
+import datetime
+import hashlib
+import importlib
+import json
+import logging
+
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError
+
+from whatsapp_business_api_is.actions import ActionPipeline
+from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.flow import FlowGraph
+from whatsapp_business_api_is.models import OutgoingMessage, TYPE_MEDIA, TYPE_QUICK_REPLY, TYPE_USER_START
+from whatsapp_business_api_is.skip_chain import SkipChain
+from whatsapp_business_api_is.validation import ValidationChain
+
+ARTIFACT_FORMAT = 2
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# messages that are sent by the infrastructure itself
+SYSTEM_MESSAGES = ('get_help', 'unknown', 'wrong_format')
+OPTIONAL_SYSTEM_MESSAGES = (OutgoingMessage.DEFAULT_STATE, 'initial_welcome_message', 'no_waiting_response_message')
+
+
+class Problem:
+    __slots__ = ('level', 'code', 'key', 'detail')
+
+    def __init__(self, level, code, key, detail):
+        self.level = level
+        self.code = code  # cycle, skip_cycle, dangling, unreachable, missing_function, missing_validator...
+        self.key = key
+        self.detail = detail
+
+    def __str__(self):
+        return f"{self.level}: {self.code} {self.key}: {self.detail}"
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def get_next_chain(flow, message):
+    """
+    Return the keys of the `next_message` chain after the message, and whether it is a cycle
+    (`send_next_message` would recurse until the recursion limit).
+    """
+    chain = []
+    seen = {message.key}
+    while (key := message.next_message_id) is not None:
+        if key in seen:
+            return chain, True
+        seen.add(key)
+        chain.append(key)
+        if (message := flow.get_message(key)) is None:
+            break
+    return chain, False
+
+
+def _check_actions(problems, kind, message):
+    for name in message.actions or {}:
+        if name not in WhatsappBusinessApiIsConfig.FUNCTIONS:
+            problems.append(Problem(ERROR, 'missing_function', message.key, f"{kind} action '{name}' is not a function"))
+
+
+def _get_edges(flow, message):
+    """ The messages that may be sent after the message """
+    edges = []
+    if message.next_message_id is not None:
+        edges.append(message.next_message_id)
+    if message.skip_if_exists and (key := message.skip_if_exists.get('next_message')):
+        edges.append(key)
+    edges.extend(response.reply_id for response in flow.get_responses(message) if response.reply_id is not None)
+    return edges
+
+
+def analyze_flow(flow):
+    """ Return the problems of the flow, most of them fail (or loop forever) only when a user reaches them """
+    problems = []
+    messages = flow.messages
+
+    for key in SYSTEM_MESSAGES:
+        if key not in messages:
+            problems.append(Problem(WARNING, 'missing_message', key, "sent by the infrastructure, but doesn't exist"))
+
+    for message in messages.values():
+        if message.next_message_id is not None and message.next_message_id not in messages:
+            problems.append(Problem(ERROR, 'dangling', message.key, f"next_message '{message.next_message_id}'"))
+        else:
+            chain, cycle = get_next_chain(flow, message)
+            if cycle:
+                problems.append(Problem(ERROR, 'cycle', message.key, f"next_message cycle {[message.key, *chain]}"))
+
+        if message.skip_if_exists and (key := message.skip_if_exists.get('next_message')) and key not in messages:
+            problems.append(Problem(ERROR, 'dangling', message.key, f"skip_if_exists next_message '{key}'"))
+        elif SkipChain(flow, message).cycle:
+            problems.append(Problem(ERROR, 'skip_cycle', message.key, "skip_if_exists loop"))
+
+        if message.type == TYPE_QUICK_REPLY and message.quick_reply:
+            for reply in message.quick_reply:
+                button_key, button_text = next(iter(reply.items()))
+                if flow.get_response(message, button_key) is None:
+                    problems.append(Problem(ERROR, 'dangling', message.key,
+                                            f"button '{button_text}' has no response '{button_key}'"))
+
+        _check_actions(problems, 'OutgoingMessage', message)
+        if message.text is None and message.template_name is None and message.type != TYPE_MEDIA and \
+                message.key != 'empty' and f"{message.key}__message" not in WhatsappBusinessApiIsConfig.FUNCTIONS:
+            problems.append(Problem(ERROR, 'missing_function', message.key,
+                                    f"no text, template or '{message.key}__message' function"))
+
+    for incoming_message in flow.incoming.values():
+        for name in ('message_id', 'reply_id'):
+            if (key := getattr(incoming_message, name)) is not None and key not in messages:
+                problems.append(Problem(ERROR, 'dangling', incoming_message.key, f"{name[:-3]} '{key}'"))
+        _check_actions(problems, 'IncomingMessage', incoming_message)
+        for validator in incoming_message.validators or []:
+            if validator['name'] not in WhatsappBusinessApiIsConfig.VALIDATORS:
+                problems.append(Problem(ERROR, 'missing_validator', incoming_message.key,
+                                        f"validator '{validator['name']}' is not a validator"))
+
+    # messages sent by code (functions, broadcasts) can't be known, so these are only warnings
+    roots = [key for key in (*SYSTEM_MESSAGES, *OPTIONAL_SYSTEM_MESSAGES) if key in messages]
+    roots += [m.reply_id for m in flow.incoming.values() if m.type == TYPE_USER_START and m.reply_id in messages]
+    roots += [m.key for m in messages.values() if m.template_name]
+    reachable = set()
+    while roots:
+        if (key := roots.pop()) not in reachable and key in messages:
+            reachable.add(key)
+            roots.extend(_get_edges(flow, messages[key]))
+    for key in messages.keys() - reachable:
+        problems.append(Problem(WARNING, 'unreachable', key, "no start message, response or next_message leads here"))
+
+    return sorted(problems, key=lambda p: (p.level != ERROR, p.code, p.key))
+
+
+def _get_tables(flow):
+    """ The lookup tables of the flow, as built by `FlowGraph`, by message key """
+    return {
+        # the start patterns are normalized, the workers must normalize the user text the same way
+        'start_pattern_normalization': list(Conf.START_PATTERN_NORMALIZATION),
+        'start_messages': {pattern: m.key for pattern, m in flow.start_messages.items()},
+        'buttons': flow.buttons,
+        'choices': {key: {pattern: m.key for pattern, m in choices.items()} for key, choices in flow.choices.items()},
+        'default_responses': {key: m.key for key, m in flow.default_responses.items()},
+    }
+
+
+def _get_path(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def _resolve_path(path):
+    """ Import a function by its `_get_path` (like `app.bot_functions.Functions.name`), return None if it is gone """
+    parts = path.split('.')
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            obj = importlib.import_module('.'.join(parts[:i]))
+        except ImportError:
+            continue
+        try:
+            for name in parts[i:]:
+                obj = getattr(obj, name)
+        except AttributeError:
+            return None
+        return obj
+    return None
+
+
+def get_digest(content):
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _get_content(artifact):
+    """ The parts of the artifact that are loaded, and covered by its digest """
+    return {name: artifact[name] for name in ('rows', 'tables', 'actions', 'validators')}
+
+
+def compile_flow(flow, problems=()):
+    """ Return the artifact of the flow: the rows of the messages, the lookup tables and the resolved actions """
+    rows = serializers.serialize('python', [*flow.messages.values(), *flow.incoming.values()])
+    rows = json.loads(json.dumps(rows, cls=DjangoJSONEncoder, sort_keys=True))
+
+    actions = {}
+    for kind, objects in (('OutgoingMessage', flow.messages), ('IncomingMessage', flow.incoming)):
+        actions[kind] = {key: {name: _get_path(func) for name, func, _, _ in ActionPipeline(obj).steps}
+                         for key, obj in objects.items()}
+    validators = {key: {v['name']: _get_path(WhatsappBusinessApiIsConfig.VALIDATORS[v['name']])
+                        for v in m.validators if v['name'] in WhatsappBusinessApiIsConfig.VALIDATORS}
+                  for key, m in flow.incoming.items() if m.validators}
+
+    artifact = {
+        'format': ARTIFACT_FORMAT,
+        'compiled': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'rows': rows,
+        'tables': _get_tables(flow),
+        'actions': actions,
+        'validators': validators,
+        'problems': [problem.as_dict() for problem in problems],
+    }
+    artifact['digest'] = get_digest(_get_content(artifact))
+    return artifact
+
+
+def _resolve_paths(paths, missing, key):
+    functions = {}
+    for name, path in paths.items():
+        if (func := _resolve_path(path)) is None:
+            missing.append(f"{key}: {name} ({path})")
+        else:
+            functions[name] = func
+    return functions
+
+
+def load_artifact(path, version=None):
+    """
+    Return the flow of an artifact written by the `compile_flow` command.
+
+    The flow is built from the rows and the lookup tables of the artifact, and the actions and validators
+    are imported by the paths they were resolved to when the flow was compiled. A worker without a function
+    of the artifact fails on startup (see `tasks.load_flow_on_worker_init`) instead of when a user reaches the message.
+    """
+    with open(path) as f:
+        artifact = json.load(f)
+    if artifact.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f"Flow artifact {path} has format {artifact.get('format')}, expected {ARTIFACT_FORMAT}")
+    if get_digest(_get_content(artifact)) != artifact['digest']:
+        raise ValueError(f"Flow artifact {path} doesn't match its digest, it was changed after it was compiled")
+    tables = artifact['tables']
+    if tables['start_pattern_normalization'] != list(Conf.START_PATTERN_NORMALIZATION):
+        raise ValueError(f"Flow artifact {path} was compiled with START_PATTERN_NORMALIZATION="
+                         f"{tables['start_pattern_normalization']}, compile it again")
+
+    outgoing_messages, incoming_messages = [], []
+    for deserialized in serializers.deserialize('python', artifact['rows']):
+        obj = deserialized.object
+        obj._state.adding = False
+        (outgoing_messages if isinstance(obj, OutgoingMessage) else incoming_messages).append(obj)
+    flow = FlowGraph(outgoing_messages, incoming_messages, version, tables=tables)
+    flow.digest = artifact['digest']
+
+    missing = []
+    for kind, objects in (('OutgoingMessage', flow.messages), ('IncomingMessage', flow.incoming)):
+        for key, obj in objects.items():
+            functions = _resolve_paths(artifact['actions'][kind].get(key, {}), missing, key)
+            flow.compiled[('actions', kind, key)] = ActionPipeline(obj, functions)
+    for key, obj in flow.incoming.items():
+        validators = _resolve_paths(artifact['validators'].get(key, {}), missing, key)
+        chain = flow.compiled[('validation', key)] = ValidationChain(obj, validators)
+        missing += [f"{key}: {name}" for name, validator, _ in chain.validators
+                    if validator is None and name not in artifact['validators'].get(key, {})]
+    if missing:
+        raise ValueError(f"Flow artifact {path} uses functions/validators that don't exist: {', '.join(missing)}")
+
+    _check_db_messages(flow)
+    logging.info("Loaded flow artifact %s digest=%s", path, flow.digest)
+    return flow
+
+
+def _check_db_messages(flow):
+    """ `WaUser.state` references the OutgoingMessage rows, so the states of the artifact must exist in the DB too """
+    try:
+        existing = set(OutgoingMessage.objects.filter(key__in=list(flow.messages)).values_list('key', flat=True))
+    except DatabaseError as e:
+        logging.warning("Can't check the messages of the flow artifact in the DB: %s", e)
+        return
+    if missing := sorted(flow.messages.keys() - existing):
+        logging.warning("Messages of the flow artifact are not in the DB, users can't be set to these states "
+                        "(run `import_flow`): %s", ', '.join(missing))
@@ -0,0 +1,129 @@
+import copy
+import logging
+
+from django.core import serializers
+from django.db import transaction, connection
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.flow import invalidate_flow
+from whatsapp_business_api_is.models import OutgoingMessage, IncomingMessage, TYPE_CHOICES
+
+BATCH_SIZE = 500
+
+
+def read_flow(stream, format_):
+    """ Return the OutgoingMessage and IncomingMessage objects of a fixture (unsaved), by key """
+    outgoing, incoming = {}, {}
+    for deserialized in serializers.deserialize(format_, stream, ignorenonexistent=True):
+        obj = deserialized.object
+        if isinstance(obj, OutgoingMessage):
+            outgoing[obj.key] = obj
+        elif isinstance(obj, IncomingMessage):
+            incoming[obj.key] = obj
+        else:
+            logging.warning("Ignoring %s %s, only flow messages are imported", type(obj).__name__, obj.pk)
+    return outgoing, incoming
+
+
+def get_choice_response_keys(outgoing):
+    """ The keys of the IncomingMessage objects that `resolve_flow` creates for the choices """
+    return [f"{message.key}_resp_{choice}" for message in outgoing.values()
+            if message is not None and message.type == TYPE_CHOICES and message.choices
+            for choice in message.choices]
+
+
+def resolve_flow(outgoing, incoming, existing_incoming=None):
+    """
+    Apply in memory what `outgoing_message_post_save` does for each saved message:
+    the `%%env%%` of template names, and an IncomingMessage for each choice (with its reply message).
+    `existing_incoming` are the current DB objects of the responses (see `get_choice_response_keys`).
+    """
+    existing_incoming = existing_incoming or {}
+    for message in list(outgoing.values()):
+        if message.template_name and '%%env%%' in message.template_name:
+            message.template_name = message.template_name.replace('%%env%%', Conf.ENV)
+
+        if message.type == TYPE_CHOICES and message.choices:
+            for choice, reply_data in message.choices.items():
+                reply_data = dict(reply_data)
+                reply_key = reply_data.pop('reply_key')
+                if 'pattern' not in reply_data:
+                    reply_data['pattern'] = choice
+                key = f"{message.key}_resp_{choice}"
+                # like `update_or_create`, fields that are not in the choice keep their current value
+                # (a copy, so `--diff` still compares it with the DB object)
+                if (response := incoming.get(key)) is None:
+                    existing = existing_incoming.get(key)
+                    response = copy.copy(existing) if existing else IncomingMessage(key=key)
+                for name, value in {**reply_data, 'type': TYPE_CHOICES}.items():
+                    setattr(response, name, value)
+                response.message_id = message.key
+                response.reply_id = reply_key
+                incoming[key] = response
+                if reply_key not in outgoing:
+                    outgoing[reply_key] = None  # must exist, like `get_or_create`
+
+
+def _changed_fields(model, obj, current):
+    return {field.name for field in model._meta.concrete_fields
+            if not field.primary_key and getattr(obj, field.attname) != getattr(current, field.attname)}
+
+
+def _write(model, objects, existing, diff):
+    """ Create the new objects and update the existing ones (only the changed ones with `diff`) """
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    to_create, to_update, update_fields = [], [], set()
+    for key, obj in objects.items():
+        if obj is None:  # a reply key that is not in the flow
+            if key not in existing:
+                to_create.append(model(key=key))
+            continue
+        if key not in existing:
+            to_create.append(obj)
+        elif not diff:
+            to_update.append(obj)
+            update_fields.update(fields)
+        elif changed := _changed_fields(model, obj, existing[key]):
+            to_update.append(obj)
+            update_fields.update(changed)
+
+    model.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    if to_update:
+        model.objects.bulk_update(to_update, sorted(update_fields), batch_size=BATCH_SIZE)
+    return {'created': len(to_create), 'updated': len(to_update),
+            'unchanged': len(objects) - len(to_create) - len(to_update)}
+
+
+def import_flow(outgoing, incoming, diff=False, dry_run=False):
+    """
+    Write a flow with a few bulk queries in one transaction.
+    The existing messages are locked (`select_for_update`), so concurrent imports don't interleave their updates.
+
+    No signals are sent (the flow is resolved in memory by `resolve_flow`), and the compiled flow is invalidated
+    once, when the transaction commits.
+    With `diff` only the messages that are different from the DB are written.
+    Messages that are in the DB but not in the flow are kept.
+    """
+    with transaction.atomic():
+        existing_outgoing = OutgoingMessage.objects.select_for_update().in_bulk(list(outgoing))
+        existing_incoming = IncomingMessage.objects.select_for_update().in_bulk(
+            [*incoming, *get_choice_response_keys(outgoing)])
+        resolve_flow(outgoing, incoming, existing_incoming)
+        # reply messages added by `resolve_flow`
+        existing_outgoing.update(OutgoingMessage.objects.select_for_update().in_bulk(
+            [key for key in outgoing if key not in existing_outgoing]))
+
+        # `next_message` may point to a message later in the same batch, and some backends (MySQL) check
+        # the foreign keys row by row, so they are checked once all the rows were written (like `loaddata`)
+        with connection.constraint_checks_disabled():
+            stats = {
+                'outgoing': _write(OutgoingMessage, outgoing, existing_outgoing, diff),
+                'incoming': _write(IncomingMessage, incoming, existing_incoming, diff),
+            }
+        connection.check_constraints(table_names=[OutgoingMessage._meta.db_table, IncomingMessage._meta.db_table])
+        if dry_run:
+            transaction.set_rollback(True)
+        elif any(s['created'] or s['updated'] for s in stats.values()):
+            invalidate_flow()
+    logging.info("Imported flow %s", stats)
+    return stats
@@ -0,0 +1,41 @@
+import time
+import uuid
+
+
+class CacheLock:
+    """
+    A lock held as a key of a cache that is shared by all the processes, which expires after `timeout` seconds
+    in case its holder died.
+
+    The cache has no compare-and-delete, so the lock is released only while it surely is still held:
+    before it expires (with a margin of `RELEASE_MARGIN` seconds for the release itself) and with our token.
+    A lock that was held longer is left to expire, so the next holder's lock is never deleted.
+    """
+
+    RELEASE_MARGIN = 1
+
+    def __init__(self, cache, key, timeout):
+        self.cache = cache
+        self.key = key
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+        self.expires = None
+
+    def acquire(self, wait, poll_interval=0.05):
+        """ Wait up to `wait` seconds for the lock, return False if it is still held by someone else """
+        deadline = time.monotonic() + wait
+        while True:
+            now = time.monotonic()
+            if self.cache.add(self.key, self.token, self.timeout):
+                self.expires = now + self.timeout
+                return True
+            if now >= deadline:
+                return False
+            time.sleep(poll_interval)
+
+    def release(self):
+        expires, self.expires = self.expires, None
+        if expires is None or time.monotonic() >= expires - self.RELEASE_MARGIN:
+            return
+        if self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
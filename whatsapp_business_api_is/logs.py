@@ -0,0 +1,169 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+from whatsapp_business_api_is.conf import Conf
+
+REDACTED = '***'
+
+_log_context = contextvars.ContextVar('wab_is_log_context', default={})
+
+
+@contextmanager
+def log_context(**values):
+    """ Add the values (like `wa_user` and `wa_message_id`) to all the log records inside the block """
+    token = _log_context.set({**_log_context.get(), **values})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def redact_headers(headers):
+    return {k: REDACTED if k.lower() in Conf.LOG_REDACTED_HEADERS else v for k, v in headers.items()}
+
+
+class ContextFilter(logging.Filter):
+    """ Add the current log context to the record, so handlers can key the events by user and message """
+
+    def filter(self, record):
+        context = _log_context.get()
+        record.event = record.msg if isinstance(record.msg, str) else repr(record.msg)
+        record.wa_user = context.get('wa_user')
+        record.wa_message_id = context.get('wa_message_id')
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a part of the records of an event.
+    `Conf.LOG_SAMPLE_RATES` maps an event (the message template, as the logging calls are lazy)
+    or a level name to the part of the records to keep.
+    """
+
+    def filter(self, record):
+        rates = Conf.LOG_SAMPLE_RATES
+        rate = rates.get(record.msg, rates.get(record.levelname)) if isinstance(record.msg, str) else None
+        return rate is None or random.random() < rate
+
+
+def get_secrets():
+    """
+    The API key, the values of the auth headers (`Conf.AUTH_HEADER` may replace the API key), the metrics token,
+    and the credentials of "<scheme> <credentials>" values, like "Bearer <token>"
+    """
+    secrets = set()
+    for value in (Conf.D360_API_KEY, *Conf.AUTH_HEADER.values(), Conf.METRICS_TOKEN):
+        if isinstance(value, str) and value.strip():
+            secrets.add(value)
+            secrets.add(value.split()[-1])
+    return secrets
+
+
+class RedactFilter(logging.Filter):
+    """ Never let the API key (or the other auth header values) reach the output of a handler """
+
+    def __init__(self):
+        super().__init__()
+        self.secrets = sorted(get_secrets(), key=len, reverse=True)  # the longest first
+
+    def redact(self, text):
+        for secret in self.secrets:
+            text = text.replace(secret, REDACTED)
+        return text
+
+    def filter(self, record):
+        message = record.getMessage()
+        if any(secret in message for secret in self.secrets):
+            record.msg = self.redact(message)
+            record.args = None
+            if isinstance(getattr(record, 'event', None), str):
+                record.event = self.redact(record.event)
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """ Format the records as JSON lines """
+
+    def format(self, record):
+        event = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': getattr(record, 'event', record.msg),
+            'message': record.getMessage(),
+            'wa_user': getattr(record, 'wa_user', None),
+            'wa_message_id': getattr(record, 'wa_message_id', None),
+        }
+        if record.exc_info:
+            event['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Put the records on a queue, for the `handlers` to format and write them on a background thread.
+
+    Only the message is formatted here (so the arguments, like mutable objects or models, are read now),
+    the redaction and the JSON formatting run on the listener thread.
+    The listener is started by the first record of each process, so the processes forked after the setup
+    (like the Celery pool or preloaded gunicorn workers) drain their own queue.
+    """
+
+    def __init__(self, handlers):
+        super().__init__(None)
+        self.target_handlers = handlers
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start_listener(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.SimpleQueue()
+            self._listener = QueueListener(self.queue, *self.target_handlers, respect_handler_level=True)
+            self._listener.start()
+            atexit.register(self._listener.stop)
+            self._pid = os.getpid()
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start_listener()
+        self.queue.put_nowait(record)
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(logger=None):
+    """
+    Move the handlers of the logger (the root logger by default) behind a queue, so the records are formatted
+    and written by a background thread instead of the worker thread.
+    The sampling and context filters run on the logging call, the redaction and the JSON formatting
+    (`StructuredFormatter`) run on the background thread.
+
+    Celery replaces the handlers of the root logger when the worker starts (`worker_hijack_root_logger`),
+    so it is called again for the worker's handlers (see `whatsapp_business_api_is.tasks`).
+    """
+    logger = logger or logging.getLogger()
+    if any(isinstance(handler, DeferredQueueHandler) for handler in logger.handlers):
+        return
+    handlers = list(logger.handlers)
+    queue_handler = DeferredQueueHandler(handlers)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(ContextFilter())
+    for handler in handlers:
+        logger.removeHandler(handler)
+        handler.addFilter(RedactFilter())
+        handler.setFormatter(StructuredFormatter())
+    logger.addHandler(queue_handler)
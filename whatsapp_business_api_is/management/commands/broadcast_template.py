@@ -0,0 +1,72 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Send a template message to many users, resuming the broadcast with the same name'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'message',
+            nargs='?',
+            help='The key of the template OutgoingMessage',
+        )
+        parser.add_argument(
+            '--name',
+            help='The name of the broadcast, used to resume it',
+        )
+        parser.add_argument(
+            '--filter',
+            default='{}',
+            help='WaUser filters as JSON, e.g. \'{"opt_in": true}\'',
+        )
+        parser.add_argument(
+            '--resend_failed',
+            action='store_true',
+            help='Send the broadcast with the --name again to the users it failed for',
+        )
+        parser.add_argument(
+            '--chunk_size',
+            type=int,
+            help='Users per query',
+        )
+
+    def handle(self, *args, **options):
+        from whatsapp_business_api_is.broadcast import broadcast, resend_failed
+        from whatsapp_business_api_is.models import Broadcast, OutgoingMessage
+
+        if options['resend_failed']:
+            if not options['name']:
+                raise CommandError("--resend_failed requires the --name of a broadcast")
+            try:
+                campaign = Broadcast.objects.select_related('message').get(name=options['name'])
+            except Broadcast.DoesNotExist:
+                raise CommandError(f"Broadcast '{options['name']}' does not exist")
+            campaign = resend_failed(campaign, chunk_size=options['chunk_size'])
+            print(f"{campaign.name}: sent={campaign.sent} failed={campaign.failed}")
+            return
+
+        if not options['message']:  # resume by name
+            if not options['name']:
+                raise CommandError("Either a message or the --name of a broadcast is required")
+            try:
+                campaign = Broadcast.objects.select_related('message').get(name=options['name'])
+            except Broadcast.DoesNotExist:
+                raise CommandError(f"Broadcast '{options['name']}' does not exist")
+            if campaign.filters is None:
+                raise CommandError(f"Broadcast '{options['name']}' was started with a queryset of users, "
+                                   f"resume it from code")
+            message, filters = campaign.message, campaign.filters
+        else:
+            try:
+                message = OutgoingMessage.objects.get(key=options['message'])
+            except OutgoingMessage.DoesNotExist:
+                raise CommandError(f"OutgoingMessage '{options['message']}' does not exist")
+            filters = json.loads(options['filter'])
+
+        if not message.template_name:
+            raise CommandError(f"OutgoingMessage '{message.key}' is not a template message")
+
+        campaign = broadcast(message, name=options['name'], filters=filters, chunk_size=options['chunk_size'])
+        print(f"{campaign.name}: sent={campaign.sent} failed={campaign.failed}")
@@ -0,0 +1,57 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Check the flow (cycles, dangling keys, unreachable messages, missing functions) and compile it ' \
+           'to an artifact for `Conf.FLOW_ARTIFACT`'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fixture',
+            help='Check a flow file (as for import_flow) instead of the messages in the DB',
+        )
+        parser.add_argument(
+            '--output',
+            help='The artifact path, without it the flow is only checked',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help="Write the artifact even if the flow has errors"
+        )
+
+    def handle(self, *args, **options):
+        from whatsapp_business_api_is.flow import FlowGraph
+        from whatsapp_business_api_is.flow_compiler import analyze_flow, compile_flow, ERROR
+        from whatsapp_business_api_is.flow_import import read_flow, resolve_flow
+        from whatsapp_business_api_is.models import OutgoingMessage, IncomingMessage
+
+        if fixture := options['fixture']:
+            try:
+                with open(fixture) as stream:
+                    outgoing, incoming = read_flow(stream, os.path.splitext(fixture)[1].lstrip('.').replace('yml', 'yaml'))
+            except OSError as e:
+                raise CommandError(f"Can't read {fixture}: {e}")
+            resolve_flow(outgoing, incoming)
+            outgoing = [message or OutgoingMessage(key=key) for key, message in outgoing.items()]
+            flow = FlowGraph(outgoing, incoming.values())
+        else:
+            flow = FlowGraph(OutgoingMessage.objects.all(), IncomingMessage.objects.all())
+
+        problems = analyze_flow(flow)
+        for problem in problems:
+            print(problem)
+        errors = sum(problem.level == ERROR for problem in problems)
+        print(f"{len(flow.messages)} outgoing, {len(flow.incoming)} incoming messages: "
+              f"{errors} errors, {len(problems) - errors} warnings")
+
+        if errors and not options['force']:
+            raise CommandError("The flow has errors" + (", the artifact was not written" if options['output'] else ''))
+        if options['output']:
+            artifact = compile_flow(flow, problems)
+            with open(options['output'], 'w') as f:
+                json.dump(artifact, f, indent=1, sort_keys=True)
+            print(f"Wrote {options['output']} digest={artifact['digest']}")
@@ -0,0 +1,45 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Load a flow fixture (json/yaml) with bulk queries, without the per message signals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'fixture',
+            help='The flow file',
+        )
+        parser.add_argument(
+            '--format',
+            help='The fixture format (json, yaml...), by default the file extension',
+        )
+        parser.add_argument(
+            '--diff',
+            action='store_true',
+            help="Write only the messages that are different from the DB"
+        )
+        parser.add_argument(
+            '--dry_run',
+            action='store_true',
+            help="Show what would be written, without writing"
+        )
+
+    def handle(self, *args, **options):
+        from whatsapp_business_api_is.flow_import import read_flow, import_flow
+
+        format_ = options['format'] or os.path.splitext(options['fixture'])[1].lstrip('.')
+        if format_ == 'yml':
+            format_ = 'yaml'
+        try:
+            with open(options['fixture']) as stream:
+                outgoing, incoming = read_flow(stream, format_)
+        except OSError as e:
+            raise CommandError(f"Can't read {options['fixture']}: {e}")
+
+        stats = import_flow(outgoing, incoming, diff=options['diff'], dry_run=options['dry_run'])
+        for model, counts in stats.items():
+            print(f"{model}: " + ' '.join(f"{name}={count}" for name, count in counts.items()))
+        if options['dry_run']:
+            print("dry run, nothing was written")
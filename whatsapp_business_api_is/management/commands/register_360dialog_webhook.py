@@ -23,9 +23,11 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        import requests
         import json
 
+        from whatsapp_business_api_is import client
+        from whatsapp_business_api_is.logs import redact_headers
+
         server_url = options['server_url'] or os.environ.get('SERVER_URL')
         webhook_url = urllib.parse.urljoin(server_url, "/wab-is/webhook")
 
@@ -38,9 +40,9 @@ class Command(BaseCommand):
         }
 
         print(f"{payload=}")
-        print(f"{headers=}")
+        print(f"headers={redact_headers(headers)}")
 
         register_url = REGISTER_URL if not options['sandbox'] else SANDBOX_REGISTER_URL
-        response = requests.request("POST", register_url, headers=headers, data=payload)
+        response = client.post(register_url, headers=headers, data=payload)
 
         print(response.text)
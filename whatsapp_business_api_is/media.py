@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.utils.module_loading import import_string
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.messages import get_media
+
+BLOBS_DIR = 'blobs'
+IDS_DIR = 'ids'
+
+EVICT_LOW_WATER = 0.9  # the part of `Conf.MEDIA_CACHE_MAX_SIZE` the cache is evicted down to
+
+_storage = None
+_lock = threading.Lock()
+# the cache size of the last `evict_media` scan and the bytes this process added since
+_size = {'scanned': 0, 'added': 0, 'scanned_at': None}
+
+
+def get_storage():
+    """ Return the storage of the media cache, created from `Conf.MEDIA_STORAGE` and `Conf.MEDIA_STORAGE_OPTIONS` """
+    global _storage
+
+    if _storage is None:
+        with _lock:
+            if _storage is None:
+                _storage = import_string(Conf.MEDIA_STORAGE)(**Conf.MEDIA_STORAGE_OPTIONS)
+    return _storage
+
+
+def _blob_name(digest):
+    return f"{BLOBS_DIR}/{digest[:2]}/{digest}"
+
+
+def _id_name(media_id):
+    return f"{IDS_DIR}/{media_id}"
+
+
+def _save(storage, name, content):
+    """
+    Save the file, replacing an existing one atomically, so concurrent downloads of the same media never leave
+    renamed duplicates (`Storage.save` renames the file when the name is taken).
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:  # a remote storage
+        if (saved_name := storage.save(name, content)) != name:
+            storage.delete(name)  # keep the newest one under the expected name, like a local replace
+            storage.save(name, storage.open(saved_name, 'rb'))
+            storage.delete(saved_name)
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_media_digest(media_id):
+    """ Return the content hash of a downloaded media, or None if it is not in the cache """
+    storage = get_storage()
+    name = _id_name(media_id)
+    if not storage.exists(name):
+        return None
+    with storage.open(name, 'rb') as f:
+        digest = f.read().decode()
+    if not storage.exists(_blob_name(digest)):  # the content was evicted
+        return None
+    return digest
+
+
+def download_media(media_id):
+    """
+    Download a media into the cache and return its content hash.
+
+    The media is streamed in chunks of `Conf.MEDIA_CHUNK_SIZE` into a temporary file, so large documents
+    are never held in memory, and each content is stored once (users re-sending the same image share a file).
+    """
+    if digest := get_media_digest(media_id):
+        logging.debug("media %s is cached as %s", media_id, digest)
+        return digest
+
+    storage = get_storage()
+    sha256 = hashlib.sha256()
+    size = 0
+    with get_media(media_id) as res, tempfile.TemporaryFile() as tmp:
+        if not res.ok:
+            raise Exception(f"Failed to download media {media_id}: {res.status_code}")
+        for chunk in res.iter_content(chunk_size=Conf.MEDIA_CHUNK_SIZE):
+            sha256.update(chunk)
+            tmp.write(chunk)
+            size += len(chunk)
+        digest = sha256.hexdigest()
+
+        blob_name = _blob_name(digest)
+        if storage.exists(blob_name):
+            logging.info("media %s has the same content as %s", media_id, digest)
+        else:
+            tmp.seek(0)
+            _save(storage, blob_name, File(tmp))
+            _size['added'] += size
+            logging.info("media %s saved as %s (%s bytes)", media_id, digest, size)
+
+    _save(storage, _id_name(media_id), ContentFile(digest.encode()))  # may replace an id of an evicted content
+
+    if _should_evict():
+        evict_media(keep=digest)
+    return digest
+
+
+def open_media(media_id):
+    """
+    Return a read only file object of the media, downloading it first if it is not in the cache.
+    The caller should close it (use it as a context manager).
+    """
+    return get_storage().open(_blob_name(download_media(media_id)), 'rb')
+
+
+def map_media(media_id):
+    """
+    Return a read only memory map of the media, for storages with local files.
+    The caller should close it (use it as a context manager).
+    """
+    with open_media(media_id) as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _get_used_time(storage, name):
+    try:
+        return storage.get_accessed_time(name)
+    except NotImplementedError:
+        return storage.get_modified_time(name)
+
+
+def _should_evict():
+    """
+    Scanning the cache costs a `stat` per content, so it is done only when the cache may be full: when the size of
+    the last scan and the contents added by this process since then exceed `Conf.MEDIA_CACHE_MAX_SIZE`,
+    or every `Conf.MEDIA_EVICT_INTERVAL` seconds (for the contents added by the other processes).
+    """
+    if not Conf.MEDIA_CACHE_MAX_SIZE:
+        return False
+    if _size['scanned_at'] is None or time.monotonic() - _size['scanned_at'] >= Conf.MEDIA_EVICT_INTERVAL:
+        return True
+    return _size['scanned'] + _size['added'] > Conf.MEDIA_CACHE_MAX_SIZE
+
+
+def evict_media(keep=None):
+    """
+    Delete the least recently used contents until the cache fits in `Conf.MEDIA_CACHE_MAX_SIZE` bytes
+    (down to `EVICT_LOW_WATER` of it, so the next downloads don't scan again).
+    The media ids that point to a deleted content are downloaded again on the next use.
+    """
+    if not Conf.MEDIA_CACHE_MAX_SIZE:
+        return
+
+    storage = get_storage()
+    blobs = []
+    total = 0
+    for prefix in storage.listdir(BLOBS_DIR)[0]:
+        for digest in storage.listdir(f"{BLOBS_DIR}/{prefix}")[1]:
+            name = f"{BLOBS_DIR}/{prefix}/{digest}"
+            size = storage.size(name)
+            total += size
+            if digest != keep:
+                blobs.append((_get_used_time(storage, name), name, size))
+
+    if total > Conf.MEDIA_CACHE_MAX_SIZE:
+        for _, name, size in sorted(blobs):
+            storage.delete(name)
+            total -= size
+            logging.info("evicted media %s (%s bytes)", name, size)
+            if total <= Conf.MEDIA_CACHE_MAX_SIZE * EVICT_LOW_WATER:
+                break
+    _size.update(scanned=total, added=0, scanned_at=time.monotonic())
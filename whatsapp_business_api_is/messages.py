@@ -1,15 +1,21 @@
-import copy
-import json
 import logging
 import os
 import re
+import time
 
-import requests
-
+from whatsapp_business_api_is import client, codec
 from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.exceptions import SendMessageException, RateLimitedException, ThrottledException, \
+    ReplyFailedException
+from whatsapp_business_api_is.flow import get_flow
+from whatsapp_business_api_is.metrics import span
 from whatsapp_business_api_is.models import OutgoingMessage, TYPE_MEDIA, TYPE_QUICK_REPLY
+from whatsapp_business_api_is.ratelimit import get_rate_limiter, parse_retry_after
+from whatsapp_business_api_is.render import create_button, get_render_plan
+from whatsapp_business_api_is.skip_chain import walk_skip_chain
+from whatsapp_business_api_is.user_session import save_user, refresh_user
 from whatsapp_business_api_is.utils import get_data, get_quick_replies_as_flat_list, run_actions, run_action, set_state, \
-    is_data_exist, should_force_next
+    should_force_next
 
 MESSAGES_URL = Conf.D360_BASE_URL + 'messages/'
 MEDIA_URL = Conf.D360_BASE_URL + 'media/'
@@ -37,7 +43,7 @@ def get_template_message_data(to_number, template_name, components, lang_code=No
     }
     message['template']['components'] = components
 
-    logging.debug(f"get_template_message_data:\n{message=}")
+    logging.debug("get_template_message_data:\nmessage=%r", message)
     return message
 
 
@@ -49,7 +55,7 @@ def get_media_message_data(to_number, media_data):
 
         media_data['media_type']: media_data['payload']
     }
-    logging.debug(f"get_media_message_data:\n{message=}")
+    logging.debug("get_media_message_data:\nmessage=%r", message)
     return message
 
 
@@ -61,7 +67,7 @@ def get_text_message_data(to_number, text):
             "body": text
         }
     }
-    logging.debug(f"get_text_message_data:\n{message=}")
+    logging.debug("get_text_message_data:\nmessage=%r", message)
     return message
 
 
@@ -72,58 +78,89 @@ def get_interactive_message_data(parts, to_number):
         "type": "interactive",
         "interactive": parts
     }
-    logging.debug(f"get_interactive_message_data:\n{message=}")
+    logging.debug("get_interactive_message_data:\nmessage=%r", message)
     return message
 
 
-def create_button(id_, title):
-    button = {
-        "type": "reply",
-        "reply": {
-            "id": id_,
-            "title": title
-        }
-    }
-    return button
+def _post_message_once(message, limiter):
+    if limiter:
+        limiter.acquire()
+    with span('send_message'):
+        res = client.post(url=MESSAGES_URL,
+                          data=codec.dumpb(message),
+                          headers=HEADERS)
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):  # `res.text` decodes the body
+        logging.debug("res=%r res.text=%r", res, res.text)
+    retry_after = parse_retry_after(res.headers.get('Retry-After'))
+    if limiter:
+        limiter.feedback(res.status_code, retry_after)
+    if not 200 <= res.status_code < 300:
+        logging.error("API error trying to send message %r", message)
+        try:
+            error = res.json()
+        except ValueError:
+            error = res.text
+        exception_class = RateLimitedException if res.status_code == 429 else SendMessageException
+        raise exception_class(res.status_code, error, retry_after)
+    return res
+
+
+def get_retry_delay(e, attempt):
+    """ Seconds to wait before sending again after a retryable error: the `Retry-After`, or exponential backoff """
+    return e.retry_after if e.retry_after is not None else Conf.SEND_RETRY_BACKOFF * 2 ** attempt
+
+
+def post_message(message):
+    """
+    Send the message to the provider, within the rate limit (`whatsapp_business_api_is.ratelimit`).
+    Retryable errors (429, and 5xx with a `Retry-After`) are retried in place up to `Conf.SEND_RETRIES` times,
+    when the wait is up to `Conf.SEND_RETRY_MAX_WAIT` seconds.
+    Otherwise `SendMessageException` (or `ThrottledException`) is raised, and the tasks retry retryable errors later.
+    """
+    logging.debug("response: %s \nresponse: message=%r", MESSAGES_URL, message)
+    limiter = get_rate_limiter()
+    for attempt in range(Conf.SEND_RETRIES + 1):
+        try:
+            return _post_message_once(message, limiter)
+        except SendMessageException as e:
+            if not e.retryable or attempt == Conf.SEND_RETRIES:
+                raise
+            if (delay := get_retry_delay(e, attempt)) > Conf.SEND_RETRY_MAX_WAIT:
+                raise
+            logging.warning("Sending failed with %s, retry in %.2f seconds", e.status_code, delay)
+            time.sleep(delay)
 
 
 def send_message(user, message, is_failure=False):
+    """
+    Send the message to the user and wait for the response, so the state is set only after the message was sent
+    (the dispatcher is used by broadcasts only, see `whatsapp_business_api_is.dispatcher`).
+    """
     if not is_failure:
         user.failure_count = 0
     else:
         user.failure_count += 1
-    user.save()
+    save_user(user, 'failure_count')
 
-    logging.debug(f"response: {MESSAGES_URL} \nresponse: {message=} {HEADERS=}")
-    res = requests.post(url=MESSAGES_URL,
-                        data=json.dumps(message),
-                        headers=HEADERS)
-
-    logging.debug(f"{res=}")
-    logging.debug(f"{res.text=}")
-    try:
-        logging.debug(f"{res.json()=}")
-    except Exception:
-        pass
-    if not 200 <= res.status_code < 300:
-        logging.error(f"API error trying to send message {json.dumps(message)}")
-        raise Exception(res.json())
+    post_message(message)
 
 
 def send_template_message(user, wab_bot_message, components=None):
-    components = components or copy.deepcopy(
-        wab_bot_message.message_variables)  # we can do this because this is a parsed JSON field
     if components:
         for component in components:
             for parameter in component['parameters']:
                 if variable := parameter.pop('variable', None):
                     parameter[parameter['type']] = str(get_data(user, variable))
+    else:
+        with span('render', kind='template'):
+            components = get_render_plan(wab_bot_message, 'template').render(user)
 
-    logging.debug(f"{components=}")
+    logging.debug("components=%r", components)
     message = get_template_message_data(user.number, wab_bot_message.template_name, components)
 
     if Conf.DEMO_MODE:
-        logging.info(f"{'*' * 20}\n*   {message=}\n{'*' * 20}")
+        logging.info("%s\n*   message=%r\n%s", '*' * 20, message, '*' * 20)
         text = wab_bot_message.pk
         if wab_bot_message.quick_reply:
             quick_replies = get_quick_replies_as_flat_list(wab_bot_message.quick_reply)
@@ -136,19 +173,8 @@ def send_template_message(user, wab_bot_message, components=None):
 
 def send_media_message(user, wab_bot_message, message_text=None):
     message_text = message_text or wab_bot_message.text
-    if message_text and wab_bot_message.message_variables['caption']:
-        variables = {k: get_data(user, v) for k, v in
-                     wab_bot_message.message_variables['caption'].items()}
-        message_text = message_text.format(**variables)
-
-    payload = wab_bot_message.message_variables['media']['payload']  # TODO make dynamic
-    if message_text:
-        payload['caption'] = message_text
-
-    media_data = {
-        'media_type': wab_bot_message.message_variables['media']['type'],
-        'payload': payload
-    }
+    with span('render', kind='media'):
+        media_data = get_render_plan(wab_bot_message, 'media').render(user, message_text)
 
     message = get_media_message_data(user.number, media_data)
 
@@ -158,22 +184,8 @@ def send_media_message(user, wab_bot_message, message_text=None):
 
 def send_interactive_message(user, wab_bot_message, message_text=None):
     message_text = message_text or wab_bot_message.text
-
-    # we can do this because this is a parsed JSON field
-    parts = copy.deepcopy(wab_bot_message.message_variables) or {}
-    if body := parts.get('body'):
-        variables = {k: get_data(user, v) for k, v in body.pop('variables').items()}
-        body['text'] = message_text.format(**variables)
-    else:
-        parts['body'] = {'text': message_text}
-
-    match wab_bot_message.type:  # there are other type that not implemented yet
-        case 'quick_reply':
-            parts['type'] = 'button'
-            buttons = get_quick_replies_as_flat_list(wab_bot_message.quick_reply)
-            parts['action'] = {
-                "buttons": [create_button(id, name) for id, name in buttons]
-            }
+    with span('render', kind='interactive'):
+        parts = get_render_plan(wab_bot_message, 'interactive').render(user, message_text)
 
     message = get_interactive_message_data(parts, user.number)
 
@@ -183,10 +195,8 @@ def send_interactive_message(user, wab_bot_message, message_text=None):
 
 def send_text_message(user, wab_bot_message, message_text=None, is_failure=False):
     message_text = message_text or wab_bot_message.text
-    if wab_bot_message.message_variables:
-        variables = {k: get_data(user, v) for k, v in
-                     wab_bot_message.message_variables.items()}
-        message_text = message_text.format(**variables)
+    with span('render', kind='text'):
+        message_text = get_render_plan(wab_bot_message, 'text').render_text(user, message_text)
 
     message = get_text_message_data(user.number, message_text)
 
@@ -195,8 +205,8 @@ def send_text_message(user, wab_bot_message, message_text=None, is_failure=False
 
 
 def send_get_help_message(user):
-    logging.info(f'send get_help_message to {user}')
-    get_help_message = OutgoingMessage.objects.get(key='get_help')
+    logging.info('send get_help_message to %s', user)
+    get_help_message = get_flow().require_message('get_help')
     send_text_message(user, get_help_message, None, True)
 
 
@@ -204,12 +214,13 @@ def send_unknown_message(user):
     if user.failure_count >= 3:
         send_get_help_message(user)
         return
-    unknown_message = OutgoingMessage.objects.get(key='unknown')
+    flow = get_flow()
+    unknown_message = flow.require_message('unknown')
     send_text_message(user, unknown_message, None, True)
 
-    user.refresh_from_db()
-    if user.state.pk != 'initial' and user.failure_count == Conf.RESEND_ON_WRONG:
-        reply_message = get_next_message(user, None, user.state)
+    refresh_user(user)
+    if user.state_id != OutgoingMessage.DEFAULT_STATE and user.failure_count == Conf.RESEND_ON_WRONG:
+        reply_message = get_next_message(user, None, flow.get_message(user.state_id))
         send_next_message(user, None, None, reply_message)
 
 
@@ -218,22 +229,23 @@ def send_error_message(user, error):
         send_get_help_message(user)
     elif error and error.message and hasattr(error, 'params') and \
             error.params and error.params.get('custom_message', False):
-        if message := OutgoingMessage.objects.filter(key=error.message).first():
+        if message := get_flow().get_message(error.message):
             send_text_message(user, message, None, True)
         else:
             message = get_text_message_data(user.number, error.message)
             send_message(user, message, True)
     else:
-        unknown_message = OutgoingMessage.objects.get(key='wrong_format')
+        unknown_message = get_flow().require_message('wrong_format')
         send_text_message(user, unknown_message, None, True)
 
 
 def get_media(media_id):
-    res = requests.get(
+    res = client.get(
         url=MEDIA_URL + '/' + media_id,
-        headers=Conf.AUTH_HEADER
+        headers=Conf.AUTH_HEADER,
+        stream=True  # the body is read by the caller (see `whatsapp_business_api_is.media`)
     )
-    logging.info(res.__dict__)
+    logging.info("media response: %s %s", res.status_code, res.headers.get('Content-Type'))
     return res
 
 
@@ -244,14 +256,12 @@ def get_next_message(user, incoming_message, next_message=None):
         next_message = incoming_message.reply
     if not next_message:
         logging.error("get_next_message should get either incoming_message or next_message")
-    logging.info(f'candidate next message: {next_message}')
-    while not should_force_next(incoming_message) and is_data_exist(user, next_message):
-        if next_message.skip_if_exists:
-            next_message = OutgoingMessage.objects.get(pk=next_message.skip_if_exists['next_message'])
-        else:
-            next_message = next_message.responses.order_by('-is_default').first().reply
-        logging.debug(f'skip to next message: {next_message}')
-    logging.info(f'next message: {next_message}')
+    logging.info('candidate next message: %s', next_message)
+    if not should_force_next(incoming_message):
+        with span('skip_chain'):
+            next_message = walk_skip_chain(user, next_message,
+                                           lambda message: logging.debug('skip to next message: %s', message))
+    logging.info('next message: %s', next_message)
     return next_message
 
 
@@ -260,11 +270,11 @@ def send_next_message(user, msg, incoming_message, reply_message):
         logging.error('no reply_message')
         return
     if reply_message.key == 'empty':
-        logging.info(f"Nothing to send")
+        logging.info("Nothing to send")
         return
 
     run_actions(user, msg, reply_message)
-    user.refresh_from_db()
+    refresh_user(user)
     message_text = None
     if reply_message.text is None and reply_message.template_name is None and reply_message.type != TYPE_MEDIA:
         logging.info("About to send method message")
@@ -272,20 +282,26 @@ def send_next_message(user, msg, incoming_message, reply_message):
             logging.info("Got no text to send")
             return
 
-    if reply_message.template_name:
-        send_template_message(user, reply_message)
-    elif reply_message.type == TYPE_MEDIA:
-        send_media_message(user, reply_message, message_text)
-    elif reply_message.type in [TYPE_QUICK_REPLY]:
-        send_interactive_message(user, reply_message, message_text)
-    else:
-        send_text_message(user, reply_message, message_text)
+    try:
+        if reply_message.template_name:
+            send_template_message(user, reply_message)
+        elif reply_message.type == TYPE_MEDIA:
+            send_media_message(user, reply_message, message_text)
+        elif reply_message.type in [TYPE_QUICK_REPLY]:
+            send_interactive_message(user, reply_message, message_text)
+        else:
+            send_text_message(user, reply_message, message_text)
+    except (SendMessageException, ThrottledException) as e:
+        if not e.retryable:
+            raise
+        # the state stays before the reply, so the reply can be sent again without routing the user message again
+        raise ReplyFailedException(e, user.number, msg, incoming_message, reply_message) from e
 
     set_state(user, reply_message)
-    user.refresh_from_db()
-    logging.info(f"Sent {reply_message.key}")
+    refresh_user(user)
+    logging.info("Sent %s", reply_message.key)
 
     if reply_message.next_message:
-        logging.info(f"About to sent next message")
+        logging.info("About to sent next message")
         next_message = get_next_message(user, incoming_message, reply_message.next_message)
         send_next_message(user, msg, incoming_message, next_message)
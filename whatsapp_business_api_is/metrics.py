@@ -0,0 +1,247 @@
+import bisect
+import contextvars
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import nullcontext
+
+from django.core.cache import caches
+from django.db import connection
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.locks import CacheLock
+
+PROCESSES_CACHE_KEY = 'wab_is:metrics:processes'
+PROCESSES_LOCK_CACHE_KEY = 'wab_is:metrics:processes:lock'
+PROCESSES_LOCK_TIMEOUT = 5
+SNAPSHOT_CACHE_KEY = 'wab_is:metrics:{process}'
+
+# seconds
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+_sampled = contextvars.ContextVar('wab_is_metrics_sampled', default=None)
+_null_span = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Registry:
+    """ In-process histograms, keyed by metric name and labels """
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, labels, buckets):
+        key = (name, labels)
+        if (histogram := self.histograms.get(key)) is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def snapshot(self):
+        """ {(name, labels): (buckets, counts, sum, count)} of all the histograms """
+        with self._lock:
+            histograms = list(self.histograms.items())
+        return {key: (histogram.buckets, *histogram.snapshot()) for key, histogram in histograms}
+
+    def render(self):
+        """ Render the histograms of this process in the Prometheus text format """
+        return render_snapshot(self.snapshot())
+
+
+def merge_snapshots(snapshots):
+    """ Add up the histograms of the snapshots of several processes """
+    merged = {}
+    for snapshot in snapshots:
+        for key, (buckets, counts, total, count) in snapshot.items():
+            if key not in merged:
+                merged[key] = (buckets, list(counts), total, count)
+                continue
+            merged_buckets, merged_counts, merged_total, merged_count = merged[key]
+            if merged_buckets != buckets:
+                logging.warning("Can't merge metric %s, the processes have different buckets", key)
+                continue
+            merged[key] = (buckets, [a + b for a, b in zip(merged_counts, counts)],
+                           merged_total + total, merged_count + count)
+    return merged
+
+
+def render_snapshot(snapshot):
+    """ Render the histograms of a snapshot in the Prometheus text format """
+    lines = []
+    by_name = {}
+    for (name, labels), histogram in sorted(snapshot.items()):
+        by_name.setdefault(name, []).append((labels, histogram))
+    for name, histograms in by_name.items():
+        lines.append(f"# TYPE {name} histogram")
+        for labels, (buckets, counts, total, count) in histograms:
+            label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+            prefix = f"{label_text}," if label_text else ''
+            cumulative = 0
+            for bucket, bucket_count in zip((*buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{prefix}le="{bucket}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{label_text}}} {total}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+_published_at = {'pid': None, 'time': 0.0}
+
+
+def _get_process_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def publish(force=False):
+    """
+    Publish the histograms of this process to the cache (`Conf.CACHE_ALIAS`), at most once every
+    `Conf.METRICS_PUBLISH_INTERVAL` seconds, so the metrics endpoint of any process can render the metrics
+    of all the web and worker processes.
+    The cache should be shared by all the processes (e.g. Redis or Memcached).
+    A process that stopped publishing is dropped after `Conf.METRICS_PUBLISH_TTL` seconds.
+    """
+    if not Conf.METRICS_PUBLISH_INTERVAL:
+        return
+    now = time.monotonic()
+    pid = os.getpid()
+    if not force and _published_at['pid'] == pid and now - _published_at['time'] < Conf.METRICS_PUBLISH_INTERVAL:
+        return
+    _published_at.update(pid=pid, time=now)
+
+    process = _get_process_name()
+    cache = caches[Conf.CACHE_ALIAS]
+    try:
+        cache.set(SNAPSHOT_CACHE_KEY.format(process=process), registry.snapshot(), Conf.METRICS_PUBLISH_TTL)
+        _add_process(cache, process)
+    except Exception as e:  # the metrics must never fail a message
+        logging.warning("Failed to publish the metrics: %s", e)
+
+
+def _add_process(cache, process):
+    """
+    Add the process to the index of the publishing processes, under a lock, so concurrent publishers don't drop
+    each other's processes (and a scrape never sums fewer processes, which looks like a counter reset).
+    The lock is not waited for (`publish` runs in the hot path), when it is busy the process is added by its next
+    publish.
+    """
+    lock = CacheLock(cache, PROCESSES_LOCK_CACHE_KEY, PROCESSES_LOCK_TIMEOUT)
+    if not lock.acquire(wait=0):
+        logging.debug("The metrics processes are locked, skipping %s", process)
+        return
+    try:
+        processes = cache.get(PROCESSES_CACHE_KEY) or {}
+        now = time.time()
+        processes = {p: seen for p, seen in processes.items() if now - seen < Conf.METRICS_PUBLISH_TTL}
+        processes[process] = now
+        cache.set(PROCESSES_CACHE_KEY, processes, None)
+    finally:
+        lock.release()
+
+
+def render_all():
+    """ Render the histograms of all the processes that published them (and of this one) """
+    if not Conf.METRICS_PUBLISH_INTERVAL:
+        return registry.render()
+    publish(force=True)
+    cache = caches[Conf.CACHE_ALIAS]
+    processes = cache.get(PROCESSES_CACHE_KEY) or {}
+    keys = [SNAPSHOT_CACHE_KEY.format(process=process) for process in processes]
+    return render_snapshot(merge_snapshots(cache.get_many(keys).values()))
+
+
+class Span:
+    """ Time a stage of the pipeline and count the DB queries it ran """
+
+    __slots__ = ('labels', 'queries', 'started', '_wrapper')
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.queries = 0
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self._count_query)
+        self._wrapper.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.started
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        registry.histogram('wab_is_stage_seconds', self.labels, TIME_BUCKETS).observe(elapsed)
+        registry.histogram('wab_is_stage_db_queries', self.labels, QUERY_BUCKETS).observe(self.queries)
+        publish()
+        return False
+
+
+def _is_sampled():
+    if (sampled := _sampled.get()) is not None:
+        return sampled
+    return random.random() < Conf.METRICS_SAMPLE_RATE
+
+
+def span(stage, **labels):
+    """
+    Return a context manager that records the time and DB queries of the stage, when metrics are enabled.
+    Inside a `trace` all the spans follow the sampling decision of the trace; the DB queries of nested spans
+    are counted by their parents too.
+    """
+    if not Conf.METRICS_ENABLED or not _is_sampled():
+        return _null_span
+    return Span((('stage', stage), *sorted(labels.items())))
+
+
+class trace:
+    """ Make one sampling decision for all the spans of an inbound message """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        sampled = Conf.METRICS_ENABLED and random.random() < Conf.METRICS_SAMPLE_RATE
+        self._token = _sampled.set(sampled)
+        self._span = span(self.stage)
+        return self._span.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            return self._span.__exit__(exc_type, exc_value, traceback)
+        finally:
+            _sampled.reset(self._token)
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.3 on 2026-10-17 15:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_business_api_is', '0002_wauser_disable_bot_wauser_failure_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('filters', models.JSONField(default=dict)),
+                ('status', models.TextField(choices=[('running', 'running'), ('done', 'done')], default='running')),
+                ('last_number', models.CharField(max_length=13, null=True)),
+                ('sent', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='whatsapp_business_api_is.outgoingmessage')),
+            ],
+        ),
+    ]
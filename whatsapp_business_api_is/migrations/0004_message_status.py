@@ -0,0 +1,34 @@
+# Generated by Django 4.0.3 on 2026-10-17 15:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_business_api_is', '0003_broadcast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wauser',
+            name='delivery_failure_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='MessageStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(max_length=128)),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'sent'), (2, 'delivered'), (3, 'read'), (4, 'failed'), (5, 'deleted')])),
+                ('timestamp', models.DateTimeField()),
+                ('error_code', models.IntegerField(null=True)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='statuses', to='whatsapp_business_api_is.wauser')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='messagestatus',
+            constraint=models.UniqueConstraint(fields=('message_id', 'status'), name='unique_message_status'),
+        ),
+    ]
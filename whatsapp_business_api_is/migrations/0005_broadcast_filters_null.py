@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-17 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_business_api_is', '0004_message_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='broadcast',
+            name='filters',
+            field=models.JSONField(default=dict, null=True),
+        ),
+    ]
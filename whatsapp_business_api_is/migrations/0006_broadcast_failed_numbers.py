@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-17 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_business_api_is', '0005_broadcast_filters_null'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcast',
+            name='failed_numbers',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 
 from whatsapp_business_api_is.conf import Conf
 
@@ -69,12 +69,77 @@ class WaUser(models.Model):
     opt_in = models.BooleanField(default=False)
     failure_count = models.IntegerField(default=0)
     disable_bot = models.BooleanField(default=False)
+    delivery_failure_count = models.IntegerField(default=0)  # outbound messages with a `failed` status
 
     def __unicode__(self):
         return u'{}'.format(self.number)
 
 
+STATUS_SENT = 1
+STATUS_DELIVERED = 2
+STATUS_READ = 3
+STATUS_FAILED = 4
+STATUS_DELETED = 5
+MESSAGE_STATUSES = [
+    (STATUS_SENT, 'sent'),
+    (STATUS_DELIVERED, 'delivered'),
+    (STATUS_READ, 'read'),
+    (STATUS_FAILED, 'failed'),
+    (STATUS_DELETED, 'deleted'),
+]
+
+
+class MessageStatus(models.Model):
+    """ A status callback of an outbound message (see `whatsapp_business_api_is.statuses`) """
+    message_id = models.CharField(max_length=128)
+    # the recipient, which may not be a known user
+    user = models.ForeignKey(WaUser, on_delete=models.DO_NOTHING, db_constraint=False, related_name='statuses')
+    status = models.PositiveSmallIntegerField(choices=MESSAGE_STATUSES)
+    timestamp = models.DateTimeField()
+    error_code = models.IntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message_id', 'status'], name='unique_message_status'),
+        ]
+
+    def __unicode__(self):
+        return u'{0} {1}'.format(self.message_id, self.get_status_display())
+
+
+BROADCAST_RUNNING = 'running'
+BROADCAST_DONE = 'done'
+BROADCAST_STATUSES = [
+    (BROADCAST_RUNNING, BROADCAST_RUNNING),
+    (BROADCAST_DONE, BROADCAST_DONE),
+]
+
+
+class Broadcast(models.Model):
+    """ The progress of a template campaign (see `whatsapp_business_api_is.broadcast`) """
+    name = models.CharField(unique=True, max_length=100)
+    message = models.ForeignKey(OutgoingMessage, on_delete=models.CASCADE)
+    # `WaUser` filters, used when resuming from the management command (None for users given as a queryset)
+    filters = models.JSONField(null=True, default=dict)
+    status = models.TextField(choices=BROADCAST_STATUSES, default=BROADCAST_RUNNING)
+    last_number = models.CharField(null=True, max_length=13)  # the last user of the last completed chunk
+    sent = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    failed_numbers = models.JSONField(default=list)  # the users the message failed for, see `resend_failed`
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return u'{0}'.format(self.name)
+
+
+def flow_changed(sender, *args, **kwargs):
+    from whatsapp_business_api_is.flow import invalidate_flow
+    invalidate_flow()
+
+
 def outgoing_message_post_save(sender, instance, *args, **kwargs):
+    flow_changed(sender)
     message = instance
     if message.template_name and '%%env%%' in message.template_name:
         message.template_name = message.template_name.replace('%%env%%', Conf.ENV)
@@ -98,4 +163,6 @@ def outgoing_message_post_save(sender, instance, *args, **kwargs):
 
 
 post_save.connect(outgoing_message_post_save, sender=OutgoingMessage)
-
+post_save.connect(flow_changed, sender=IncomingMessage)
+post_delete.connect(flow_changed, sender=OutgoingMessage)
+post_delete.connect(flow_changed, sender=IncomingMessage)
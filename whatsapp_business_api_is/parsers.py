@@ -0,0 +1,121 @@
+"""
+Parsers of the user input for `validate_value`.
+
+They accept exactly what the original `DATE_PATTERN` + `dateutil.parser.parse(dayfirst=True)` and `TIME_PATTERN`
+accepted, without the regex engine and dateutil (see `benchmarks/parsers.py`).
+"""
+import time as _time
+from datetime import date, time
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+
+DIGITS = frozenset('0123456789')
+DATE_SEPARATORS = frozenset('/.-')
+
+# day/month -> value, with and without a leading zero
+DAYS = {**{str(d): d for d in range(1, 10)}, **{f"{d:02d}": d for d in range(1, 32)}}
+MONTHS = {**{str(m): m for m in range(1, 10)}, **{f"{m:02d}": m for m in range(1, 13)}}
+TWO_DIGITS = {f"{n:02d}": n for n in range(100)}
+
+
+def _convert_year(year):
+    """ A 2 digits year is in the 100 years around today, like `dateutil` """
+    this_year = _time.localtime().tm_year
+    year += this_year // 100 * 100
+    if year >= this_year + 50:
+        year -= 100
+    elif year < this_year - 50:
+        year += 100
+    return year
+
+
+def _split_date_part(text, start, values):
+    """ Return the value of the 1 or 2 characters day/month at `start` and the index of the separator after it """
+    for end in (start + 1, start + 2):
+        if text[end:end + 1] in DATE_SEPARATORS and (value := values.get(text[start:end])) is not None:
+            return value, end
+    return None, None
+
+
+def parse_date(text):
+    """
+    Parse a day first date: d/m/yy, dd.mm.yyyy, d-m-20yy etc.
+    Raise `ValidationError` for other formats, and `ValueError` for dates that don't exist (31/2/23).
+    """
+    if text.endswith('\n'):  # like `$`
+        text = text[:-1]
+    day, sep1 = _split_date_part(text, 0, DAYS)
+    if day is None:
+        raise ValidationError('Wrong date format')
+    month, sep2 = _split_date_part(text, sep1 + 1, MONTHS)
+    if month is None:
+        raise ValidationError('Wrong date format')
+
+    year = text[sep2 + 1:]
+    if len(year) == 2 and year in TWO_DIGITS:
+        year = _convert_year(TWO_DIGITS[year])
+    elif len(year) == 4 and year[:2] == '20' and year[2:] in TWO_DIGITS:
+        year = 2000 + TWO_DIGITS[year[2:]]
+    else:
+        raise ValidationError('Wrong date format')
+
+    if (text[sep1] == '.') != (text[sep2] == '.'):
+        # dateutil reads "1/2.23" as the day 1 and the number 2.23
+        raise ValueError(f"String does not contain a date: {text}")
+    return date(year, month, day)
+
+
+def _hours(text, i):
+    """ The matches of `1[0-9]|2[0-3]|0?[0-9]` at `i`, in the regex order """
+    c0, c1 = text[i:i + 1], text[i + 1:i + 2]
+    matches = []
+    if c1 in DIGITS:
+        if c0 == '1':
+            matches.append((10 + int(c1), i + 2))
+        elif c0 == '2' and c1 in '0123':
+            matches.append((20 + int(c1), i + 2))
+        elif c0 == '0':
+            matches.append((int(c1), i + 2))
+    if c0 in DIGITS:
+        matches.append((int(c0), i + 1))
+    return matches
+
+
+def _minutes(text, i):
+    """ The matches of `[1-5][0-9]|0?[0-9]` at `i`, in the regex order """
+    c0, c1 = text[i:i + 1], text[i + 1:i + 2]
+    matches = []
+    if c1 in DIGITS and (c0 == '0' or c0 in '12345' and c0):
+        matches.append((int(c0) * 10 + int(c1), i + 2))
+    if c0 in DIGITS:
+        matches.append((int(c0), i + 1))
+    return matches
+
+
+@lru_cache(maxsize=1024)  # users enter the same few times over and over
+def _match_time(text):
+    n = len(text)
+    ends = (n, n - 1) if text.endswith('\n') else (n,)  # like `$`
+    for hours, i in _hours(text, 0):
+        # `\D?` is greedy, so first try with a separator
+        starts = (i + 1, i) if i < n and not text[i].isdecimal() else (i,)
+        for start in starts:
+            for minutes, end in _minutes(text, start):
+                if end in ends:
+                    return time(hours, minutes)
+    return None
+
+
+def parse_time(text):
+    """
+    Parse an hour and minutes, with or without one non digit character between them: 9:30, 0930, 21h5 etc.
+    Raise `ValidationError` for other formats.
+    """
+    if (value := _match_time(text)) is None:
+        raise ValidationError('Wrong time format')
+    return value
+
+
+def parse_number(text):
+    return float(text) if '.' in text else int(text)
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.exceptions import ThrottledException
+from whatsapp_business_api_is.locks import CacheLock
+
+RATE_LIMIT_CACHE_KEY = 'wab_is:rate_limit:{key}'
+
+
+class LocalBackend:
+    """ Keep the limiter state in the process memory, each process has its own limit """
+
+    def __init__(self):
+        self.states = {}
+        self._lock = threading.Lock()
+
+    def update(self, key, func, busy=None):
+        """ Apply `func` to the state of the key atomically and return its result (`busy` if the state is locked) """
+        with self._lock:
+            return func(self.states.setdefault(key, {}))
+
+
+class CacheBackend:
+    """
+    Keep the limiter state in the Django cache (`Conf.CACHE_ALIAS`), so all the worker processes share one limit.
+    The state is updated under a short lock, the cache should be shared by all the workers (e.g. Redis or Memcached).
+    The state is never updated without the lock: when it is held for longer than `lock_wait` (e.g. by a process that
+    died, until it expires) the update is skipped and `busy` is returned.
+    """
+
+    lock_timeout = 5
+    lock_wait = 1
+    poll_interval = 0.001
+
+    def update(self, key, func, busy=None):
+        cache = caches[Conf.CACHE_ALIAS]
+        state_key = RATE_LIMIT_CACHE_KEY.format(key=key)
+        lock = CacheLock(cache, f"{state_key}:lock", self.lock_timeout)
+        if not lock.acquire(self.lock_wait, self.poll_interval):
+            return busy
+        try:
+            state = cache.get(state_key) or {}
+            result = func(state)
+            cache.set(state_key, state, None)
+            return result
+        finally:
+            lock.release()
+
+
+class RateLimiter:
+    """
+    A token bucket that adapts its rate to the provider's responses (AIMD).
+
+    The rate starts at `Conf.RATE_LIMIT` (the provider's limit, messages per second) and is multiplied by
+    `Conf.RATE_LIMIT_DECREASE` on each 429/5xx response, down to `Conf.RATE_LIMIT_MIN`.
+    Successful sends add `Conf.RATE_LIMIT_INCREASE` messages per second to the rate, for each second of sends,
+    back up to `Conf.RATE_LIMIT`. A `Retry-After` pauses all the sends for the given time.
+    The time is wall clock time, as the state may be shared between hosts.
+    """
+
+    # seconds to wait before trying again when the state is locked by someone else (no token was taken)
+    busy_wait = 0.05
+
+    def __init__(self, backend, key='messages'):
+        self.backend = backend
+        self.key = key
+
+    def _init(self, state, now):
+        if 'rate' not in state:
+            state.update(rate=float(Conf.RATE_LIMIT), tokens=float(Conf.RATE_LIMIT_BURST), updated=now, paused_until=0)
+
+    def _take(self, state):
+        now = time.time()
+        self._init(state, now)
+        if now < state['paused_until']:
+            return state['paused_until'] - now
+        state['tokens'] = min(Conf.RATE_LIMIT_BURST, state['tokens'] + (now - state['updated']) * state['rate'])
+        state['updated'] = now
+        if state['tokens'] >= 1:
+            state['tokens'] -= 1
+            return 0
+        return (1 - state['tokens']) / state['rate']
+
+    def acquire(self, timeout=None):
+        """ Wait for a token, up to `timeout` seconds (`Conf.RATE_LIMIT_WAIT` by default), or raise `ThrottledException` """
+        timeout = Conf.RATE_LIMIT_WAIT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while wait := self.backend.update(self.key, self._take, busy=self.busy_wait):
+            if time.monotonic() + wait > deadline:
+                raise ThrottledException(f"No capacity to send a message within {timeout} seconds", retry_after=wait)
+            time.sleep(wait)
+
+    def feedback(self, status_code, retry_after=None):
+        """ Adjust the rate by the response of the provider """
+
+        def update(state):
+            now = time.time()
+            self._init(state, now)
+            if status_code == 429 or status_code >= 500:
+                state['rate'] = max(Conf.RATE_LIMIT_MIN, state['rate'] * Conf.RATE_LIMIT_DECREASE)
+                state['tokens'] = min(state['tokens'], 0)
+                if retry_after:
+                    state['paused_until'] = max(state['paused_until'], now + retry_after)
+            elif state['rate'] < Conf.RATE_LIMIT:
+                state['rate'] = min(Conf.RATE_LIMIT, state['rate'] + Conf.RATE_LIMIT_INCREASE / state['rate'])
+            return state['rate']
+
+        rate = self.backend.update(self.key, update)
+        if rate is None:
+            logging.warning("Rate limiter state is locked, ignoring the %s response", status_code)
+        elif status_code == 429 or status_code >= 500:
+            logging.warning("Provider responded %s, rate limit is now %.2f/s (retry_after=%s)",
+                            status_code, rate, retry_after)
+
+
+def parse_retry_after(value):
+    """ Return the seconds of a `Retry-After` header (either seconds or an HTTP date), or None """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_limiter = None
+_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """ Return the rate limiter of the outbound messages, or None when `Conf.RATE_LIMIT` is not set """
+    global _limiter
+
+    if not Conf.RATE_LIMIT:
+        return None
+    if _limiter is None:
+        with _lock:
+            if _limiter is None:
+                _limiter = RateLimiter(import_string(Conf.RATE_LIMIT_BACKEND)())
+    return _limiter
@@ -0,0 +1,243 @@
+import json
+import logging
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Model
+
+from whatsapp_business_api_is.flow import get_flow
+from whatsapp_business_api_is.models import WaUser
+from whatsapp_business_api_is.utils import get_data, get_quick_replies_as_flat_list, get_object, parse_filter
+
+
+def create_button(id_, title):
+    button = {
+        "type": "reply",
+        "reply": {
+            "id": id_,
+            "title": title
+        }
+    }
+    return button
+
+
+def compile_variables(specs):
+    """
+    Prepare a list of data specs (as used by `get_data`) for `resolve_variables`.
+    Specs that read the same object (same model and filter) share a lookup key, so the object is fetched once.
+    """
+    compiled = []
+    for spec in specs:
+        key = None
+        if 'model' in spec and 'action' not in spec:
+            key = (tuple(spec['model']), json.dumps(spec.get('filter'), sort_keys=True, default=str))
+        compiled.append((spec, key))
+    return compiled
+
+
+def resolve_variables(user, compiled):
+    """ Return the value of each compiled spec, fetching each object only once """
+    values = []
+    objects = {}
+    for spec, key in compiled:
+        if key is None:
+            values.append(get_data(user, spec))
+            continue
+        if key not in objects:
+            objects[key] = get_object(user, spec)
+        obj = objects[key]
+        values.append(getattr(obj, spec['field'], None) if 'field' in spec else obj)
+    logging.debug("Resolved %s variables with %s lookups", len(values), len(objects))
+    return values
+
+
+def get_objects_in_bulk(users, spec):
+    """
+    Return the object of the spec for each user, with one query for filters on a single field.
+    Specs that read the user itself don't hit the DB at all.
+    """
+    model = apps.get_model(*spec['model'])
+    filters = [parse_filter(spec['filter'], user) for user in users]
+    if model is WaUser and all(f in ({'number': user.number}, {'pk': user.pk}) for f, user in zip(filters, users)):
+        return list(users)
+
+    field_names = {name for f in filters for name in f}
+    try:
+        if len(field_names) != 1 or not all(filters):
+            raise FieldDoesNotExist()
+        name = next(iter(field_names))
+        attname = model._meta.get_field(name).attname
+    except (FieldDoesNotExist, AttributeError):  # lookups, reverse relations or different filters
+        return [model.objects.filter(**f).first() for f in filters]
+
+    values = [f[name].pk if isinstance(f[name], Model) else f[name] for f in filters]
+    queryset = model.objects.filter(**{f"{name}__in": set(values)})
+    if not queryset.ordered:  # same as `.first()`: the model's `Meta.ordering`, else the pk
+        queryset = queryset.order_by('pk')
+    objects = {}
+    for obj in queryset:
+        objects.setdefault(getattr(obj, attname), obj)
+    return [objects.get(value) for value in values]
+
+
+def resolve_variables_in_bulk(users, compiled):
+    """ Return the values of the compiled specs for each user, fetching each object of all the users together """
+    users = list(users)
+    objects = {}
+    for spec, key in compiled:
+        if key is not None and key not in objects:
+            objects[key] = get_objects_in_bulk(users, spec)
+
+    rows = []
+    for i, user in enumerate(users):
+        values = []
+        for spec, key in compiled:
+            if key is None:
+                values.append(get_data(user, spec))
+                continue
+            obj = objects[key][i]
+            values.append(getattr(obj, spec['field'], None) if 'field' in spec else obj)
+        rows.append(values)
+    logging.debug("Resolved %s variables of %s users with %s bulk lookups", len(compiled), len(users), len(objects))
+    return rows
+
+
+class RenderPlan:
+    """
+    The compiled form of an OutgoingMessage for one kind of message (text, media, interactive or template).
+
+    All the variables of the message are collected into a single list, so they are resolved together,
+    and the static parts of the payload are prepared once and shared between renders (they must not be changed).
+    """
+
+    def __init__(self, message):
+        self.names = []
+        self.variables = []
+
+    def set_variables(self, named_specs):
+        self.names = list(named_specs)
+        self.variables = compile_variables(named_specs.values())
+
+    def resolve(self, user):
+        if not self.variables:
+            return []
+        return resolve_variables(user, self.variables)
+
+    def render_text(self, user, text):
+        if not self.names:
+            return text
+        return text.format(**dict(zip(self.names, self.resolve(user))))
+
+
+class TextPlan(RenderPlan):
+    def __init__(self, message):
+        super().__init__(message)
+        if message.message_variables:
+            self.set_variables(message.message_variables)
+
+
+class MediaPlan(RenderPlan):
+    def __init__(self, message):
+        super().__init__(message)
+        if caption := message.message_variables.get('caption'):
+            self.set_variables(caption)
+        self.media_type = message.message_variables['media']['type']
+        self.payload = message.message_variables['media']['payload']  # TODO make dynamic
+
+    def render(self, user, text):
+        """ Return the media data for `get_media_message_data` """
+        payload = self.payload
+        if text:
+            payload = {**payload, 'caption': self.render_text(user, text)}
+        return {
+            'media_type': self.media_type,
+            'payload': payload
+        }
+
+
+class InteractivePlan(RenderPlan):
+    def __init__(self, message):
+        super().__init__(message)
+        variables = message.message_variables or {}
+        self.parts = {k: v for k, v in variables.items() if k != 'body'}
+        self.body = {}
+        if body := variables.get('body'):
+            self.body = {k: v for k, v in body.items() if k != 'variables'}
+            self.set_variables(body['variables'])
+
+        match message.type:  # there are other type that not implemented yet
+            case 'quick_reply':
+                self.parts['type'] = 'button'
+                self.parts['action'] = {
+                    "buttons": [create_button(id_, name) for id_, name in
+                                get_quick_replies_as_flat_list(message.quick_reply)]
+                }
+
+    def render(self, user, text):
+        parts = dict(self.parts)
+        parts['body'] = {**self.body, 'text': self.render_text(user, text)}
+        return parts
+
+
+class TemplatePlan(RenderPlan):
+    def __init__(self, message):
+        super().__init__(message)
+        self.components = None
+        if not message.message_variables:
+            return
+
+        specs = []
+        self.components = []
+        for component in message.message_variables:
+            parameters = []
+            for parameter in component['parameters']:
+                slot = None
+                if 'variable' in parameter:
+                    slot = len(specs)
+                    specs.append(parameter['variable'])
+                    parameter = {k: v for k, v in parameter.items() if k != 'variable'}
+                parameters.append((parameter, slot))
+            self.components.append(({k: v for k, v in component.items() if k != 'parameters'}, parameters))
+        self.variables = compile_variables(specs)
+
+    def render(self, user):
+        if self.components is None:
+            return None
+        return self.build(self.resolve(user))
+
+    def render_many(self, users):
+        """ Return the components of each user, with the variables of all the users resolved together """
+        if self.components is None:
+            return [None] * len(users)
+        if not self.variables:
+            return [self.build([]) for _ in users]
+        return [self.build(values) for values in resolve_variables_in_bulk(users, self.variables)]
+
+    def build(self, values):
+        return [
+            {**component,
+             'parameters': [parameter if slot is None else {**parameter, parameter['type']: str(values[slot])}
+                            for parameter, slot in parameters]}
+            for component, parameters in self.components
+        ]
+
+
+PLAN_TYPES = {
+    'text': TextPlan,
+    'media': MediaPlan,
+    'interactive': InteractivePlan,
+    'template': TemplatePlan,
+}
+
+
+def get_render_plan(message, kind):
+    """ Return the plan of the message, plans of messages of the compiled flow are compiled only once """
+    plan_type = PLAN_TYPES[kind]
+    flow = get_flow()
+    if flow.get_message(message.key) is not message:
+        return plan_type(message)
+
+    key = ('render', message.key, kind)
+    if (plan := flow.compiled.get(key)) is None:
+        plan = flow.compiled[key] = plan_type(message)
+    return plan
@@ -0,0 +1,82 @@
+import logging
+import zlib
+from contextlib import contextmanager
+
+from django.core.cache import caches
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.exceptions import UserLockedException
+from whatsapp_business_api_is.locks import CacheLock
+
+USER_LOCK_CACHE_KEY = 'wab_is:user_lock:{number}'
+
+
+def get_user_queue(number):
+    """
+    Return the queue of the user, or None when `Conf.USER_QUEUES` is not set.
+
+    The users are hashed on a fixed set of queues, so all the tasks of a user go to the same queue.
+    To keep each user's messages in order, every queue should be consumed by a single worker process, e.g.
+    `celery worker -Q wab_is_user_0 -c 1`, while the different queues can be spread on all cores and nodes.
+    """
+    if not Conf.USER_QUEUES:
+        return None
+    return f"{Conf.USER_QUEUE_PREFIX}{zlib.crc32(str(number).encode()) % Conf.USER_QUEUES}"
+
+
+def _get_task_number(name, args, kwargs):
+    match name.rsplit('.', 1)[-1]:
+        case 'parse_incoming_message':
+            raw_msg = args[0] if args else kwargs['raw_msg']
+            return raw_msg['from']
+        case 'parse_incoming_messages':
+            raw_msgs = args[0] if args else kwargs['raw_msgs']
+            return raw_msgs[0]['from'] if raw_msgs else None
+        case 'async_send_message':
+            return args[0] if args else kwargs['user_id']
+    return None
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Celery router that sends the tasks of each user to the user's queue.
+
+    Add it to the Celery configuration: `task_routes = ('whatsapp_business_api_is.routing.route_task',)`
+    """
+    if not name.startswith('whatsapp_business_api_is.'):
+        return None
+    try:
+        number = _get_task_number(name, args, kwargs)
+    except (IndexError, KeyError, TypeError):
+        return None
+    if number and (queue := get_user_queue(number)):
+        return {'queue': queue}
+    return None
+
+
+@contextmanager
+def user_lock(number):
+    """
+    Make sure only one task handles the user at a time (across all workers), when `Conf.USER_LOCK_TIMEOUT` is set.
+
+    Wait up to `Conf.USER_LOCK_WAIT` seconds for the lock, then raise `UserLockedException`.
+    The lock expires after `Conf.USER_LOCK_TIMEOUT` seconds in case the worker died while holding it, and is not
+    renewed, so the timeout must be longer than the longest task (see `Conf.USER_LOCK_TIMEOUT`).
+
+    The lock is a mutual exclusion only, it doesn't keep the user's messages in order: a task that is retried
+    on `UserLockedException` goes behind the newer tasks of the user. The order is kept by the user queues
+    (`Conf.USER_QUEUES`, each consumed by a single worker process).
+    """
+    if not Conf.USER_LOCK_TIMEOUT:
+        yield
+        return
+
+    lock = CacheLock(caches[Conf.CACHE_ALIAS], USER_LOCK_CACHE_KEY.format(number=number), Conf.USER_LOCK_TIMEOUT)
+    if not lock.acquire(Conf.USER_LOCK_WAIT, Conf.USER_LOCK_POLL_INTERVAL):
+        raise UserLockedException(f"User {number} is locked by another task")
+    logging.debug("Locked user %s", number)
+
+    try:
+        yield
+    finally:
+        lock.release()
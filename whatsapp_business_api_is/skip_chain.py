@@ -0,0 +1,127 @@
+import logging
+
+from whatsapp_business_api_is.flow import get_flow
+from whatsapp_business_api_is.metrics import span
+from whatsapp_business_api_is.render import compile_variables
+from whatsapp_business_api_is.user_session import get_user_session
+from whatsapp_business_api_is.utils import get_data, get_object, get_unique_objects, value_exists
+
+
+class SkipNode:
+    __slots__ = ('message', 'data', 'key', 'next_key')
+
+    def __init__(self, message, data, key, next_key):
+        self.message = message
+        self.data = data  # the data to look for, None if the message is never skipped
+        self.key = key  # the lookup key of the data object (see `compile_variables`)
+        self.next_key = next_key  # the message to skip to
+
+
+def get_skip_data(flow, message):
+    """ Same rules as `is_data_exist` """
+    if message.skip_if_exists:
+        return message.skip_if_exists
+    responses = flow.get_responses(message)
+    if not responses or not responses[0].actions:
+        return None
+    data = responses[0].actions.get('save_data')
+    if not data or data.get('do_not_skip', False):
+        return None
+    return data
+
+
+class SkipChain:
+    """
+    All the messages that may be skipped when starting from a message, in order, precomputed from the flow.
+    The chain ends at the first message that is never skipped, or before a message that is already in the chain.
+    """
+
+    def __init__(self, flow, message):
+        self.nodes = []
+        self.cycle = False
+        seen = set()
+        while message is not None:
+            if message.key in seen:
+                self.cycle = True
+                break
+            seen.add(message.key)
+            data = get_skip_data(flow, message)
+            if data is None:
+                break
+            if message.skip_if_exists:
+                next_key = message.skip_if_exists.get('next_message')
+            else:
+                default_response = flow.get_default_response(message)
+                next_key = default_response.reply_id if default_response else None
+            [(_, key)] = compile_variables([data])
+            self.nodes.append(SkipNode(message, data, key, next_key))
+            message = flow.get_message(next_key)
+
+
+def get_skip_chain(message):
+    flow = get_flow()
+    if flow.get_message(message.key) is not message:
+        return SkipChain(flow, message)
+
+    key = ('skip_chain', message.key)
+    if (chain := flow.compiled.get(key)) is None:
+        chain = flow.compiled[key] = SkipChain(flow, message)
+    return chain
+
+
+def _get_objects_cache(user):
+    """ The data objects fetched for the user, kept for the whole task when there is a user session """
+    if session := get_user_session(user):
+        return session.cache.setdefault('skip_objects', {})
+    return {}
+
+
+def node_data_exists(user, node, objects):
+    try:
+        if node.key is None:
+            value = get_data(user, node.data)
+        else:
+            if node.key not in objects:
+                objects[node.key] = get_object(user, node.data)
+            obj = objects[node.key]
+            value = getattr(obj, node.data['field'], None) if 'field' in node.data else obj
+        logging.info("Found value=%r", value)
+        return value_exists(value, node.data)
+    except Exception as e:
+        logging.debug("Not found e=%r", e)
+        return False
+
+
+def walk_skip_chain(user, message, on_hop=None):
+    """
+    Return the first message of the chain that starts at `message` and should not be skipped for the user.
+
+    The data of the chain is looked up by model and filter, so messages that check fields of the same object
+    share one query, and the objects of the chain that are found by a unique field are fetched together
+    (see `get_unique_objects`). The objects are memoized for the user for the rest of the task.
+    Each hop is measured as a `skip_hop` span.
+    Return None when a skipped message has no next message.
+    """
+    if message is None:
+        return None
+    flow = get_flow()
+    chain = get_skip_chain(message)
+    objects = _get_objects_cache(user)
+    prefetched = False
+    for node in chain.nodes:
+        with span('skip_hop'):
+            if not prefetched and node.key is not None and node.key not in objects:
+                objects.update(get_unique_objects(user, {n.key: n.data for n in chain.nodes
+                                                         if n.key is not None and n.key not in objects}))
+                prefetched = True
+            if not node_data_exists(user, node, objects):
+                return node.message
+            message = flow.get_message(node.next_key)
+            if message is None:
+                logging.error("No next message to skip to from %s (next_message=%s)", node.message.key, node.next_key)
+                return None
+        if on_hop:
+            on_hop(message)
+    if chain.cycle:
+        logging.error("skip_if_exists loop detected, stopping at %s", message.key)
+    return message
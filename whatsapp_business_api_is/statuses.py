@@ -0,0 +1,144 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.db import close_old_connections, transaction, IntegrityError
+from django.db.models import F
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.dedup import forget_messages
+from whatsapp_business_api_is.models import MessageStatus, WaUser, MESSAGE_STATUSES, STATUS_FAILED
+
+STATUS_CODES = {name: code for code, name in MESSAGE_STATUSES}
+
+
+def status_key(status):
+    """ The dedup key of a status callback (see `whatsapp_business_api_is.dedup`) """
+    if not isinstance(status, dict):
+        return None  # never a duplicate, `_parse_status` skips it
+    return f"{status.get('id')}:{status.get('status')}"
+
+
+def _parse_status(status):
+    """ Return the MessageStatus of a status callback, or None for a malformed one (which is skipped) """
+    try:
+        if (code := STATUS_CODES.get(status.get('status'))) is None:
+            logging.warning("Unknown status %r", status)
+            return None
+        errors = status.get('errors') or [{}]
+        return MessageStatus(message_id=status['id'],
+                             user_id=status['recipient_id'],
+                             status=code,
+                             timestamp=datetime.fromtimestamp(int(status['timestamp']), tz=timezone.utc),
+                             error_code=errors[0].get('code'))
+    except (AttributeError, KeyError, IndexError, TypeError, ValueError) as e:
+        logging.warning("Malformed status %r: %r", status, e)
+        return None
+
+
+def _create_failed(obj):
+    """ Save a `failed` status on its own, return False if it was already saved """
+    try:
+        with transaction.atomic():
+            obj.save(force_insert=True)
+        return True
+    except IntegrityError:
+        return False
+
+
+def write_statuses(statuses):
+    """
+    Save the status callbacks in bulk and add the `failed` statuses to `WaUser.delivery_failure_count`,
+    with one update per distinct count.
+    Statuses that were already saved are ignored, and are not counted again. The `failed` statuses (which are rare)
+    are inserted one by one, so only the new ones are counted, in the same transaction as the counts.
+    """
+    objs = [obj for status in statuses if (obj := _parse_status(status)) is not None]
+    if not objs:
+        return
+    failed = [obj for obj in objs if obj.status == STATUS_FAILED]
+    with transaction.atomic():  # the failures are counted only with their statuses, also when retried
+        MessageStatus.objects.bulk_create([obj for obj in objs if obj.status != STATUS_FAILED],
+                                          batch_size=Conf.STATUS_BATCH_SIZE, ignore_conflicts=True)
+
+        failures = Counter(obj.user_id for obj in failed if _create_failed(obj))
+        numbers_by_count = {}
+        for number, count in failures.items():
+            numbers_by_count.setdefault(count, []).append(number)
+        for count, numbers in numbers_by_count.items():
+            WaUser.objects.filter(number__in=numbers).update(delivery_failure_count=F('delivery_failure_count') + count)
+    logging.info("Saved %s statuses (%s failed)", len(objs), sum(failures.values()))
+
+
+def forget_statuses(statuses):
+    """ Let the provider deliver the statuses again, after they failed to be saved """
+    forget_messages(statuses, key=status_key)
+
+
+class StatusBuffer:
+    """
+    Collect status callbacks in memory and write them together, when there are `batch_size` of them
+    or every `interval` seconds (by a background thread), whichever comes first.
+    The statuses are acknowledged to the provider before they are written, so the statuses that are still in memory
+    when the process dies are lost (they are written on a normal exit).
+    """
+
+    def __init__(self, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.statuses = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='wab-is-statuses', daemon=True)
+        self._thread.start()
+
+    def add(self, statuses):
+        with self._lock:
+            self.statuses.extend(statuses)
+            if len(self.statuses) < self.batch_size:
+                return
+            batch, self.statuses = self.statuses, []
+        self._write(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self.statuses = self.statuses, []
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            write_statuses(batch)
+        except Exception as e:
+            logging.exception("Failed to save %s statuses: %s", len(batch), e)
+            forget_statuses(batch)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+            close_old_connections()  # the thread lives as long as the process, like a request that never ends
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+
+
+_buffer = None
+_buffer_pid = None
+_lock = threading.Lock()
+
+
+def get_status_buffer():
+    """ Return the status buffer of the current process, it is written at exit too """
+    global _buffer, _buffer_pid
+
+    if _buffer is None or _buffer_pid != os.getpid():
+        with _lock:
+            if _buffer is None or _buffer_pid != os.getpid():
+                _buffer = StatusBuffer(Conf.STATUS_BATCH_SIZE, Conf.STATUS_FLUSH_INTERVAL)
+                _buffer_pid = os.getpid()
+                atexit.register(_buffer.close)
+    return _buffer
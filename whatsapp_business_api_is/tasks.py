@@ -1,70 +1,201 @@
 import logging
 
-from celery import shared_task
+from celery import shared_task, Task
+from celery.signals import worker_init, after_setup_logger
 from django.core.exceptions import ValidationError
+from django.db import DatabaseError
 
+from whatsapp_business_api_is import codec  # registers the task serializer, see `Conf.TASK_SERIALIZER`
+from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.exceptions import UserLockedException, ReplyFailedException
+from whatsapp_business_api_is.flow import get_flow
+from whatsapp_business_api_is.logs import log_context, setup_logging
+from whatsapp_business_api_is.metrics import span, trace
 from whatsapp_business_api_is.messages import send_error_message, \
-    send_unknown_message, get_next_message, send_next_message
+    send_unknown_message, get_next_message, send_next_message, get_retry_delay
 from whatsapp_business_api_is.models import WaUser, OutgoingMessage
+from whatsapp_business_api_is.routing import user_lock, get_user_queue
+from whatsapp_business_api_is.statuses import write_statuses
 from whatsapp_business_api_is.user_msg import msg_factory
+from whatsapp_business_api_is.user_session import user_session
 from whatsapp_business_api_is.utils import get_start_message, \
     validate_value, \
-    run_actions, \
-    get_quick_replies_as_flat_list
+    run_actions
 
+TASK_OPTIONS = {'serializer': Conf.TASK_SERIALIZER} if Conf.TASK_SERIALIZER else {}
 
-@shared_task
-def async_send_message(user_id, msg, incoming_message_id, reply_message_id):
-    logging.info(f"About to send {reply_message_id} to {user_id}")
-    user = WaUser.objects.filter(number=user_id).first()
-    incoming_message = OutgoingMessage.objects.filter(pk=incoming_message_id).first()
 
-    reply_message = get_next_message(user,
-                                     None,
-                                     next_message=OutgoingMessage.objects.get(pk=reply_message_id))
+@worker_init.connect
+def load_flow_on_worker_init(**kwargs):
+    """
+    Load the flow artifact when the worker starts (before the pool processes are forked), so a broken artifact
+    fails the worker instead of the first message.
+    """
+    if Conf.FLOW_ARTIFACT:
+        get_flow()
+
+
+@after_setup_logger.connect
+def setup_structured_logging(logger=None, **kwargs):
+    """ Move the handlers Celery set on the root logger (which replaced the ones of `apps.ready`) behind the queue """
+    if Conf.STRUCTURED_LOGGING:
+        setup_logging(logger)
+
+
+class UserTask(Task):
+    """ A task retried while its user is locked, up to `Conf.USER_LOCK_RETRIES` times """
+
+    autoretry_for = (UserLockedException,)
+    retry_backoff = True
+    max_retries = Conf.USER_LOCK_RETRIES
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        if isinstance(exc, UserLockedException):
+            logging.error("Dropping %s%r %r after %s retries: %s", self.name, args, kwargs, self.request.retries, exc)
+
+
+def send_reply_later(e, attempt=0, next_msgs=None):
+    """
+    Send the reply that failed (and the messages after it) again with `async_send_message`,
+    after the `Retry-After` of the provider or with backoff, up to `Conf.SEND_RETRIES` times.
+    The user message is not routed again, the changes made before the error (like the state) are kept,
+    and only the actions of the reply run again (waits up to `Conf.SEND_RETRY_MAX_WAIT` are retried in place
+    by `post_message`, without this).
+    `next_msgs` are the user's next raw messages, enqueued once the reply was sent (or dropped).
+    """
+    if attempt >= Conf.SEND_RETRIES:
+        raise e.error
+    countdown = get_retry_delay(e.error, attempt)
+    logging.warning("%s, sending again in %.2f seconds", e, countdown)
+    async_send_message.apply_async((e.number,
+                                    e.msg.raw_msg if e.msg else None,
+                                    e.incoming_message.key if e.incoming_message else None,
+                                    e.reply_message.key),
+                                   {'attempt': attempt + 1, 'next_msgs': next_msgs},
+                                   queue=get_user_queue(e.number),
+                                   countdown=countdown)
+
+
+@shared_task(base=UserTask, **TASK_OPTIONS)
+def async_send_message(user_id, msg, incoming_message_id, reply_message_id, attempt=0, next_msgs=None):
+    """
+    Send the reply (and the messages after it) to the user, then enqueue the user's next raw messages `next_msgs`.
+    `msg` is the raw message of the user (or None), `attempt` counts the sends of the reply that failed before.
+    """
+    logging.info("About to send %s to %s", reply_message_id, user_id)
+    flow = get_flow()
+    incoming_message = flow.incoming.get(incoming_message_id)
+    if isinstance(msg, dict):
+        msg = msg_factory(msg)
+
+    with log_context(wa_user=user_id), user_lock(user_id):
+        user = WaUser.objects.filter(number=user_id).first()
+        with user_session(user):
+            reply_message = get_next_message(user,
+                                             None,
+                                             next_message=flow.require_message(reply_message_id))
+
+            try:
+                send_next_message(user, msg, incoming_message, reply_message)
+            except ReplyFailedException as e:
+                send_reply_later(e, attempt, next_msgs)
+                next_msgs = None  # enqueued after the next attempt
+            finally:
+                if next_msgs:
+                    parse_incoming_messages.apply_async((next_msgs,), queue=get_user_queue(user_id))
+
+
+@shared_task(bind=True, base=UserTask, **TASK_OPTIONS)
+def parse_incoming_message(self, raw_msg):
+    """
+    Handle a message of the user.
+    A reply that failed with a retryable error is sent again later by `send_reply_later`, or, when the parser
+    is called directly (by `parse_incoming_messages`), `ReplyFailedException` is raised to the caller.
+    The user's next messages that are already enqueued are not deferred, so they are handled before the reply
+    is sent again (see `Conf.SEND_RETRY_MAX_WAIT`).
+    """
+    with trace('parse_incoming_message'):
+        with span('msg_factory'):
+            msg = msg_factory(raw_msg)
+        logging.debug('msg=%r', msg.raw_msg)
+
+        with log_context(wa_user=msg.number, wa_message_id=raw_msg.get('id')), user_lock(msg.number):
+            user, _ = WaUser.objects.get_or_create(number=msg.number)
+
+            if user.disable_bot:
+                logging.debug('Bot is disabled for %s', user)
+                return
+
+            with user_session(user):
+                try:
+                    handle_message(user, msg)
+                except ReplyFailedException as e:
+                    if self.request.called_directly:
+                        raise
+                    send_reply_later(e)
+
+
+def handle_message(user, msg):
+    with span('routing'):
+        route = route_message(user, msg)
+    if route is None:
+        return
+    incoming_message, reply_message, ignore_validation = route
+
+    try:
+        if not ignore_validation:
+            with span('validate_value'):
+                validate_value(user, msg, incoming_message)
+        run_actions(user, msg, incoming_message)
+    except ValidationError as e:
+        logging.error("e.message=%r", e.message)
+        send_error_message(user, e)
+        return
+
+    if not reply_message:
+        reply_message = get_next_message(user, incoming_message)
 
     send_next_message(user, msg, incoming_message, reply_message)
 
 
-@shared_task
-def parse_incoming_message(raw_msg):
+def route_message(user, msg):
+    """
+    Find the IncomingMessage (and the reply, if already known) for the user message.
+    Return None if the message was already handled.
+    """
     reply_message = None
     incoming_message = None
-    msg = msg_factory(raw_msg)
     msg_type = msg.type
-    logging.debug(f'{msg.__dict__=}')
     ignore_validation = False
+    flow = get_flow()
 
-    user, _ = WaUser.objects.get_or_create(number=msg.number)
-
-    if user.disable_bot:
-        logging.debug(f'Bot is disabled for {user}')
-        return
     if msg_type == 'text' and (incoming_message := get_start_message(msg.text)):
 
-        logging.info(f"Start message")
+        logging.info("Start message")
 
         reply_message = incoming_message.reply
-    elif user.state.pk == 'initial':
-        if initial_welcome_message := OutgoingMessage.objects.filter(key='initial_welcome_message').first():
-            logging.info(f"Unknown message from new user")
+    elif user.state_id == OutgoingMessage.DEFAULT_STATE:
+        if initial_welcome_message := flow.get_message('initial_welcome_message'):
+            logging.info("Unknown message from new user")
             send_next_message(user, None, None, initial_welcome_message)
         else:
             send_unknown_message(user)
         return
     elif msg_type == 'text' and msg.text == '*':
-        reply_message = get_next_message(user, None, user.state)
+        reply_message = get_next_message(user, None, flow.get_message(user.state_id))
         ignore_validation = True
     elif (msg_type == 'button' and msg.button_payload == "wab_is_do_nothing") or \
             (msg_type == "interactive" and msg.button_reply_id == "wab_is_do_nothing"):
         return
     else:
-        current_state = user.state
-        logging.info(f"{current_state=}")
-        logging.debug(f"{current_state.responses.all()=} {current_state.responses.exists()=}")
-        if not current_state.responses.exists():
-            if no_waiting_response_message := OutgoingMessage.objects.filter(key='no_waiting_response_message').first():
-                logging.info(f"No waiting response")
+        current_state = flow.require_message(user.state_id)
+        responses = flow.get_responses(current_state)
+        logging.info("current_state=%s", current_state)
+        logging.debug("responses=%s", responses)
+        if not responses:
+            if no_waiting_response_message := flow.get_message('no_waiting_response_message'):
+                logging.info("No waiting response")
                 send_next_message(user, None, None, no_waiting_response_message)
             else:
                 send_unknown_message(user)
@@ -84,45 +215,87 @@ def parse_incoming_message(raw_msg):
                     elif msg_type == 'text':
                         button_text = msg.text
 
-                    for button_key, button_pattern in get_quick_replies_as_flat_list(current_state.quick_reply):
-                        if button_pattern == button_text:
-                            break
-                    else:
+                    if (button_key := flow.match_button(current_state, button_text)) is None:
                         send_unknown_message(user)
                         return
 
-                logging.debug(f"{button_key=}")
-                incoming_message = current_state.responses.filter(key=button_key).first()
+                logging.debug("button_key=%r", button_key)
+                incoming_message = flow.get_response(current_state, button_key)
             case 'choices':
                 msg_text = msg.text if hasattr(msg, 'text') else None
-                incoming_message = None
-                choice_key_prefix = f"{current_state.key}_resp_"
-                logging.debug(f'{choice_key_prefix=}')
-                if msg_text:
-                    incoming_message = current_state.responses.filter(key__startswith=choice_key_prefix,
-                                                                      pattern=msg_text).first()
-                if not incoming_message:
-                    incoming_message = current_state.responses.filter(key=f"{choice_key_prefix}_default_choice").first()
+                incoming_message = flow.match_choice(current_state, msg_text)
             case 'text':
-                incoming_message = current_state.responses.first()
+                incoming_message = responses[0]
             case _:
-                incoming_message = current_state.responses.first()
-        logging.info(f"{incoming_message=}")
+                incoming_message = responses[0]
+        logging.info("incoming_message=%s", incoming_message)
         if not incoming_message:
-            logging.info(f"No message found")
+            logging.info("No message found")
             send_unknown_message(user)
             return
 
-    try:
-        if not ignore_validation:
-            validate_value(user, msg, incoming_message)
-        run_actions(user, msg, incoming_message)
-    except ValidationError as e:
-        logging.error(f"{e.message=}")
-        send_error_message(user, e)
+    return incoming_message, reply_message, ignore_validation
+
+
+@shared_task(**TASK_OPTIONS)
+def parse_incoming_messages(raw_msgs, handled=None):
+    """
+    Parse all the messages of a webhook in a single task.
+    The messages are handled one after the other, so the order of each sender's messages is kept.
+
+    The parser is called directly, so it is not retried on `UserLockedException`: the message and the user's
+    next messages are enqueued again, together, on the user's queue.
+    A reply that failed with a retryable error is sent again later (`send_reply_later`),
+    and the user's next messages are enqueued once it was sent.
+
+    When called directly (`Conf.WEBHOOK_MODE='inline'`), the messages that were handled are added to `handled`,
+    so the webhook lets the provider redeliver only the others when this fails. There is no broker to defer
+    anything to: the messages of a locked user are left to the provider (`UserLockedException` is raised once
+    the others were handled), and a reply that still failed after the in-place retries of `post_message` is dropped.
+    """
+    parser = WhatsappBusinessApiIsConfig.incoming_parser
+    inline = handled is not None
+    handled = handled if inline else []
+    pending = {}  # number -> (messages, the reply that failed or None)
+    locked = None
+    for raw_msg in raw_msgs:
+        number = raw_msg.get('from')
+        if number in pending:
+            pending[number][0].append(raw_msg)
+            continue
+        try:
+            parser(raw_msg)
+        except UserLockedException as e:
+            logging.info("%s, leaving the user's messages to the provider" if inline else
+                         "%s, enqueueing the user's messages again", e)
+            pending[number] = ([raw_msg], None)
+            locked = locked or e
+            continue
+        except ReplyFailedException as e:
+            if inline:
+                logging.error("%s, dropping the reply", e)
+            else:
+                pending[number] = ([], e)
+        except Exception as e:
+            logging.exception("Failed to parse message: %s", e)
+        handled.append(raw_msg)
+
+    if inline:
+        if locked:
+            raise locked
         return
 
-    if not reply_message:
-        reply_message = get_next_message(user, incoming_message)
+    for number, (user_msgs, failed_reply) in pending.items():
+        if failed_reply:
+            try:
+                send_reply_later(failed_reply, next_msgs=user_msgs)
+                user_msgs = None  # enqueued once the reply was sent
+            except Exception as e:
+                logging.exception("Failed to parse message: %s", e)
+        if user_msgs:
+            parse_incoming_messages.apply_async((user_msgs,), queue=get_user_queue(number))
 
-    send_next_message(user, msg, incoming_message, reply_message)
+
+@shared_task(autoretry_for=(DatabaseError,), retry_backoff=True, max_retries=5, **TASK_OPTIONS)
+def save_statuses(statuses):
+    write_statuses(statuses)
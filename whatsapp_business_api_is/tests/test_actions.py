@@ -0,0 +1,58 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from whatsapp_business_api_is import utils
+from whatsapp_business_api_is.actions import ActionPipeline, action
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.models import OutgoingMessage, WaUser
+from whatsapp_business_api_is.utils import run_actions
+
+
+def rename(user, msg, msg_obj=None, data=None):
+    WaUser.objects.filter(number=user.number).update(name=data['name'])
+
+
+@action(mutates_user=False)
+def report(user, msg, msg_obj=None, data=None):
+    pass
+
+
+FUNCTIONS = {'rename': rename, 'report': report}
+
+
+class ActionPipelineTest(TestCase):
+
+    def setUp(self):
+        OutgoingMessage.objects.create(key=OutgoingMessage.DEFAULT_STATE)
+        self.user = WaUser.objects.create(number='111')
+
+    def run_actions(self, actions):
+        message = OutgoingMessage(key='ask_name', actions=actions)
+        pipeline = ActionPipeline(message, functions=FUNCTIONS)
+        with mock.patch.object(utils, 'get_action_pipeline', return_value=pipeline):
+            run_actions(self.user, None, message)
+
+    def test_mutating_actions_refresh_the_user(self):
+        self.run_actions({'rename': {'name': 'Dana'}})
+
+        self.assertEqual(self.user.name, 'Dana')
+
+    def test_other_actions_do_not_refresh_the_user(self):
+        with self.assertNumQueries(0):
+            self.run_actions({'report': None})
+
+    @mock.patch.object(Conf, 'ACTIONS_MUTATE_USER_BY_DEFAULT', False)
+    def test_undeclared_actions_use_the_default(self):
+        self.run_actions({'rename': {'name': 'Dana'}})
+
+        self.assertEqual(self.user.name, '')
+        self.assertEqual(WaUser.objects.get(number='111').name, 'Dana')
+
+    def test_steps_are_in_order(self):
+        message = OutgoingMessage(key='rename', actions={'report': None, 'missing': None})
+
+        pipeline = ActionPipeline(message, functions=FUNCTIONS)
+
+        self.assertEqual([(name, mutates_user) for name, _, _, mutates_user in pipeline.steps],
+                         [('rename', True), ('report', False)])
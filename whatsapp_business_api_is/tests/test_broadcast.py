@@ -0,0 +1,43 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from whatsapp_business_api_is import broadcast as broadcast_module
+from whatsapp_business_api_is.broadcast import broadcast, resend_failed
+from whatsapp_business_api_is.models import OutgoingMessage, WaUser
+
+
+class BroadcastTest(TestCase):
+
+    def setUp(self):
+        OutgoingMessage.objects.create(key=OutgoingMessage.DEFAULT_STATE)
+        self.message = OutgoingMessage.objects.create(key='promo', type='template', template_name='promo')
+        for number in ('111', '222', '333'):
+            WaUser.objects.create(number=number)
+        self.unreachable = {'222'}
+        patcher = mock.patch.object(broadcast_module, 'send_chunk', self.send_chunk)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send_chunk(self, message, users):
+        return [user.number for user in users if user.number not in self.unreachable]
+
+    def test_records_the_failed_users(self):
+        campaign = broadcast(self.message, WaUser.objects.all(), name='promo', chunk_size=2)
+
+        self.assertEqual((campaign.sent, campaign.failed, campaign.failed_numbers), (2, 1, ['222']))
+
+    def test_resend_failed(self):
+        campaign = broadcast(self.message, WaUser.objects.all(), name='promo', chunk_size=2)
+
+        self.unreachable = set()
+        campaign = resend_failed(campaign)
+
+        self.assertEqual((campaign.sent, campaign.failed, campaign.failed_numbers), (3, 0, []))
+
+    def test_resend_failed_keeps_the_users_it_fails_for_again(self):
+        campaign = broadcast(self.message, WaUser.objects.all(), name='promo', chunk_size=2)
+
+        campaign = resend_failed(campaign)
+
+        self.assertEqual((campaign.sent, campaign.failed, campaign.failed_numbers), (2, 1, ['222']))
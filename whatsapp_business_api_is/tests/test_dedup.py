@@ -0,0 +1,84 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from whatsapp_business_api_is import dedup
+from whatsapp_business_api_is.dedup import LRU, drop_duplicates
+
+
+class FakeCache:
+    """ A cache that fails on the keys in `failing` """
+
+    def __init__(self, failing=()):
+        self.keys = set()
+        self.failing = set(failing)
+
+    def add(self, key, value, timeout):
+        if key in self.failing:
+            raise ConnectionError("redis down")
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def delete_many(self, keys):
+        self.keys.difference_update(keys)
+
+
+class DropDuplicatesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = FakeCache()
+        patchers = [
+            mock.patch.object(dedup, '_seen', LRU(100, 60)),
+            mock.patch.object(dedup, 'caches', {dedup.Conf.CACHE_ALIAS: self.cache}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_drops_seen_messages(self):
+        self.assertEqual(drop_duplicates([{'id': '1'}, {'id': '2'}]), [{'id': '1'}, {'id': '2'}])
+        self.assertEqual(drop_duplicates([{'id': '1'}, {'id': '3'}, {}]), [{'id': '3'}, {}])
+
+    def test_redelivery_after_cache_failure(self):
+        self.cache.failing.add(dedup.SEEN_CACHE_KEY.format(id='1'))
+        with self.assertRaises(ConnectionError):
+            drop_duplicates([{'id': '1'}])
+
+        self.cache.failing.clear()
+        self.assertEqual(drop_duplicates([{'id': '1'}]), [{'id': '1'}])
+
+    def test_forgets_the_messages_before_the_failure(self):
+        self.cache.failing.add(dedup.SEEN_CACHE_KEY.format(id='2'))
+        with self.assertRaises(ConnectionError):
+            drop_duplicates([{'id': '1'}, {'id': '2'}])
+
+        self.cache.failing.clear()
+        self.assertEqual(drop_duplicates([{'id': '1'}, {'id': '2'}]), [{'id': '1'}, {'id': '2'}])
+
+    def test_handle_webhook_forgets_messages_that_failed_to_enqueue(self):
+        from whatsapp_business_api_is.views import handle_webhook
+
+        data = {'messages': [{'id': '1', 'from': '111'}]}
+        with mock.patch('whatsapp_business_api_is.views.enqueue_messages', side_effect=ConnectionError("broker down")):
+            with self.assertRaises(ConnectionError):
+                handle_webhook(data)
+
+        with mock.patch('whatsapp_business_api_is.views.enqueue_messages') as enqueue_messages:
+            handle_webhook(data)
+        enqueue_messages.assert_called_once_with(data['messages'], [])
+
+    def test_handle_webhook_forgets_only_the_messages_that_were_not_enqueued(self):
+        from whatsapp_business_api_is.views import handle_webhook
+
+        data = {'messages': [{'id': '1', 'from': '111'}, {'id': '2', 'from': '222'}, {'id': '3', 'from': '333'}]}
+        parser = mock.Mock()
+        parser.apply_async.side_effect = [None, ConnectionError("broker down")]
+        with mock.patch('whatsapp_business_api_is.views.WhatsappBusinessApiIsConfig.incoming_parser', parser), \
+                mock.patch('whatsapp_business_api_is.views.Conf.WEBHOOK_MODE', 'task'):
+            with self.assertRaises(ConnectionError):
+                handle_webhook(data)
+
+        # the first message was enqueued, the provider's redelivery must not enqueue it again
+        self.assertEqual(drop_duplicates(data['messages']), data['messages'][1:])
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from whatsapp_business_api_is.dispatcher import Dispatcher
+
+
+class DispatcherTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dispatcher = Dispatcher(concurrency=4)
+        self.addCleanup(self.dispatcher.close, 5)
+
+    def test_jobs_of_a_key_run_in_order(self):
+        done = []
+
+        def job(i):
+            time.sleep(0.01 * (5 - i))  # the first jobs are the slowest
+            done.append(i)
+            return i
+
+        futures = [self.dispatcher.submit('111', job, i) for i in range(5)]
+
+        self.assertEqual([future.result(timeout=5) for future in futures], list(range(5)))
+        self.assertEqual(done, list(range(5)))
+
+    def test_jobs_of_different_keys_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        futures = [self.dispatcher.submit(key, barrier.wait) for key in ('111', '222')]
+
+        for future in futures:
+            future.result(timeout=5)  # raises BrokenBarrierError if the jobs ran one after the other
+
+    def test_errors_are_returned_by_the_future(self):
+        def fail():
+            raise ValueError("failed")
+
+        failed = self.dispatcher.submit('111', fail)
+        after = self.dispatcher.submit('111', lambda: 'sent')
+
+        self.assertIsInstance(failed.exception(timeout=5), ValueError)
+        self.assertEqual(after.result(timeout=5), 'sent')
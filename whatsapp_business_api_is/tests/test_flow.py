@@ -0,0 +1,29 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.flow import FlowGraph
+from whatsapp_business_api_is.models import OutgoingMessage, IncomingMessage, TYPE_USER_START
+
+
+def get_flow():
+    outgoing = [OutgoingMessage(key='welcome')]
+    incoming = [IncomingMessage(key='start', type=TYPE_USER_START, pattern='Hi  there', reply_id='welcome')]
+    return FlowGraph(outgoing, incoming)
+
+
+class MatchStartTest(SimpleTestCase):
+
+    @mock.patch.object(Conf, 'START_PATTERN_NORMALIZATION', [])
+    def test_exact_match(self):
+        flow = get_flow()
+
+        self.assertEqual(flow.match_start('Hi  there').key, 'start')
+        self.assertIsNone(flow.match_start('hi  there'))
+
+    @mock.patch.object(Conf, 'START_PATTERN_NORMALIZATION', ['case', 'whitespace'])
+    def test_match_like_mysql(self):
+        flow = get_flow()
+
+        self.assertEqual(flow.match_start('HI there ').key, 'start')
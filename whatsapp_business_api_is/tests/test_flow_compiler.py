@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+
+from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
+from whatsapp_business_api_is.flow import get_flow
+from whatsapp_business_api_is.flow_compiler import compile_flow, load_artifact
+from whatsapp_business_api_is.models import OutgoingMessage, IncomingMessage, TYPE_QUICK_REPLY
+
+
+def greet(user, msg, msg_obj=None, data=None):
+    pass
+
+
+class ArtifactTest(TestCase):
+
+    def setUp(self):
+        welcome = OutgoingMessage.objects.create(key='welcome', type=TYPE_QUICK_REPLY, text='Hello',
+                                                 quick_reply=[{'yes_resp': 'Yes'}])
+        done = OutgoingMessage.objects.create(key='done', text='Done')
+        IncomingMessage.objects.create(key='start', pattern='hi', reply=welcome, actions={'greet': None})
+        IncomingMessage.objects.create(key='yes_resp', type=TYPE_QUICK_REPLY, message=welcome, reply=done,
+                                       is_default=True)
+        patcher = mock.patch.dict(WhatsappBusinessApiIsConfig.FUNCTIONS, {'greet': greet})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, artifact):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(artifact, f)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_build_and_load(self):
+        artifact = compile_flow(get_flow())
+
+        flow = load_artifact(self.write(artifact))
+
+        self.assertEqual(flow.digest, artifact['digest'])
+        welcome = flow.get_message('welcome')
+        self.assertEqual(flow.match_start('hi').key, 'start')
+        self.assertIs(flow.match_start('hi').reply, welcome)
+        self.assertEqual(flow.match_button(welcome, 'Yes'), 'yes_resp')
+        self.assertIs(flow.get_default_response(welcome), flow.incoming['yes_resp'])
+        steps = flow.compiled[('actions', 'IncomingMessage', 'start')].steps
+        self.assertEqual([(name, func) for name, func, _, _ in steps], [('greet', greet)])
+
+    def test_changed_artifact(self):
+        artifact = compile_flow(get_flow())
+        artifact['tables']['start_messages']['hello'] = 'start'
+
+        with self.assertRaisesRegex(ValueError, 'digest'):
+            load_artifact(self.write(artifact))
+
+    def test_missing_function(self):
+        def local_greet(user, msg, msg_obj=None, data=None):
+            pass
+
+        with mock.patch.dict(WhatsappBusinessApiIsConfig.FUNCTIONS, {'greet': local_greet}):
+            artifact = compile_flow(get_flow())
+
+        with self.assertRaisesRegex(ValueError, 'greet'):
+            load_artifact(self.write(artifact))
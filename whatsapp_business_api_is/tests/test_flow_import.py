@@ -0,0 +1,62 @@
+import io
+import json
+
+from django.test import TestCase
+
+from whatsapp_business_api_is.flow_import import read_flow, import_flow
+from whatsapp_business_api_is.models import OutgoingMessage, IncomingMessage
+
+FLOW = [
+    # `next_message` points to a message later in the fixture
+    {'model': 'whatsapp_business_api_is.outgoingmessage', 'pk': 'welcome',
+     'fields': {'type': 'text', 'text': 'Hello', 'next_message': 'ask_color'}},
+    {'model': 'whatsapp_business_api_is.outgoingmessage', 'pk': 'ask_color',
+     'fields': {'type': 'choices', 'text': 'Which color?',
+                'choices': {'red': {'reply_key': 'red_reply'}, 'blue': {'reply_key': 'blue_reply'}}}},
+    {'model': 'whatsapp_business_api_is.outgoingmessage', 'pk': 'red_reply', 'fields': {'type': 'text', 'text': 'Red'}},
+    {'model': 'whatsapp_business_api_is.incomingmessage', 'pk': 'start',
+     'fields': {'type': 'user_start', 'pattern': 'hi', 'reply': 'welcome'}},
+]
+
+
+def load(flow=FLOW):
+    return read_flow(io.StringIO(json.dumps(flow)), 'json')
+
+
+class ImportFlowTest(TestCase):
+
+    def test_import(self):
+        stats = import_flow(*load())
+
+        # the reply of a choice that is not in the flow is created, like `get_or_create`
+        self.assertEqual(stats['outgoing'], {'created': 4, 'updated': 0, 'unchanged': 0})
+        # a response for each choice, like `outgoing_message_post_save`
+        self.assertEqual(stats['incoming'], {'created': 3, 'updated': 0, 'unchanged': 0})
+        self.assertEqual(OutgoingMessage.objects.get(key='welcome').next_message_id, 'ask_color')
+        response = IncomingMessage.objects.get(key='ask_color_resp_blue')
+        self.assertEqual((response.message_id, response.reply_id, response.pattern),
+                         ('ask_color', 'blue_reply', 'blue'))
+
+    def test_diff_round_trip(self):
+        import_flow(*load())
+
+        stats = import_flow(*load(), diff=True)
+
+        self.assertEqual(stats['outgoing'], {'created': 0, 'updated': 0, 'unchanged': 4})
+        self.assertEqual(stats['incoming'], {'created': 0, 'updated': 0, 'unchanged': 3})
+
+    def test_diff_writes_the_changed_messages(self):
+        import_flow(*load())
+        flow = json.loads(json.dumps(FLOW))
+        flow[2]['fields']['text'] = 'Red!'
+
+        stats = import_flow(*load(flow), diff=True)
+
+        self.assertEqual(stats['outgoing'], {'created': 0, 'updated': 1, 'unchanged': 3})
+        self.assertEqual(OutgoingMessage.objects.get(key='red_reply').text, 'Red!')
+
+    def test_dry_run(self):
+        stats = import_flow(*load(), dry_run=True)
+
+        self.assertEqual(stats['outgoing']['created'], 4)
+        self.assertFalse(OutgoingMessage.objects.exists())
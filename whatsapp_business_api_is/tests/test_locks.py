@@ -0,0 +1,40 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from whatsapp_business_api_is.locks import CacheLock
+
+
+class CacheLockTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = caches['default']
+        self.cache.delete('test_lock')
+        self.addCleanup(self.cache.delete, 'test_lock')
+
+    def test_exclusive(self):
+        lock = CacheLock(self.cache, 'test_lock', 10)
+        other = CacheLock(self.cache, 'test_lock', 10)
+
+        self.assertTrue(lock.acquire(wait=0))
+        self.assertFalse(other.acquire(wait=0))
+        lock.release()
+        self.assertTrue(other.acquire(wait=0))
+
+    def test_does_not_release_the_next_holder_lock(self):
+        lock = CacheLock(self.cache, 'test_lock', 10)
+        self.assertTrue(lock.acquire(wait=0))
+
+        # the lock expired, and another task took it
+        self.cache.set('test_lock', 'other', 10)
+        lock.release()
+        self.assertEqual(self.cache.get('test_lock'), 'other')
+
+    def test_does_not_release_a_lock_that_may_have_expired(self):
+        lock = CacheLock(self.cache, 'test_lock', 10)
+        self.assertTrue(lock.acquire(wait=0))
+
+        with mock.patch('whatsapp_business_api_is.locks.time.monotonic', return_value=lock.expires - 0.5):
+            lock.release()
+        self.assertEqual(self.cache.get('test_lock'), lock.token)
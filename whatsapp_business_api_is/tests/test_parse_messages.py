@@ -0,0 +1,75 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from whatsapp_business_api_is import tasks
+from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
+from whatsapp_business_api_is.exceptions import UserLockedException, ReplyFailedException, RateLimitedException
+
+
+class ParseIncomingMessagesTest(SimpleTestCase):
+    """ The messages of a user that could not be handled now keep their order, in the batch and inline modes """
+
+    def setUp(self):
+        self.parsed = []
+        self.errors = {}  # message id -> exception raised by the parser
+        patchers = [
+            mock.patch.object(WhatsappBusinessApiIsConfig, 'incoming_parser', self.parse),
+            mock.patch.object(tasks.parse_incoming_messages, 'apply_async'),
+            mock.patch.object(tasks.async_send_message, 'apply_async'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def parse(self, raw_msg):
+        self.parsed.append(raw_msg['id'])
+        if error := self.errors.get(raw_msg['id']):
+            raise error
+
+    def reply_failed(self, number):
+        reply_message = mock.Mock(key='reply')
+        return ReplyFailedException(RateLimitedException(429, 'rate limited', 1), number, None, None, reply_message)
+
+    def test_batch_enqueues_the_messages_of_a_locked_user_together(self):
+        self.errors['1'] = UserLockedException('locked')
+        msgs = [{'id': '1', 'from': 'a'}, {'id': '2', 'from': 'b'}, {'id': '3', 'from': 'a'}]
+
+        tasks.parse_incoming_messages(msgs)
+
+        self.assertEqual(self.parsed, ['1', '2'])
+        tasks.parse_incoming_messages.apply_async.assert_called_once_with(
+            ([msgs[0], msgs[2]],), queue=tasks.get_user_queue('a'))
+
+    def test_batch_enqueues_the_next_messages_with_the_failed_reply(self):
+        self.errors['1'] = self.reply_failed('a')
+        msgs = [{'id': '1', 'from': 'a'}, {'id': '2', 'from': 'a'}]
+
+        tasks.parse_incoming_messages(msgs)
+
+        self.assertEqual(self.parsed, ['1'])
+        tasks.parse_incoming_messages.apply_async.assert_not_called()
+        args, kwargs = tasks.async_send_message.apply_async.call_args
+        self.assertEqual(args[1], {'attempt': 1, 'next_msgs': [msgs[1]]})
+
+    def test_inline_leaves_the_messages_of_a_locked_user_to_the_provider(self):
+        self.errors['1'] = UserLockedException('locked')
+        msgs = [{'id': '1', 'from': 'a'}, {'id': '2', 'from': 'b'}, {'id': '3', 'from': 'a'}]
+        handled = []
+
+        with self.assertRaises(UserLockedException):
+            tasks.parse_incoming_messages(msgs, handled=handled)
+
+        self.assertEqual(handled, [msgs[1]])
+        tasks.parse_incoming_messages.apply_async.assert_not_called()
+
+    def test_inline_drops_the_failed_reply_without_a_broker(self):
+        self.errors['1'] = self.reply_failed('a')
+        msgs = [{'id': '1', 'from': 'a'}, {'id': '2', 'from': 'a'}]
+        handled = []
+
+        tasks.parse_incoming_messages(msgs, handled=handled)
+
+        self.assertEqual(self.parsed, ['1', '2'])
+        self.assertEqual(handled, msgs)
+        tasks.async_send_message.apply_async.assert_not_called()
@@ -0,0 +1,67 @@
+import itertools
+import re
+from datetime import date, time
+
+from dateutil.parser import parse
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase
+
+from whatsapp_business_api_is.parsers import parse_date, parse_time
+
+# the validation of `validate_value` before `whatsapp_business_api_is.parsers`
+DATE_PATTERN = re.compile('^(3[01]|[12][0-9]|0?[1-9])[/.-](1[0-2]|0?[1-9])[/.-](?:20)?[0-9]{2}$')
+TIME_PATTERN = re.compile('^(?P<hours>1[0-9]|2[0-3]|0?[0-9])\\D?(?P<minutes>[1-5][0-9]|0?[0-9])$')
+
+
+def original_date(text):
+    if not DATE_PATTERN.match(text):
+        raise ValidationError('Wrong date format')
+    return parse(text, dayfirst=True).date()
+
+
+def original_time(text):
+    if not (m := TIME_PATTERN.match(text)):
+        raise ValidationError('Wrong time format')
+    return time(int(m.group('hours')), int(m.group('minutes')))
+
+
+def outcome(func, text):
+    try:
+        return func(text)
+    except ValidationError:
+        return ValidationError
+    except ValueError:  # dateutil raises subclasses
+        return ValueError
+
+
+class ParsersTest(SimpleTestCase):
+    """ The parsers accept the same inputs as the original validation, with the same results """
+
+    def assert_parity(self, original, new, inputs):
+        for text in inputs:
+            self.assertEqual(outcome(new, text), outcome(original, text), text)
+
+    def test_date_parity(self):
+        days = ['0', '1', '9', '01', '10', '29', '31', '32']
+        months = ['0', '1', '2', '02', '12', '13']
+        years = ['23', '99', '75', '76', '00', '2003', '2099', '1999', '2', '202', '20']
+        self.assert_parity(original_date, parse_date,
+                           (f"{day}{sep1}{month}{sep2}{year}{tail}"
+                            for day, month, year in itertools.product(days, months, years)
+                            for sep1, sep2 in itertools.product('/.- ', repeat=2)
+                            for tail in ('', '\n', ' ')))
+
+    def test_time_parity(self):
+        self.assert_parity(original_time, parse_time,
+                           (''.join(chars) for length in range(5)
+                            for chars in itertools.product('0123456789:h \n', repeat=length)))
+
+    def test_samples(self):
+        self.assertEqual(parse_date('31/12/23'), date(2023, 12, 31))
+        self.assertEqual(parse_date('1.2.2024'), date(2024, 2, 1))
+        self.assertRaises(ValueError, parse_date, '29/2/23')
+        self.assertRaises(ValueError, parse_date, '1/2.23')
+        self.assertRaises(ValidationError, parse_date, 'tomorrow')
+        self.assertEqual(parse_time('21h5'), time(21, 5))
+        self.assertEqual(parse_time('0930'), time(9, 30))
+        self.assertRaises(ValidationError, parse_time, '24:00')
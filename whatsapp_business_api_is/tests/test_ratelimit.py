@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.exceptions import ThrottledException
+from whatsapp_business_api_is.ratelimit import RateLimiter, LocalBackend, CacheBackend, RATE_LIMIT_CACHE_KEY
+
+
+@mock.patch.multiple(Conf, RATE_LIMIT=10, RATE_LIMIT_BURST=1, RATE_LIMIT_MIN=1, RATE_LIMIT_DECREASE=0.5,
+                     RATE_LIMIT_INCREASE=1)
+class RateLimiterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter(LocalBackend())
+
+    def test_backs_off_on_429(self):
+        self.limiter.acquire(timeout=0)
+
+        self.limiter.feedback(429)
+
+        self.assertEqual(self.limiter.backend.states['messages']['rate'], 5)
+        with self.assertRaises(ThrottledException):  # no token is left, it comes back at the lower rate
+            self.limiter.acquire(timeout=0)
+
+    def test_rate_does_not_go_below_the_minimum(self):
+        for _ in range(10):
+            self.limiter.feedback(503)
+
+        self.assertEqual(self.limiter.backend.states['messages']['rate'], 1)
+
+    def test_retry_after_pauses_the_sends(self):
+        self.limiter.feedback(429, retry_after=60)
+
+        with self.assertRaises(ThrottledException) as cm:
+            self.limiter.acquire(timeout=1)
+        self.assertGreater(cm.exception.retry_after, 59)
+
+    def test_successes_restore_the_rate(self):
+        self.limiter.feedback(429)
+
+        for _ in range(100):
+            self.limiter.feedback(200)
+
+        self.assertEqual(self.limiter.backend.states['messages']['rate'], 10)
+
+
+@mock.patch.multiple(Conf, RATE_LIMIT=10, RATE_LIMIT_BURST=1)
+class CacheBackendTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = caches[Conf.CACHE_ALIAS]
+        self.lock_key = f"{RATE_LIMIT_CACHE_KEY.format(key='messages')}:lock"
+        self.addCleanup(self.cache.delete_many, [self.lock_key, RATE_LIMIT_CACHE_KEY.format(key='messages')])
+
+    def test_locked_state_gives_no_token(self):
+        backend = CacheBackend()
+        backend.lock_wait = 0
+        limiter = RateLimiter(backend)
+        self.cache.set(self.lock_key, 'someone else', 60)
+
+        with self.assertRaises(ThrottledException):
+            limiter.acquire(timeout=0.1)
+        self.assertIsNone(self.cache.get(RATE_LIMIT_CACHE_KEY.format(key='messages')))
+
+        self.cache.delete(self.lock_key)
+        limiter.acquire(timeout=0)
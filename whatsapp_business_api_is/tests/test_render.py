@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.test import TestCase
+
+from whatsapp_business_api_is.models import MessageStatus, OutgoingMessage, WaUser
+from whatsapp_business_api_is.render import get_objects_in_bulk
+from whatsapp_business_api_is.utils import get_object
+
+STATUS_SPEC = {'model': ['whatsapp_business_api_is', 'MessageStatus'], 'filter': {'user': 'current_user'}}
+
+
+class BulkLookupTest(TestCase):
+
+    def setUp(self):
+        OutgoingMessage.objects.create(key=OutgoingMessage.DEFAULT_STATE)
+        self.users = [WaUser.objects.create(number=number) for number in ('111', '222', '333')]
+        for i, (number, hour) in enumerate([('111', 2), ('111', 1), ('222', 3)]):
+            MessageStatus.objects.create(message_id=str(i), user_id=number, status=1,
+                                         timestamp=datetime(2023, 1, 1, hour, tzinfo=timezone.utc))
+
+    def assert_same_as_get_object(self, spec):
+        with self.assertNumQueries(1):
+            objects = get_objects_in_bulk(self.users, spec)
+        self.assertEqual(objects, [get_object(user, spec) for user in self.users])
+        return objects
+
+    def test_same_objects_as_get_object(self):
+        objects = self.assert_same_as_get_object(STATUS_SPEC)
+
+        self.assertEqual([obj and obj.message_id for obj in objects], ['0', '2', None])
+
+    def test_keeps_the_model_ordering(self):
+        with mock.patch.object(MessageStatus._meta, 'ordering', ['timestamp']):
+            objects = self.assert_same_as_get_object(STATUS_SPEC)
+
+        self.assertEqual([obj and obj.message_id for obj in objects], ['1', '2', None])
+
+    def test_user_lookups_do_not_hit_the_db(self):
+        spec = {'model': ['whatsapp_business_api_is', 'WaUser'], 'filter': {'number': 'current_user#number'}}
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_objects_in_bulk(self.users, spec), self.users)
@@ -0,0 +1,117 @@
+from django.test import TestCase
+
+from whatsapp_business_api_is.flow import get_flow
+from whatsapp_business_api_is.models import OutgoingMessage, IncomingMessage, WaUser
+from whatsapp_business_api_is.skip_chain import walk_skip_chain
+from whatsapp_business_api_is.utils import get_unique_objects
+
+WA_USER = ['whatsapp_business_api_is', 'WaUser']
+CURRENT_USER = {'number': 'current_user#number'}
+
+
+def skippable(key, field, next_message, filters=None):
+    return OutgoingMessage.objects.create(key=key, skip_if_exists={
+        'model': WA_USER,
+        'filter': filters or CURRENT_USER,
+        'field': field,
+        'next_message': next_message,
+    })
+
+
+class WalkSkipChainTest(TestCase):
+
+    def setUp(self):
+        OutgoingMessage.objects.create(key=OutgoingMessage.DEFAULT_STATE)
+        OutgoingMessage.objects.create(key='done')
+        self.user = WaUser.objects.create(number='111')
+
+    def walk(self, key):
+        return walk_skip_chain(self.user, get_flow().get_message(key))
+
+    def test_stops_at_the_first_message_without_data(self):
+        skippable('ask_name', 'name', 'ask_email')
+        skippable('ask_email', 'email', 'done')
+
+        self.assertEqual(self.walk('ask_name').key, 'ask_name')
+
+    def test_skips_the_messages_with_data(self):
+        skippable('ask_name', 'name', 'ask_email')
+        skippable('ask_email', 'email', 'done')
+        WaUser.objects.filter(number='111').update(name='Dana')
+
+        self.assertEqual(self.walk('ask_name').key, 'ask_email')
+
+    def test_dangling_next_message(self):
+        skippable('ask_name', 'name', 'no_such_message')
+        WaUser.objects.filter(number='111').update(name='Dana')
+
+        self.assertIsNone(self.walk('ask_name'))
+
+    def test_default_response_without_reply(self):
+        ask_name = OutgoingMessage.objects.create(key='ask_name')
+        IncomingMessage.objects.create(key='name_response', type='text', message=ask_name, reply=None,
+                                       is_default=True,
+                                       actions={'save_data': {'model': WA_USER, 'filter': CURRENT_USER,
+                                                              'field': 'name'}})
+        WaUser.objects.filter(number='111').update(name='Dana')
+
+        self.assertIsNone(self.walk('ask_name'))
+
+    def test_bad_filter_of_a_message_that_is_not_reached(self):
+        skippable('ask_name', 'name', 'ask_other')
+        skippable('ask_other', 'name', 'done', filters={'no_such_field': 'x'})
+
+        self.assertEqual(self.walk('ask_name').key, 'ask_name')
+
+    def test_bad_filter_of_a_reached_message(self):
+        skippable('ask_name', 'name', 'ask_other')
+        skippable('ask_other', 'name', 'done', filters={'no_such_field': 'x'})
+        WaUser.objects.filter(number='111').update(name='Dana')
+
+        self.assertEqual(self.walk('ask_name').key, 'ask_other')
+
+    def test_lookups_that_are_not_unique_are_fetched_when_reached(self):
+        skippable('ask_name', 'name', 'ask_other')
+        skippable('ask_other', 'name', 'done', filters={'name': 'Dana'})
+        message = get_flow().get_message('ask_name')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(walk_skip_chain(self.user, message).key, 'ask_name')
+
+    def test_unique_lookups_are_fetched_together(self):
+        WaUser.objects.create(number='222', name='Noa')
+        skippable('ask_name', 'name', 'ask_friend')
+        skippable('ask_friend', 'name', 'done', filters={'number': '222'})
+        WaUser.objects.filter(number='111').update(name='Dana')
+        message = get_flow().get_message('ask_name')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(walk_skip_chain(self.user, message).key, 'done')
+
+
+class GetUniqueObjectsTest(TestCase):
+
+    def setUp(self):
+        OutgoingMessage.objects.create(key=OutgoingMessage.DEFAULT_STATE)
+        self.user = WaUser.objects.create(number='111')
+
+    def test_leaves_out_lookups_that_are_not_unique(self):
+        objects = get_unique_objects(self.user, {
+            'user': {'model': WA_USER, 'filter': CURRENT_USER},
+            'by_name': {'model': WA_USER, 'filter': {'name': ''}},
+        })
+
+        self.assertEqual(objects, {'user': self.user})
+
+    def test_missing_object(self):
+        objects = get_unique_objects(self.user, {'user': {'model': WA_USER, 'filter': {'number': '999'}}})
+
+        self.assertEqual(objects, {'user': None})
+
+    def test_leaves_out_failing_specs(self):
+        objects = get_unique_objects(self.user, {
+            'model': {'model': ['whatsapp_business_api_is', 'NoSuchModel'], 'filter': CURRENT_USER},
+            'user': {'model': WA_USER, 'filter': CURRENT_USER},
+        })
+
+        self.assertEqual(objects, {'user': self.user})
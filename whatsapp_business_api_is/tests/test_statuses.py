@@ -0,0 +1,38 @@
+from django.test import TestCase
+
+from whatsapp_business_api_is.models import MessageStatus, OutgoingMessage, WaUser
+from whatsapp_business_api_is.statuses import StatusBuffer
+
+
+def status(message_id, name='delivered', recipient_id='111'):
+    return {'id': message_id, 'status': name, 'recipient_id': recipient_id, 'timestamp': '1672531200'}
+
+
+class StatusBufferTest(TestCase):
+
+    def setUp(self):
+        OutgoingMessage.objects.create(key=OutgoingMessage.DEFAULT_STATE)
+        WaUser.objects.create(number='111')
+        self.buffer = StatusBuffer(batch_size=3, interval=3600)
+        self.addCleanup(self.buffer.close)
+
+    def test_writes_full_batches(self):
+        self.buffer.add([status('1'), status('2')])
+        self.assertEqual(MessageStatus.objects.count(), 0)
+
+        with self.assertNumQueries(3):  # the savepoint, a single insert and its release
+            self.buffer.add([status('3')])
+        self.assertEqual(MessageStatus.objects.count(), 3)
+
+    def test_flush_writes_the_rest(self):
+        self.buffer.add([status('1')])
+
+        self.buffer.flush()
+
+        self.assertEqual(MessageStatus.objects.count(), 1)
+
+    def test_failures_are_counted_once(self):
+        self.buffer.add([status('1', 'failed'), status('2', 'failed'), status('1', 'failed')])
+
+        self.assertEqual(WaUser.objects.get(number='111').delivery_failure_count, 2)
+        self.assertEqual(MessageStatus.objects.count(), 2)
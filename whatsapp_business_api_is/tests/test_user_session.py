@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
+from whatsapp_business_api_is.models import OutgoingMessage, WaUser
+from whatsapp_business_api_is.user_session import user_session, save_user, refresh_user
+from whatsapp_business_api_is.utils import set_state
+
+
+class UserSessionTest(TestCase):
+
+    def setUp(self):
+        OutgoingMessage.objects.create(key=OutgoingMessage.DEFAULT_STATE)
+        OutgoingMessage.objects.create(key='ask_name')
+        OutgoingMessage.objects.create(key='ask_email')
+        self.user = WaUser.objects.get(number=WaUser.objects.create(number='111').number)
+
+    def test_changes_are_written_once(self):
+        with self.assertNumQueries(1):
+            with user_session(self.user):
+                self.user.name = 'Dana'
+                save_user(self.user, 'name')
+                self.user.failure_count = 2
+                save_user(self.user, 'failure_count')
+
+        user = WaUser.objects.get(number='111')
+        self.assertEqual((user.name, user.failure_count), ('Dana', 2))
+
+    def test_refresh_keeps_the_pending_changes(self):
+        with user_session(self.user):
+            self.user.name = 'Dana'
+            save_user(self.user, 'name')
+            WaUser.objects.filter(number='111').update(email='dana@example.com')
+
+            refresh_user(self.user, force=True)
+
+            self.assertEqual((self.user.name, self.user.email), ('Dana', 'dana@example.com'))
+        self.assertEqual(WaUser.objects.get(number='111').name, 'Dana')
+
+    def test_refresh_drops_the_pending_changes_of_fields_changed_in_the_db(self):
+        with user_session(self.user):
+            self.user.name = 'Dana'
+            save_user(self.user, 'name')
+            WaUser.objects.filter(number='111').update(name='Noa')  # like a function that mutates the user
+
+            refresh_user(self.user, force=True)
+
+            self.assertEqual(self.user.name, 'Noa')
+        self.assertEqual(WaUser.objects.get(number='111').name, 'Noa')
+
+    def test_set_state_hook_runs_after_the_user_is_saved(self):
+        states = []
+
+        def hook(user):
+            states.append(WaUser.objects.get(number=user.number).state_id)
+
+        with mock.patch.object(WhatsappBusinessApiIsConfig, 'set_state', hook):
+            with user_session(self.user):
+                set_state(self.user, OutgoingMessage.objects.get(key='ask_name'))
+                set_state(self.user, OutgoingMessage.objects.get(key='ask_email'))
+                self.assertEqual(states, [])
+
+        self.assertEqual(states, ['ask_email', 'ask_email'])
+
+    def test_save_new_user_without_session(self):
+        user = WaUser(number='222', name='Noa')
+
+        save_user(user, 'name')
+
+        self.assertEqual(WaUser.objects.get(number='222').name, 'Noa')
@@ -15,9 +15,11 @@ Including another URLconf
 """
 from django.urls import path
 
-from whatsapp_business_api_is.views import webhook
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.views import webhook, async_webhook, metrics
 
 urlpatterns = [
-                  path('webhook', webhook),
+                  path('webhook', async_webhook if Conf.ASYNC_WEBHOOK else webhook),
+                  path('metrics', metrics),
               ]
 
@@ -1,68 +1,247 @@
 import logging
 
+from whatsapp_business_api_is import media
 from whatsapp_business_api_is.utils import format_number
 
+# msg type (or "{msg type}.{interactive type}") -> msg class, see `register_msg_type`
+MSG_CLASSES = {}
+
+
+def register_msg_type(msg_type):
+    """
+    Register a msg class for a type of the webhook messages, apps can use it to add types or replace the defaults.
+    e.g.
+    ```
+    @register_msg_type('sticker')
+    class StickerMsg(BaseMsg):
+        __slots__ = ('_sticker_id',)
+
+        @field
+        def sticker_id(self):
+            return self.raw_msg['sticker']['id']
+    ```
+    """
+
+    def decorator(cls):
+        MSG_CLASSES[msg_type] = cls
+        return cls
+
+    return decorator
+
+
+class field:
+    """
+    A field that is extracted from the raw message on first access, and kept in the `_<name>` slot.
+    Each class must declare the slots of its fields.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.slot = f"_{func.__name__}"
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.func(obj)
+            setattr(obj, self.slot, value)
+            return value
+
+
+def _restore_msg(raw_msg, validated_value):
+    msg = msg_factory(raw_msg)
+    msg.validated_value = validated_value
+    return msg
+
 
 class BaseMsg:
+    """
+    A message received from the user.
+    The messages keep only the raw message, the other fields are extracted when they are used.
+    They are pickled as the raw message (and the validated value).
+    """
+
+    __slots__ = ('raw_msg', 'validated_value')
+
     def __init__(self, msg):
-        self.number = msg['from']
-        self.type = msg['type']
         self.raw_msg = msg
-        self.validated_data = None
+        self.validated_value = None
 
+    @property
+    def number(self):
+        return self.raw_msg['from']
 
+    @property
+    def type(self):
+        return self.raw_msg['type']
+
+    @property
+    def validated_data(self):  # the old name of `validated_value`
+        return self.validated_value
+
+    @validated_data.setter
+    def validated_data(self, value):
+        self.validated_value = value
+
+    def __reduce__(self):
+        return _restore_msg, (self.raw_msg, self.validated_value)
+
+
+@register_msg_type('text')
 class TextMsg(BaseMsg):
-    def __init__(self, msg):
-        super().__init__(msg)
-        self.text = msg['text']['body'].strip().replace(u'\xa0', u' ')  # sometimes a space represent by \xa0
+    __slots__ = ('_text',)
+
+    @field
+    def text(self):
+        return self.raw_msg['text']['body'].strip().replace(u'\xa0', u' ')  # sometimes a space represent by \xa0
 
 
+@register_msg_type('interactive')
 class InteractiveMsg(BaseMsg):
-    def __init__(self, msg):
-        super().__init__(msg)
-        self.button_reply_id = msg['interactive']['button_reply']['id']
+    __slots__ = ('_button_reply_id',)
+
+    @field
+    def button_reply_id(self):
+        return self.raw_msg['interactive']['button_reply']['id']
+
+
+@register_msg_type('interactive.list_reply')
+class ListReplyMsg(BaseMsg):
+    __slots__ = ('_list_reply_id', '_list_reply_title')
+
+    @field
+    def list_reply_id(self):
+        return self.raw_msg['interactive']['list_reply']['id']
+
+    @field
+    def list_reply_title(self):
+        return self.raw_msg['interactive']['list_reply']['title']
+
+    @property
+    def button_reply_id(self):  # the rows of a list are handled like buttons
+        return self.list_reply_id
 
 
+@register_msg_type('button')
 class ButtonMsg(BaseMsg):
-    def __init__(self, msg):
-        super().__init__(msg)
-        self.button_text = msg['button']['text']
-        self.button_payload = msg['button'].get('payload', None)
+    __slots__ = ('_button_text', '_button_payload')
+
+    @field
+    def button_text(self):
+        return self.raw_msg['button']['text']
 
+    @field
+    def button_payload(self):
+        return self.raw_msg['button'].get('payload', None)
 
+
+@register_msg_type('contacts')
 class ContactsMsg(BaseMsg):
     class Contact:
+        __slots__ = ('number', 'name')
+
         def __init__(self, number, name):
             self.number = number
             self.name = name
 
-    def __init__(self, msg):
-        super().__init__(msg)
-        self.contacts = []
-        for contact in msg['contacts']:
+    __slots__ = ('_contacts',)
+
+    @field
+    def contacts(self):
+        contacts = []
+        for contact in self.raw_msg['contacts']:
             if len(contact['phones']) == 1:
                 number = contact['phones'][0]['wa_id'] or format_number(
                     contact['phones'][0]['phone'])  # TODO ignore non whatsapp numbers?
-                self.contacts.append(
+                contacts.append(
                     ContactsMsg.Contact(number, contact['name']['formatted_name']))
+        return contacts
 
 
-class ImagesMsg(BaseMsg):
-    def __init__(self, msg):
-        super().__init__(msg)
-        self.image_id = msg['image']['id']
+class MediaMsg(BaseMsg):
+    __slots__ = ()
+
+    @property
+    def media_id(self):
+        return self.raw_msg[self.type]['id']
+
+    @property
+    def caption(self):
+        return self.raw_msg[self.type].get('caption')
+
+    def open_media(self):
+        """ Return a read only file object of the media (see `whatsapp_business_api_is.media.open_media`) """
+        return media.open_media(self.media_id)
+
+
+@register_msg_type('image')
+class ImagesMsg(MediaMsg):
+    __slots__ = ()
+
+    @property
+    def image_id(self):
+        return self.media_id
+
+
+@register_msg_type('document')
+class DocumentMsg(MediaMsg):
+    __slots__ = ()
+
+    @property
+    def document_id(self):
+        return self.media_id
+
+    @property
+    def filename(self):
+        return self.raw_msg['document'].get('filename')
+
+    @property
+    def mime_type(self):
+        return self.raw_msg['document'].get('mime_type')
+
+
+@register_msg_type('location')
+class LocationMsg(BaseMsg):
+    __slots__ = ()
+
+    @property
+    def latitude(self):
+        return self.raw_msg['location']['latitude']
+
+    @property
+    def longitude(self):
+        return self.raw_msg['location']['longitude']
+
+    @property
+    def name(self):
+        return self.raw_msg['location'].get('name')
+
+    @property
+    def address(self):
+        return self.raw_msg['location'].get('address')
+
+
+@register_msg_type('reaction')
+class ReactionMsg(BaseMsg):
+    __slots__ = ()
+
+    @property
+    def emoji(self):
+        return self.raw_msg['reaction'].get('emoji')
+
+    @property
+    def reacted_message_id(self):
+        return self.raw_msg['reaction']['message_id']
 
 
 def msg_factory(msg):
-    msg_classes = {
-        'text': TextMsg,
-        'interactive': InteractiveMsg,
-        'button': ButtonMsg,
-        'contacts': ContactsMsg,
-        'image': ImagesMsg
-    }
     msg_type = msg['type']
-    msg_class = msg_classes.get(msg_type, BaseMsg)
-    logging.info(f"Got message with {msg_type=} -> {msg_class=}")
+    msg_class = None
+    if msg_type == 'interactive':
+        msg_class = MSG_CLASSES.get(f"interactive.{msg['interactive'].get('type')}")
+    msg_class = msg_class or MSG_CLASSES.get(msg_type, BaseMsg)
+    logging.info("Got message with msg_type=%s -> msg_class=%s", msg_type, msg_class)
 
     return msg_class(msg)
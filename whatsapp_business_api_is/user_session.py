@@ -0,0 +1,138 @@
+import contextvars
+import logging
+from contextlib import contextmanager
+
+from django.db.models.signals import post_save
+
+from whatsapp_business_api_is.models import WaUser
+
+_current_session = contextvars.ContextVar('wab_is_user_session', default=None)
+
+
+class UserSession:
+    """
+    A unit of work for the `WaUser` that is handled by the current task.
+
+    Changes made by the infrastructure (state, failure_count, saved data) are kept on the user object
+    and written once, when the session ends.
+    The user is read again from the DB when someone else saved the same row during the session, and after the
+    functions that may change the user (which may use `QuerySet.update()`, that sends no signal).
+    A pending change of a field that was changed in the DB in the meantime is dropped, the DB value wins.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.dirty_fields = set()
+        self.stale = False
+        self.cache = {}  # objects read for the user during the task, cleared on any save
+        self.after_flush = []  # callbacks that must see the changes in the DB, like the `set_state` hook
+        self.loaded = self.get_values()  # the DB values of the fields, as last read or written
+
+    def get_values(self, attnames=None):
+        if attnames is None:
+            attnames = [field.attname for field in WaUser._meta.concrete_fields]
+        return {attname: getattr(self.user, attname) for attname in attnames}
+
+    def mark_dirty(self, *fields):
+        self.dirty_fields.update(fields)
+
+    def refresh(self, force=False):
+        if not self.stale and not force:
+            return
+        logging.debug("%s was changed during the session, reloading", self.user)
+        fields = {WaUser._meta.get_field(field).attname: field for field in self.dirty_fields}
+        pending = self.get_values(fields)
+        self.user.refresh_from_db()
+        for attname, value in pending.items():
+            if getattr(self.user, attname) != self.loaded[attname]:
+                logging.debug("%s was changed in the DB, dropping the pending change", fields[attname])
+                self.dirty_fields.discard(fields[attname])
+            else:  # changes that were not flushed yet
+                setattr(self.user, attname, value)
+        self.loaded = self.get_values()
+        self.stale = False
+        self.cache.clear()
+
+    def flush(self):
+        if self.dirty_fields:
+            update_fields = [*self.dirty_fields, 'updated']
+            logging.debug("Saving update_fields=%s of %s", update_fields, self.user)
+            self.dirty_fields.clear()
+            self.user.save(update_fields=update_fields)  # `user_post_save` updates `loaded`
+        callbacks, self.after_flush = self.after_flush, []
+        for callback in callbacks:
+            callback()
+
+
+@contextmanager
+def user_session(user):
+    session = UserSession(user)
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+        session.flush()
+
+
+def get_user_session(user):
+    session = _current_session.get()
+    if session is not None and session.user is user:
+        return session
+    return None
+
+
+def save_user(user, *fields):
+    if session := get_user_session(user):
+        session.mark_dirty(*fields)
+    elif user._state.adding:
+        user.save()
+    else:
+        user.save(update_fields=[*fields, 'updated'])
+
+
+def refresh_user(user, force=False):
+    """ Read the user again if it was changed by someone else, or always with `force` """
+    if session := get_user_session(user):
+        session.refresh(force)
+    else:
+        user.refresh_from_db()
+
+
+def flush_user(user):
+    """ Write the pending changes of the user now """
+    if session := get_user_session(user):
+        session.flush()
+
+
+def after_user_saved(user, callback):
+    """ Run the callback once the pending changes of the user are written (now, when there is no session) """
+    if session := get_user_session(user):
+        session.after_flush.append(callback)
+    else:
+        callback()
+
+
+def any_post_save(sender, instance, **kwargs):
+    if session := _current_session.get():
+        session.cache.clear()
+
+
+def user_post_save(sender, instance, update_fields=None, **kwargs):
+    session = _current_session.get()
+    if session is None or instance.pk != session.user.pk:
+        return
+    if instance is session.user:
+        if update_fields is None:
+            session.dirty_fields.clear()
+            session.loaded = session.get_values()
+        else:
+            session.dirty_fields.difference_update(update_fields)
+            session.loaded.update(session.get_values([WaUser._meta.get_field(field).attname
+                                                       for field in update_fields]))
+    else:
+        session.stale = True
+
+
+post_save.connect(user_post_save, sender=WaUser)
+post_save.connect(any_post_save)
@@ -1,77 +1,49 @@
+import functools
 import logging
 import re
 from datetime import timedelta, time
 
-from dateutil.parser import parse
 from django.apps import apps
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.exceptions import ObjectDoesNotExist, FieldDoesNotExist, ValidationError
+from django.db.models import Model
 
+from whatsapp_business_api_is.actions import get_action_pipeline, is_mutating
 from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
 from whatsapp_business_api_is.conf import Conf
-from whatsapp_business_api_is.models import TYPE_USER_START, IncomingMessage, WaUser
+from whatsapp_business_api_is.flow import get_flow
+from whatsapp_business_api_is.metrics import span
+from whatsapp_business_api_is.models import IncomingMessage, WaUser
+from whatsapp_business_api_is.parsers import parse_date, parse_time
+from whatsapp_business_api_is.user_session import get_user_session, save_user, refresh_user, after_user_saved
+from whatsapp_business_api_is.validation import get_validation_chain
 
 UUID_PATTERN = re.compile('id:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
-TIME_PATTERN = re.compile('^(?P<hours>1[0-9]|2[0-3]|0?[0-9])\D?(?P<minutes>[1-5][0-9]|0?[0-9])$')
-DATE_PATTERN = re.compile('^(3[01]|[12][0-9]|0?[1-9])[/.-](1[0-2]|0?[1-9])[/.-](?:20)?[0-9]{2}$')
 
 
 def get_user(number):
     try:
         user = WaUser.objects.filter(number=number).first()
-        logging.info(f'Got {user=}')
+        logging.info('Got user=%s', user)
     except ObjectDoesNotExist:
         user = None
     return user
 
 
 def get_start_message(pattern):
-    start_message = IncomingMessage.objects.filter(type=TYPE_USER_START,
-                                                     pattern=pattern).first()
+    start_message = get_flow().match_start(pattern)
     return start_message
 
 
 def get_date(msg_text):
-    if not DATE_PATTERN.match(msg_text):
-        raise ValidationError('Wrong date format')
-    date = parse(msg_text, dayfirst=True)
-    return date.date()
+    return parse_date(msg_text)
 
 
 def get_time(msg_text):
-    m = TIME_PATTERN.match(msg_text)
-    return time(int(m.group('hours')), int(m.group('minutes')))
+    return parse_time(msg_text)
 
 
 def validate_value(user, msg, msg_obj: 'IncomingMessage'):
-    msg_text = ''
-    try:
-        match msg_obj.type:
-            case 'text':
-                msg_text = msg.text
-                value = msg_text
-            case 'date':
-                msg_text = msg.text
-                value = get_date(msg_text)
-            case 'time':
-                msg_text = msg.text
-                value = get_time(msg_text)
-            case 'number':
-                msg_text = msg.text
-                value = float(msg_text) if '.' in msg_text else int(msg_text)
-            case 'quick_reply':
-                value = msg_obj.key  # validation happens before
-            case 'choices':  # TODO better validation
-                value = msg.text if hasattr(msg, 'text') else msg
-            case _:
-                value = msg
-        msg.validated_value = value
-    except Exception as e:
-        raise ValidationError(f'{msg_text} is not in the correct format for {msg_obj.type}: {e}')
-
-    if msg_obj.validators:
-        for validator in msg_obj.validators:
-            logging.info(f"run validation: {validator}")
-            WhatsappBusinessApiIsConfig.VALIDATORS[validator['name']](user, msg, msg_obj, validator.get('message', ''))
+    get_validation_chain(msg_obj)(user, msg, msg_obj)
 
 
 def format_number(number):
@@ -119,51 +91,109 @@ def parse_filter(row_filters, user):
             else:
                 filters[k] = v
     except Exception as e:
-        logging.error(f" Failed to parse filter: {e}")
+        logging.error(" Failed to parse filter: %s", e)
 
     return filters
 
 
-def _get_object(user, data):
+def _is_session_user(model, filters, user):
+    # the user of the current session is always up-to-date
+    return model is WaUser and get_user_session(user) and filters in ({'number': user.number}, {'pk': user.pk})
+
+
+def get_object(user, data):
     model = apps.get_model(*data['model'])
     filters = parse_filter(data['filter'], user)
+    if _is_session_user(model, filters, user):
+        return user
     obj = model.objects.filter(**filters).first()
-    logging.debug(f"Object found: {model=} {filters=} {obj=}")
+    logging.debug("Object found: model=%s filters=%s obj=%s", model, filters, obj)
     return obj
 
 
+def _get_unique_lookup(model, filters):
+    """ Return (attname, value) for a filter on a single unique field, which matches one object at most """
+    if len(filters) != 1:
+        return None
+    [(name, value)] = filters.items()
+    try:
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+    except FieldDoesNotExist:  # a lookup, like `created__gte`
+        return None
+    if not getattr(field, 'concrete', False) or not field.unique:
+        return None
+    if isinstance(value, Model):
+        value = value.pk
+    try:
+        return field.attname, (field.target_field if field.is_relation else field).to_python(value)
+    except ValidationError:
+        return None
+
+
+def get_unique_objects(user, specs):
+    """
+    Return the objects of the data specs (`{key: spec}`, like `get_object`) that are found by a unique field.
+    The specs that filter a model by the same unique field are fetched together, with one query.
+    The other specs, and the specs that fail, are left out (to be fetched with `get_object` when needed).
+    """
+    objects = {}
+    lookups = {}
+    for key, spec in specs.items():
+        try:
+            model = apps.get_model(*spec['model'])
+            filters = parse_filter(spec['filter'], user)
+            if _is_session_user(model, filters, user):
+                objects[key] = user
+            elif lookup := _get_unique_lookup(model, filters):
+                lookups.setdefault((model, lookup[0]), []).append((key, lookup[1]))
+        except Exception as e:
+            logging.debug("Not prefetching key=%s e=%r", key, e)
+
+    for (model, attname), items in lookups.items():
+        try:
+            found = {getattr(obj, attname): obj
+                     for obj in model.objects.filter(**{f"{attname}__in": {value for _, value in items}})}
+        except Exception as e:
+            logging.debug("Not prefetching model=%s e=%r", model, e)
+            continue
+        for key, value in items:
+            objects[key] = found.get(value)
+    return objects
+
+
 def run_action(action, user, msg, wab_bot_message, data):
     if action_func := WhatsappBusinessApiIsConfig.FUNCTIONS.get(action, None):
-        res = action_func(user, msg, wab_bot_message, data)
-        user.refresh_from_db()
+        with span('run_action', function=action):
+            res = action_func(user, msg, wab_bot_message, data)
+            if is_mutating(action_func):
+                refresh_user(user, force=True)
         return res
     else:
-        logging.info(f"Action '{action}' not found")
+        logging.info("Action '%s' not found", action)
     return None
 
 
 def run_actions(user, msg, wab_bot_message):
     if not wab_bot_message:
         return
-    actions = {wab_bot_message.key: None}
-
-    if wab_bot_message.actions:
-        actions.update(wab_bot_message.actions)
 
-    for action, data in actions.items():
-        logging.info(f'About to run action: {action}')
-        run_action(action, user, msg, wab_bot_message, data)
+    for action, action_func, data, mutates_user in get_action_pipeline(wab_bot_message).steps:
+        logging.info('About to run action: %s', action)
+        with span('run_action', function=action):
+            action_func(user, msg, wab_bot_message, data)
+            if mutates_user:
+                refresh_user(user, force=True)
 
 
 def get_data(user, data):
     obj = None
     if 'model' in data:
-        obj = _get_object(user, data)
+        obj = get_object(user, data)
     if 'action' in data:
         obj = run_action(data.get('action'), user, None, None, data)
     res = getattr(obj, data['field'], None) if 'field' in data else obj
 
-    logging.info(f"{res=}")
+    logging.info("res=%r", res)
 
     return res
 
@@ -171,7 +201,7 @@ def get_data(user, data):
 def set_data(user, data, msg):
     obj = None
     if 'model' in data:
-        obj = _get_object(user, data)
+        obj = get_object(user, data)
     if 'action' in data:
         obj = run_action(data.get('action'), user, msg, None, data)
 
@@ -179,9 +209,12 @@ def set_data(user, data, msg):
         # we want an exception to be thrown if msg is None and data['value'] doesn't exist
         value = data.get('value', msg.validated_value) if msg else data['value']
 
-        logging.info(f"About to save data: {obj=} {data['field']=} {value=}")
+        logging.info("About to save data: obj=%s field=%s value=%r", obj, data['field'], value)
         setattr(obj, data['field'], value)
-        obj.save(update_fields=[data['field']])
+        if isinstance(obj, WaUser):
+            save_user(obj, data['field'])
+        else:
+            obj.save(update_fields=[data['field']])
 
 
 def get_quick_replies_as_flat_list(quick_reply):
@@ -190,46 +223,52 @@ def get_quick_replies_as_flat_list(quick_reply):
 
 def set_state(user, state):
     user.state = state
-    user.save(update_fields=['state'])
+    save_user(user, 'state')
 
-    WhatsappBusinessApiIsConfig.set_state(user)
+    # the hook may read the user from the DB, so it runs once the user is saved (when the message was handled)
+    if hook := WhatsappBusinessApiIsConfig.set_state:
+        after_user_saved(user, functools.partial(hook, user))
 
-    logging.info(f"Set {state=} to {user=}")
+    logging.info("Set state=%s to user=%s", state, user)
 
 
 def is_data_exist(user, message):
     try:
         if message.skip_if_exists:
-            logging.debug(f"use skip_if_exists")
+            logging.debug("use skip_if_exists")
             data = message.skip_if_exists
         else:
-            if not message.responses.exists():
+            responses = get_flow().get_responses(message)
+            if not responses:
                 return False
-            data = message.responses.first().actions.get('save_data')
+            data = responses[0].actions.get('save_data')
             if not data or data.get('do_not_skip', False):
-                logging.debug(f"Do not skip - {'No save_data' if not data else 'do_not_skip'}")
+                logging.debug("Do not skip - %s", 'No save_data' if not data else 'do_not_skip')
                 return False
-        logging.info(f'{data=}')
+        logging.info('data=%s', data)
         value = get_data(user, data)
-        logging.info(f"Found {value=}")
-        if value is None:
-            return False
-        if 'ManyRelatedManager' in str(type(value)):
-            logging.debug(f"{value.exists()=}")
-            return value.exists()
-
-        if 'value' in data:
-            logging.debug(f"{value} == {data['value']}")
-            return value == data['value']
-
-        return value
+        logging.info("Found value=%r", value)
+        return value_exists(value, data)
     except Exception as e:
-        logging.debug(f"Not found {e=}")
+        logging.debug("Not found e=%r", e)
+        return False
+
+
+def value_exists(value, data):
+    if value is None:
         return False
+    if 'ManyRelatedManager' in str(type(value)):
+        return value.exists()
+
+    if 'value' in data:
+        logging.debug("%s == %s", value, data['value'])
+        return value == data['value']
+
+    return value
 
 
 def should_force_next(incoming_message):
     if not incoming_message:
         return False
-    logging.debug(f"{incoming_message.force_next=}")
+    logging.debug("force_next=%s", incoming_message.force_next)
     return incoming_message.force_next
@@ -0,0 +1,70 @@
+import logging
+
+from django.core.exceptions import ValidationError
+
+from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
+from whatsapp_business_api_is.flow import get_flow
+from whatsapp_business_api_is.parsers import parse_date, parse_time, parse_number
+
+
+def _choice_value(msg, msg_obj):
+    return msg.text if hasattr(msg, 'text') else msg  # TODO better validation
+
+
+# IncomingMessage type -> the value of the user message, types of text messages
+TEXT_COERCIONS = {
+    'text': lambda msg, msg_obj: msg.text,
+    'date': lambda msg, msg_obj: parse_date(msg.text),
+    'time': lambda msg, msg_obj: parse_time(msg.text),
+    'number': lambda msg, msg_obj: parse_number(msg.text),
+}
+COERCIONS = {
+    **TEXT_COERCIONS,
+    'quick_reply': lambda msg, msg_obj: msg_obj.key,  # validation happens before
+    'choices': _choice_value,
+}
+
+
+def _any_value(msg, msg_obj):
+    return msg
+
+
+class ValidationChain:
+    """
+    The validation of an IncomingMessage, resolved once: the coercion of its type, then its `validators` in order.
+    The validators are looked up in `validators` (by name), `WhatsappBusinessApiIsConfig.VALIDATORS` by default.
+    """
+
+    def __init__(self, incoming_message, validators=None):
+        validators = WhatsappBusinessApiIsConfig.VALIDATORS if validators is None else validators
+        self.type = incoming_message.type
+        self.coerce = COERCIONS.get(incoming_message.type, _any_value)
+        self.is_text = incoming_message.type in TEXT_COERCIONS
+        self.validators = [(validator['name'], validators.get(validator['name']),
+                            validator.get('message', ''))
+                           for validator in incoming_message.validators or []]
+
+    def __call__(self, user, msg, msg_obj):
+        try:
+            msg.validated_value = self.coerce(msg, msg_obj)
+        except Exception as e:
+            msg_text = getattr(msg, 'text', '') if self.is_text else ''
+            raise ValidationError(f'{msg_text} is not in the correct format for {self.type}: {e}')
+
+        for name, validator, message in self.validators:
+            logging.info("run validation: %s", name)
+            if validator is None:
+                raise KeyError(name)
+            validator(user, msg, msg_obj, message)
+
+
+def get_validation_chain(incoming_message):
+    """ Return the validation of the message, validations of messages of the compiled flow are compiled only once """
+    flow = get_flow()
+    if flow.incoming.get(incoming_message.key) is not incoming_message:
+        return ValidationChain(incoming_message)
+
+    key = ('validation', incoming_message.key)
+    if (chain := flow.compiled.get(key)) is None:
+        chain = flow.compiled[key] = ValidationChain(incoming_message)
+    return chain
@@ -1,12 +1,21 @@
-import json
+import hmac
 import logging
 
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
 from django.db.transaction import non_atomic_requests
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404, HttpResponseNotAllowed
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_GET
 
+from whatsapp_business_api_is import codec
 from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
+from whatsapp_business_api_is.conf import Conf
+from whatsapp_business_api_is.dedup import drop_duplicates, forget_messages
+from whatsapp_business_api_is.metrics import render_all
+from whatsapp_business_api_is.routing import get_user_queue
+from whatsapp_business_api_is.statuses import get_status_buffer, status_key, forget_statuses
+from whatsapp_business_api_is.tasks import parse_incoming_messages, save_statuses
 
 
 @csrf_exempt
@@ -14,18 +23,115 @@ from whatsapp_business_api_is.apps import WhatsappBusinessApiIsConfig
 @non_atomic_requests
 def webhook(request):
     jsondata = request.body
-    data = json.loads(jsondata)
+    data = codec.loads(jsondata)
 
-    logging.info("Data received from Webhook is: ", data)
+    return HttpResponse(handle_webhook(data), content_type="text/plain")
+
+
+@non_atomic_requests
+async def async_webhook(request):
+    """
+    The webhook for ASGI deployments, selected by `Conf.ASYNC_WEBHOOK`.
+    The body is parsed on the event loop (by `Conf.JSON_CODEC`), and the dedup and enqueueing (which talk to the cache and the broker)
+    run in a thread, so a slow broker never blocks the other connections.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    data = codec.loads(request.body)
+
+    return HttpResponse(await _handle_webhook_async(data), content_type="text/plain")
+
+
+async_webhook.csrf_exempt = True  # `csrf_exempt` and `require_POST` wrap the view with a sync function in Django 4.0
+
+
+def handle_webhook(data):
+    """ Enqueue the messages and statuses of a webhook, return the text of the response """
+    logging.info("Data received from Webhook is: %s", data)
+
+    if "statuses" in data:
+        enqueue_statuses(data["statuses"])
 
     if "messages" not in data:
-        return HttpResponse("No messages.", content_type="text/plain")
+        return "No messages."
+
+    if not (messages := drop_duplicates(data["messages"])):
+        return "Duplicate messages."
 
+    enqueued = []
+    try:
+        enqueue_messages(messages, enqueued)
+    except Exception:
+        enqueued_ids = {id(message) for message in enqueued}
+        # let the provider redeliver the messages that were not enqueued (or handled) before the error
+        forget_messages([message for message in messages if id(message) not in enqueued_ids])
+        raise
+
+    return "Message received okay."
+
+
+def _handle_webhook_in_thread(data):
+    """
+    `handle_webhook` for the executor threads of `async_webhook`.
+    Like a sync request, the DB connections of the thread (used by the inline mode and the status buffer)
+    are closed when they are expired or broken, at the start and the end of the request.
+    """
+    close_old_connections()
+    try:
+        return handle_webhook(data)
+    finally:
+        close_old_connections()
+
+
+_handle_webhook_async = sync_to_async(_handle_webhook_in_thread, thread_sensitive=False)
+
+
+def enqueue_messages(messages, enqueued):
+    """ Hand the messages to the incoming parser, adding each message to `enqueued` once it was enqueued (or handled) """
     parser = WhatsappBusinessApiIsConfig.incoming_parser
-    for message in data["messages"]:
-        logging.info("message received")
-        logging.debug(message)
-        parser.delay(message)
-        logging.info("task called")
+    match Conf.WEBHOOK_MODE:
+        case 'inline':
+            logging.debug(messages)
+            parse_incoming_messages(messages, handled=enqueued)
+        case 'batch':
+            logging.debug(messages)
+            batches = {}  # a batch per user queue, so each message is still handled on its user's queue
+            for message in messages:
+                batches.setdefault(get_user_queue(message['from']), []).append(message)
+            for queue, batch in batches.items():
+                parse_incoming_messages.apply_async((batch,), queue=queue)
+                enqueued.extend(batch)
+            logging.info("task called for %s messages", len(messages))
+        case _:
+            for message in messages:
+                logging.info("message received")
+                logging.debug(message)
+                parser.apply_async((message,), queue=get_user_queue(message['from']))
+                enqueued.append(message)
+                logging.info("task called")
+
+
+def enqueue_statuses(statuses):
+    if not Conf.STATUS_INGESTION or not (statuses := drop_duplicates(statuses, key=status_key)):
+        return
+    try:
+        match Conf.STATUS_INGESTION:
+            case 'buffer':
+                get_status_buffer().add(statuses)
+            case 'task':
+                save_statuses.delay(statuses)
+            case _:
+                raise ValueError(f"Unknown Conf.STATUS_INGESTION: {Conf.STATUS_INGESTION}")
+    except Exception:
+        forget_statuses(statuses)  # let the provider redeliver them
+        raise
+
 
-    return HttpResponse("Message received okay.", content_type="text/plain")
\ No newline at end of file
+@require_GET
+def metrics(request):
+    """ The metrics of all the processes (see `whatsapp_business_api_is.metrics.publish`), for Prometheus """
+    if not Conf.METRICS_ENABLED or not Conf.METRICS_TOKEN:
+        raise Http404("Metrics are disabled")
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {Conf.METRICS_TOKEN}"):
+        return HttpResponse("Unauthorized", status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(render_all(), content_type="text/plain; version=0.0.4")